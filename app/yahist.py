@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Yahoo!ストアの購入履歴情報を収集して，Excel ファイルとして出力します．
+Yahoo!ストアの購入履歴情報を収集して，Excel ファイル等として出力します．
 
 Usage:
-  yahist.py [-c CONFIG] [-e] [-N]
+  yahist.py [-c CONFIG] [-e] [-N] [-f FORMAT]
 
 Options:
   -c CONFIG    : CONFIG を設定ファイルとして読み込んで実行します．[default: config.yaml]
   -e           : データ収集は行わず，Excel ファイルの出力のみ行います．
   -N            : サムネイル画像を含めないようにします．
+  -f FORMAT    : 出力形式 (excel, csv, jsonl, parquet) を指定します．[default: excel]
 """
 
 import logging
@@ -18,6 +19,7 @@ import random
 import store_yahoo.handle
 import store_yahoo.crawler
 import store_yahoo.order_history
+import store_yahoo.order_export
 import local_lib.selenium_util
 
 NAME = "yahist"
@@ -35,15 +37,18 @@ def execute_fetch(handle):
         raise
 
 
-def execute(config, is_export_mode=False, is_need_thumb=True):
+def execute(config, is_export_mode=False, is_need_thumb=True, export_format="excel"):
     handle = store_yahoo.handle.create(config)
 
     try:
         if not is_export_mode:
             execute_fetch(handle)
-        store_yahoo.order_history.generate_table_excel(
-            handle, store_yahoo.handle.get_excel_file_path(handle), is_need_thumb
-        )
+        if export_format == "excel":
+            store_yahoo.order_history.generate_table_excel(
+                handle, store_yahoo.handle.get_excel_file_path(handle), is_need_thumb
+            )
+        else:
+            store_yahoo.order_export.generate_table_export(handle, export_format)
 
         store_yahoo.handle.finish(handle)
     except:
@@ -68,7 +73,8 @@ if __name__ == "__main__":
     config_file = args["-c"]
     is_export_mode = args["-e"]
     is_need_thumb = not args["-N"]
+    export_format = args["-f"]
 
     config = local_lib.config.load(args["-c"])
 
-    execute(config, is_export_mode, is_need_thumb)
+    execute(config, is_export_mode, is_need_thumb, export_format)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+辞書をいくつかのセクションに分けて，セクション毎に符号化して保存します．
+読み込み時は，セクションに含まれるキーに初めてアクセスした時に復号します．
+
+Usage:
+  container.py [-n COUNT]
+
+Options:
+  -n COUNT      : ベンチマークに使う商品の数．[default: 100000]
+"""
+
+import collections.abc
+import io
+import lzma
+import pickle
+import struct
+import zlib
+
+MAGIC = b"YHCNTR01"
+HEADER_SIZE = struct.Struct("<I")
+
+META_SECTION = "meta"
+
+CODEC = {
+    "pickle": {
+        "encode": lambda data: pickle.dumps(data, protocol=5),
+        "decode": lambda buf: pickle.loads(buf),
+    },
+    "zlib": {
+        "encode": lambda data: zlib.compress(pickle.dumps(data, protocol=5), 6),
+        "decode": lambda buf: pickle.loads(zlib.decompress(buf)),
+    },
+    "lzma": {
+        "encode": lambda data: lzma.compress(pickle.dumps(data, protocol=5), preset=6),
+        "decode": lambda buf: pickle.loads(lzma.decompress(buf)),
+    },
+}
+
+
+class LazyData(collections.abc.MutableMapping):
+    def __init__(self, section_map={}):
+        self.data = {}
+        self.section = {}
+        self.key_section = {}
+
+        for name, section in section_map.items():
+            self.section[name] = section
+            for key in section["key"]:
+                self.key_section[key] = name
+
+    def decode(self, name):
+        section = self.section.pop(name)
+        for key in section["key"]:
+            self.key_section.pop(key)
+
+        self.data.update(CODEC[section["codec"]]["decode"](section["buf"]))
+
+    def load_key(self, key):
+        if key in self.key_section:
+            self.decode(self.key_section[key])
+
+    def get_raw(self, name, codec, key_list):
+        # NOTE: 未使用のセクションは復号せず，そのままの内容を書き戻せるようにする
+        if name not in self.section:
+            return None
+        if (self.section[name]["codec"] != codec) or (self.section[name]["key"] != key_list):
+            return None
+
+        return self.section[name]["buf"]
+
+    def __getitem__(self, key):
+        self.load_key(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.load_key(key)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.load_key(key)
+        del self.data[key]
+
+    def __contains__(self, key):
+        return (key in self.data) or (key in self.key_section)
+
+    def __iter__(self):
+        yield from list(self.data.keys())
+        yield from list(self.key_section.keys())
+
+    def __len__(self):
+        return len(self.data) + len(self.key_section)
+
+    def __or__(self, other):
+        return dict(self) | dict(other)
+
+    def copy(self):
+        return dict(self)
+
+
+def is_container(buf):
+    return buf[: len(MAGIC)] == MAGIC
+
+
+def dump(data, f, codec="pickle", section_key_map={}):
+    meta_key_list = [
+        key for key in data.keys() if not any(key in key_list for key_list in section_key_map.values())
+    ]
+
+    header = {"codec": codec, "section": []}
+    buf_list = []
+    for name, key_list in list(section_key_map.items()) + [(META_SECTION, meta_key_list)]:
+        key_list = [key for key in key_list if key in data]
+        if len(key_list) == 0:
+            continue
+
+        buf = data.get_raw(name, codec, key_list) if isinstance(data, LazyData) else None
+        if buf is None:
+            buf = CODEC[codec]["encode"]({key: data[key] for key in key_list})
+
+        header["section"].append({"name": name, "key": key_list, "size": len(buf)})
+        buf_list.append(buf)
+
+    header_buf = pickle.dumps(header)
+
+    f.write(MAGIC)
+    f.write(HEADER_SIZE.pack(len(header_buf)))
+    f.write(header_buf)
+    for buf in buf_list:
+        f.write(buf)
+
+
+def load(buf):
+    buf = memoryview(buf)
+
+    offset = len(MAGIC)
+    (header_size,) = HEADER_SIZE.unpack_from(buf, offset)
+    offset += HEADER_SIZE.size
+
+    header = pickle.loads(buf[offset : offset + header_size])
+    offset += header_size
+
+    section_map = {}
+    for section in header["section"]:
+        section_map[section["name"]] = {
+            "codec": header["codec"],
+            "key": section["key"],
+            "buf": buf[offset : offset + section["size"]],
+        }
+        offset += section["size"]
+
+    return LazyData(section_map)
+
+
+if __name__ == "__main__":
+    import datetime
+    import logging
+    import pathlib
+    import random
+    import tempfile
+    import time
+
+    from docopt import docopt
+
+    import local_lib.logger
+    import local_lib.serializer
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    item_count = int(args["-n"])
+    seller_list = ["store-{i}".format(i=i) for i in range(300)]
+    category_list = [
+        ["カテゴリ{i}".format(i=i), "サブカテゴリ{j}".format(j=j)] for i in range(20) for j in range(10)
+    ]
+
+    random.seed(0)
+    item_list = []
+    for i in range(item_count):
+        seller = random.choice(seller_list)
+        item_list.append(
+            {
+                "name": "商品 {i} {rand:x}".format(i=i, rand=random.getrandbits(64)),
+                "price": random.randint(100, 50000),
+                "count": random.randint(1, 3),
+                "url": "https://store.shopping.yahoo.co.jp/{seller}/{i}.html".format(seller=seller, i=i),
+                "id": "{seller}_{i}".format(seller=seller, i=i),
+                "date": datetime.datetime(2010, 1, 1) + datetime.timedelta(minutes=i * 37),
+                "no": "{seller}-{no}".format(seller=seller, no=10000000 + i // 2),
+                "seller": seller,
+                "kind": "normal",
+                "category": random.choice(category_list),
+            }
+        )
+
+    data = {
+        "year_list": list(range(2010, 2025)),
+        "year_count": {year: item_count // 15 for year in range(2010, 2025)},
+        "year_stat": {year: True for year in range(2010, 2025)},
+        "page_stat": {year: {page: True for page in range(1, 400)} for year in range(2010, 2025)},
+        "item_list": item_list,
+        "order_no_stat": {item["no"]: True for item in item_list},
+        "thumb_stat": {item["id"]: {"content_type": "image/jpeg", "size": 4096} for item in item_list},
+        "last_modified": datetime.datetime.now(),
+    }
+    section_key_map = {
+        "item": ["item_list"],
+        "order": ["order_no_stat"],
+        "thumb": ["thumb_stat"],
+        "page": ["page_stat", "year_stat"],
+    }
+
+    logging.info("{count:,} items".format(count=item_count))
+    logging.info(
+        "{codec:>12s} {size:>12s} {store:>10s} {load:>10s} {meta:>10s} {item:>10s}".format(
+            codec="codec",
+            size="size [KB]",
+            store="store [s]",
+            load="load [s]",
+            meta="meta [s]",
+            item="items [s]",
+        )
+    )
+
+    start = time.perf_counter()
+    buf = pickle.dumps(data)
+    store_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pickle.loads(buf)
+    load_sec = time.perf_counter() - start
+
+    logging.info(
+        "{codec:>12s} {size:>12,.0f} {store:>10.3f} {load:>10.3f} {meta:>10.3f} {item:>10.3f}".format(
+            codec="(serializer)",
+            size=len(buf) / 1024,
+            store=store_sec,
+            load=load_sec,
+            meta=load_sec,
+            item=load_sec,
+        )
+    )
+
+    for codec in CODEC.keys():
+        f = io.BytesIO()
+
+        start = time.perf_counter()
+        dump(data, f, codec, section_key_map)
+        store_sec = time.perf_counter() - start
+
+        buf = f.getvalue()
+
+        start = time.perf_counter()
+        lazy_data = load(buf)
+        assert lazy_data["year_count"] == data["year_count"]
+        meta_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        assert len(lazy_data["item_list"]) == item_count
+        item_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in data.keys():
+            lazy_data[key]
+        load_sec = meta_sec + item_sec + (time.perf_counter() - start)
+
+        assert dict(lazy_data) == data
+
+        logging.info(
+            "{codec:>12s} {size:>12,.0f} {store:>10.3f} {load:>10.3f} {meta:>10.3f} {item:>10.3f}".format(
+                codec=codec,
+                size=len(buf) / 1024,
+                store=store_sec,
+                load=load_sec,
+                meta=meta_sec,
+                item=meta_sec + item_sec,
+            )
+        )
+
+    # NOTE: 触っていないセクションは復号せずに書き戻せる
+    lazy_data = load(buf)
+    lazy_data["last_modified"] = datetime.datetime.now()
+    f = io.BytesIO()
+    dump(lazy_data, f, codec, section_key_map)
+    assert "thumb" in lazy_data.section
+    assert dict(load(f.getvalue())) == data | {"last_modified": lazy_data["last_modified"]}
+
+    # NOTE: serializer 経由で読み込んで保存しても，item_list は復号されずに元の内容が書き戻される
+    file_path = pathlib.Path(tempfile.mkdtemp(), "cache.dat")
+    local_lib.serializer.store(file_path, data, codec, section_key_map)
+    item_buf = bytes(load(file_path.read_bytes()).section["item"]["buf"])
+
+    lazy_data = local_lib.serializer.load(file_path, {"watermark": None})
+    lazy_data["last_modified"] = datetime.datetime.now()
+    local_lib.serializer.store(file_path, lazy_data, codec, section_key_map)
+    assert "item" in lazy_data.section
+    assert bytes(load(file_path.read_bytes()).section["item"]["buf"]) == item_buf
+
+    logging.info("OK")
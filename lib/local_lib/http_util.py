@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Selenium のセッションを引き継いで，HTTP で直接ページを取得します．
+
+Usage:
+  http_util.py
+"""
+
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+
+import requests
+import requests.adapters
+import urllib3.util.retry
+
+import local_lib.selenium_util
+import local_lib.pacing
+
+POOL_SIZE = 8
+TIMEOUT_SEC = 30
+RETRY_COUNT = 2
+
+
+def create_session(agent_name=local_lib.selenium_util.AGENT_NAME, pool_size=POOL_SIZE):
+    session = requests.Session()
+
+    # NOTE: 同じホストへの接続を使い回すため，コネクションプールを持つアダプタを使う
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=urllib3.util.retry.Retry(
+            total=RETRY_COUNT, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.headers.update(
+        {
+            "User-Agent": agent_name,
+            "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
+        }
+    )
+
+    return session
+
+
+def import_cookie(session, cookie_list):
+    for cookie in cookie_list:
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain"),
+            path=cookie.get("path", "/"),
+            secure=cookie.get("secure", False),
+        )
+
+    logging.debug("Import {count} cookies".format(count=len(cookie_list)))
+
+
+class throttle:
+    # NOTE: 複数スレッドから使っても，同時接続数とリクエストの頻度が上限を超えないようにする
+    def __init__(self, concurrency=1, limiter=None):
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.limiter = limiter
+
+    def __enter__(self):
+        self.semaphore.acquire()
+
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.semaphore.release()
+
+
+def fetch(session, url, timeout=TIMEOUT_SEC, limit=None):
+    if limit is None:
+        res = session.get(url, timeout=timeout)
+    else:
+        with limit:
+            res = session.get(url, timeout=timeout)
+
+    res.raise_for_status()
+
+    return res
+
+
+def fetch_content(session, url, content_type_prefix="image/", timeout=TIMEOUT_SEC, limit=None):
+    res = fetch(session, url, timeout, limit)
+
+    content_type = res.headers.get("Content-Type", "")
+    if not content_type.startswith(content_type_prefix):
+        raise ValueError("Unexpected content type: {content_type}".format(content_type=content_type))
+
+    return (res.content, {"content_type": content_type, "size": len(res.content)})
+
+
+def write_file(file_path, buf):
+    # NOTE: 途中で中断しても壊れたファイルが残らないように，一時ファイルに書いてから置き換える
+    file_path = pathlib.Path(file_path)
+    f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), delete=False)
+    try:
+        f.write(buf)
+        f.close()
+        os.replace(f.name, file_path)
+    except:
+        f.close()
+        os.unlink(f.name)
+        raise
+
+
+def download(session, url, file_path, content_type_prefix="image/", timeout=TIMEOUT_SEC, limit=None):
+    content, stat = fetch_content(session, url, content_type_prefix, timeout, limit)
+
+    write_file(file_path, content)
+
+    return stat
+
+
+if __name__ == "__main__":
+    import http.server
+
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (self.headers.get("Cookie") or "").encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    session = create_session()
+    import_cookie(session, [{"name": "B", "value": "test", "domain": "127.0.0.1", "path": "/"}])
+
+    url = "http://127.0.0.1:{port}/".format(port=server.server_address[1])
+    limit = throttle(2, local_lib.pacing.RateLimiter(rate=10))
+    for _ in range(3):
+        assert fetch(session, url, limit=limit).text == "B=test"
+
+    server.shutdown()
+    logging.info("OK")
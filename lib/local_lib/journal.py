@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+データの変更を追記型のジャーナルに記録し，定期的にスナップショットへまとめます．
+
+スナップショットは serializer と同じ pickle 形式です．
+ジャーナルの各レコードには CRC を付けてあり，書き込み途中で中断した末尾は読み捨てます．
+
+Usage:
+  journal.py
+"""
+
+import collections.abc
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import traceback
+import zlib
+
+import local_lib.serializer
+
+COMPACT_COUNT = 2000
+
+SEQ_KEY = "journal_seq"
+RECORD_HEADER = struct.Struct("<II")
+
+
+def get_journal_path(file_path):
+    return file_path.with_name(file_path.name + ".journal")
+
+
+def get_journal_old_path(file_path):
+    return file_path.with_name(file_path.name + ".journal.old")
+
+
+def get_snapshot_old_path(file_path):
+    return file_path.with_suffix(".old")
+
+
+def apply(data, op, path, value=None):
+    # NOTE: 途中の辞書が無い場合は作成する
+    target = data
+    for key in path[:-1]:
+        if isinstance(target, dict):
+            target = target.setdefault(key, {})
+        else:
+            target = target[key]
+
+    if op == "set":
+        target[path[-1]] = value
+    elif op == "append":
+        target[path[-1]].append(value)
+    elif op == "delete":
+        target.pop(path[-1], None)
+    else:
+        raise ValueError("Unknown operation: {op}".format(op=op))
+
+
+def read_record_list(journal_path):
+    if not journal_path.exists():
+        return []
+
+    with open(journal_path, "rb") as f:
+        buf = f.read()
+
+    record_list = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(buf):
+        size, crc = RECORD_HEADER.unpack_from(buf, offset)
+        payload = buf[offset + RECORD_HEADER.size : offset + RECORD_HEADER.size + size]
+
+        if (len(payload) != size) or (zlib.crc32(payload) != crc):
+            logging.warning(
+                "Discard broken journal tail of {file_path} at {offset}".format(
+                    file_path=journal_path, offset=offset
+                )
+            )
+            break
+
+        record_list.append(pickle.loads(payload))
+        offset += RECORD_HEADER.size + size
+
+    return record_list
+
+
+def write_snapshot(file_path, buf):
+    f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), delete=False)
+    try:
+        f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+        # NOTE: 直前のスナップショットは .old として残す．名前を変更すると，置き換えまでの間に
+        # 中断した場合にスナップショットが無くなるので，コピーしてから置き換える
+        if file_path.exists():
+            shutil.copy(file_path, get_snapshot_old_path(file_path))
+
+        os.replace(f.name, file_path)
+    except:
+        f.close()
+        if pathlib.Path(f.name).exists():
+            os.unlink(f.name)
+        raise
+
+
+def open_active(journal):
+    journal["file"] = open(get_journal_path(journal["file_path"]), "ab")
+    journal["count"] = 0
+
+
+def load(file_path, init_value={}):
+    file_path = pathlib.Path(file_path)
+
+    # NOTE: 以前の版ではスナップショットの置き換え中に中断すると .old だけが残るので，そちらを使う
+    if (not file_path.exists()) and get_snapshot_old_path(file_path).exists():
+        logging.warning("Load {file_path} instead".format(file_path=get_snapshot_old_path(file_path)))
+        data = local_lib.serializer.load(get_snapshot_old_path(file_path), init_value)
+    else:
+        data = local_lib.serializer.load(file_path, init_value)
+    snapshot_seq = data.pop(SEQ_KEY, 0)
+
+    journal = {
+        "file_path": file_path,
+        "seq": snapshot_seq,
+        "lock": threading.Lock(),
+        "thread": None,
+    }
+
+    # NOTE: スナップショットに含まれていない変更を再生する
+    replay_count = 0
+    for journal_path in [get_journal_old_path(file_path), get_journal_path(file_path)]:
+        for seq, op, path, value in read_record_list(journal_path):
+            if seq <= snapshot_seq:
+                continue
+            apply(data, op, path, value)
+            journal["seq"] = seq
+            replay_count += 1
+
+    if replay_count != 0:
+        logging.info(
+            "Replay {count} journal records of {file_path}".format(count=replay_count, file_path=file_path)
+        )
+
+    if get_journal_old_path(file_path).exists() or get_journal_path(file_path).exists():
+        # NOTE: 再生した内容をスナップショットにまとめて，ジャーナルを空にしてから使う
+        data[SEQ_KEY] = journal["seq"]
+        write_snapshot(file_path, pickle.dumps(dict(data)))
+        data.pop(SEQ_KEY)
+
+        for journal_path in [get_journal_old_path(file_path), get_journal_path(file_path)]:
+            if journal_path.exists():
+                journal_path.unlink()
+
+    open_active(journal)
+
+    return (journal, data)
+
+
+def update(journal, data, op, path, value=None):
+    with journal["lock"]:
+        apply(data, op, path, value)
+
+        journal["seq"] += 1
+        payload = pickle.dumps((journal["seq"], op, list(path), value))
+
+        journal["file"].write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        journal["file"].write(payload)
+        journal["count"] += 1
+
+
+def copy_state(value):
+    # NOTE: ジャーナルで変更される辞書とリストだけを複製し，値 (ItemRecord 等) は共有する．
+    # まとめ中に値が変更されても，後の set / delete を再生すれば同じ結果になる．
+    if isinstance(value, collections.abc.Mapping):
+        return {key: copy_state(child) for key, child in value.items()}
+    elif isinstance(value, list):
+        return [copy_state(child) for child in value]
+    else:
+        return value
+
+
+def compact_impl(journal, snapshot):
+    try:
+        write_snapshot(journal["file_path"], pickle.dumps(snapshot))
+        get_journal_old_path(journal["file_path"]).unlink()
+    except:
+        logging.error(traceback.format_exc())
+
+
+def compact(journal, data, is_wait=False):
+    if (journal["thread"] is not None) and journal["thread"].is_alive():
+        # NOTE: 前回のまとめ処理が終わっていない
+        return
+
+    logging.debug("Compact journal of {file_path}".format(file_path=journal["file_path"]))
+
+    with journal["lock"]:
+        journal["file"].close()
+        if get_journal_old_path(journal["file_path"]).exists():
+            # NOTE: 前回のまとめ処理が失敗していたら，ジャーナルを連結して残す
+            with open(get_journal_old_path(journal["file_path"]), "ab") as old_file:
+                with open(get_journal_path(journal["file_path"]), "rb") as f:
+                    old_file.write(f.read())
+            get_journal_path(journal["file_path"]).unlink()
+        else:
+            os.replace(get_journal_path(journal["file_path"]), get_journal_old_path(journal["file_path"]))
+
+        # NOTE: ロック中は構造の複製だけを行い，時間のかかる pickle 化と書き込みは裏で行う
+        snapshot = copy_state(data)
+        snapshot[SEQ_KEY] = journal["seq"]
+
+        open_active(journal)
+
+    journal["thread"] = threading.Thread(target=compact_impl, args=(journal, snapshot), daemon=False)
+    journal["thread"].start()
+
+    if is_wait:
+        journal["thread"].join()
+
+
+def store(journal, data):
+    logging.debug("Store journal of {file_path}".format(file_path=journal["file_path"]))
+
+    with journal["lock"]:
+        journal["file"].flush()
+        os.fsync(journal["file"].fileno())
+
+    if journal["count"] >= COMPACT_COUNT:
+        compact(journal, data)
+
+
+def close(journal, data):
+    if journal["count"] != 0:
+        compact(journal, data, is_wait=True)
+    elif journal["thread"] is not None:
+        journal["thread"].join()
+
+    journal["file"].close()
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    init_value = {"item_list": [], "page_stat": {}}
+    file_path = pathlib.Path(tempfile.mkdtemp(), "cache.dat")
+
+    journal, data = load(file_path, init_value)
+    for i in range(COMPACT_COUNT + 10):
+        update(journal, data, "append", ["item_list"], {"no": i})
+    update(journal, data, "set", ["page_stat", 2020, 1], True)
+    update(journal, data, "delete", ["page_stat", 2021])
+    store(journal, data)
+    journal["thread"].join()
+
+    # NOTE: まとめている間の変更は，スナップショットには含まれずジャーナルから再生される
+    compact(journal, data)
+    update(journal, data, "set", ["page_stat", 2020, 2], True)
+    journal["thread"].join()
+    assert local_lib.serializer.load(file_path, init_value)["page_stat"] == {2020: {1: True}}
+    store(journal, data)
+
+    # NOTE: 書き込み途中で中断した状態を再現する
+    with open(get_journal_path(file_path), "ab") as f:
+        f.write(RECORD_HEADER.pack(100, 0) + b"broken")
+
+    journal, data = load(file_path, init_value)
+    assert len(data["item_list"]) == COMPACT_COUNT + 10
+    assert data["page_stat"] == {2020: {1: True, 2: True}}
+    assert not get_journal_old_path(file_path).exists()
+    close(journal, data)
+
+    assert local_lib.serializer.load(file_path, init_value)["page_stat"] == {2020: {1: True, 2: True}}
+
+    # NOTE: スナップショットを .old に移した直後に中断した状態を再現する
+    journal, data = load(file_path, init_value)
+    update(journal, data, "set", ["page_stat", 2022, 1], True)
+    store(journal, data)
+    journal["file"].close()
+    os.replace(get_journal_path(file_path), get_journal_old_path(file_path))
+    os.replace(file_path, get_snapshot_old_path(file_path))
+
+    journal, data = load(file_path, init_value)
+    assert len(data["item_list"]) == COMPACT_COUNT + 10
+    assert data["page_stat"] == {2020: {1: True, 2: True}, 2022: {1: True}}
+    assert file_path.exists()
+    close(journal, data)
+
+    logging.info("OK")
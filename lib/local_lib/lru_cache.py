@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有効期限とサイズ上限を持つ，永続化可能なキャッシュです．
+
+Usage:
+  lru_cache.py
+"""
+
+import collections
+import logging
+import threading
+import time
+
+import local_lib.serializer
+
+
+def create(max_size, ttl_sec, entry=None):
+    cache = {
+        "max_size": max_size,
+        "ttl_sec": ttl_sec,
+        "entry": collections.OrderedDict() if entry is None else collections.OrderedDict(entry),
+        "lock": threading.Lock(),
+        "dirty": False,
+    }
+
+    with cache["lock"]:
+        evict(cache)
+
+    return cache
+
+
+def is_expired(cache, entry, now):
+    return (cache["ttl_sec"] is not None) and (now - entry["time"] > cache["ttl_sec"])
+
+
+def evict(cache):
+    now = time.time()
+    for key in [key for key, entry in cache["entry"].items() if is_expired(cache, entry, now)]:
+        del cache["entry"][key]
+
+    # NOTE: 最近使われていないものから捨てる
+    while len(cache["entry"]) > cache["max_size"]:
+        cache["entry"].popitem(last=False)
+
+
+def get(cache, key):
+    with cache["lock"]:
+        entry = cache["entry"].get(key)
+        if entry is None:
+            return None
+
+        if is_expired(cache, entry, time.time()):
+            del cache["entry"][key]
+            return None
+
+        cache["entry"].move_to_end(key)
+
+        return entry["value"]
+
+
+def put(cache, key, value):
+    with cache["lock"]:
+        cache["entry"][key] = {"time": time.time(), "value": value}
+        cache["entry"].move_to_end(key)
+        cache["dirty"] = True
+
+        while len(cache["entry"]) > cache["max_size"]:
+            cache["entry"].popitem(last=False)
+
+
+def update(cache, key, value):
+    # NOTE: 登録時刻は変えずに値だけ更新する
+    with cache["lock"]:
+        if key not in cache["entry"]:
+            return False
+
+        cache["entry"][key]["value"] |= value
+        cache["dirty"] = True
+
+        return True
+
+
+def is_dirty(cache):
+    # NOTE: 参照による並び順の変化は，書き出すほどの変更とはみなさない
+    return cache["dirty"]
+
+
+def store(file_path, cache):
+    with cache["lock"]:
+        entry = cache["entry"].copy()
+        cache["dirty"] = False
+
+    local_lib.serializer.store(file_path, {"entry": entry})
+
+
+def load(file_path, max_size, ttl_sec):
+    return create(max_size, ttl_sec, local_lib.serializer.load(file_path, {"entry": {}})["entry"])
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    cache = create(2, 60)
+    put(cache, "a", {"v": 1})
+    put(cache, "b", {"v": 2})
+    get(cache, "a")
+    put(cache, "c", {"v": 3})
+
+    assert get(cache, "b") is None
+    assert get(cache, "a") == {"v": 1}
+    assert is_dirty(cache)
+
+    f = tempfile.NamedTemporaryFile()
+    store(pathlib.Path(f.name), cache)
+    assert not is_dirty(cache)
+
+    assert get(load(pathlib.Path(f.name), 2, 60), "c") == {"v": 3}
+    assert get(load(pathlib.Path(f.name), 2, 0), "c") is None
+
+    logging.info("OK")
@@ -1,8 +1,121 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+"""
+openpyxl を使ってエクセルの表を作成します．
+
+Usage:
+  openpyxl_util.py
+"""
+
+import copy
+import datetime
+import hashlib
+import io
+import pathlib
+import zipfile
+
+import openpyxl.cell
 import openpyxl.utils
 import openpyxl.styles
 import openpyxl.drawing.image
+import openpyxl.drawing.spreadsheet_drawing
+import openpyxl.writer.excel
+import openpyxl.packaging.relationship
+import openpyxl.xml.constants
+import openpyxl.xml.functions
+
+
+class CellImage:
+    # NOTE: 行毎には画像への参照と位置だけを保持し，アンカーは書き出す時に作成する
+    __slots__ = ["img", "col", "row", "col_offset_emu", "row_offset_emu"]
+
+    def __init__(self, img, col, row, col_offset_emu, row_offset_emu):
+        self.img = img
+        self.col = col
+        self.row = row
+        self.col_offset_emu = col_offset_emu
+        self.row_offset_emu = row_offset_emu
+
+    def gen_anchor(self):
+        marker_1 = openpyxl.drawing.spreadsheet_drawing.AnchorMarker(
+            col=self.col - 1, row=self.row - 1, colOff=self.col_offset_emu, rowOff=self.row_offset_emu
+        )
+        marker_2 = openpyxl.drawing.spreadsheet_drawing.AnchorMarker(
+            col=self.col, row=self.row, colOff=-self.col_offset_emu, rowOff=-self.row_offset_emu
+        )
+
+        return openpyxl.drawing.spreadsheet_drawing.TwoCellAnchor(_from=marker_1, to=marker_2)
+
+
+class SharedImageExcelWriter(openpyxl.writer.excel.ExcelWriter):
+    # NOTE: 同じ画像は一つのファイルとして格納し，複数のアンカーから参照させる
+    def register_image(self, img):
+        image_map = self.__dict__.setdefault("_image_map", {})
+
+        share_key = getattr(img, "share_key", None)
+        if (share_key is not None) and (share_key in image_map):
+            img._id = image_map[share_key]._id
+            return
+
+        self._images.append(img)
+        img._id = len(self._images)
+        if share_key is not None:
+            image_map[share_key] = img
+
+    def _write_drawing(self, drawing):
+        # NOTE: openpyxl の内部メソッドを置き換えているので，使っていないグラフには対応しない
+        if len(drawing.charts) != 0:
+            raise ValueError("Charts are not supported by SharedImageExcelWriter")
+
+        self._drawings.append(drawing)
+        drawing._id = len(self._drawings)
+
+        # NOTE: アンカーは一つずつ作成して書き出し，全体の XML をメモリ上に作らない
+        rel_list = openpyxl.packaging.relationship.RelationshipList()
+        rel_id_map = {}
+        with self._archive.open(drawing.path[1:], "w", force_zip64=True) as f:
+            f.write('<wsDr xmlns="{ns}">'.format(ns=openpyxl.xml.constants.SHEET_DRAWING_NS).encode("utf-8"))
+            for idx, entry in enumerate(drawing.images, 1):
+                if isinstance(entry, CellImage):
+                    img = entry.img
+                    anchor = entry.gen_anchor()
+                else:
+                    img = entry
+                    anchor = openpyxl.drawing.spreadsheet_drawing._check_anchor(entry)
+
+                self.register_image(img)
+                if img._id not in rel_id_map:
+                    rel_list.append(
+                        openpyxl.packaging.relationship.Relationship(type="image", Target=img.path)
+                    )
+                    rel_id_map[img._id] = "rId{id}".format(id=len(rel_list))
+
+                anchor.pic = drawing._picture_frame(idx)
+                anchor.pic.blipFill.blip.embed = rel_id_map[img._id]
+
+                f.write(openpyxl.xml.functions.tostring(anchor.to_tree()))
+            f.write(b"</wsDr>")
+
+        rels_path = openpyxl.packaging.relationship.get_rels_path(drawing.path)[1:]
+        self._archive.writestr(rels_path, openpyxl.xml.functions.tostring(rel_list.to_tree()))
+        self.manifest.append(drawing)
+
+
+class BufferImage(openpyxl.drawing.image.Image):
+    # NOTE: 画像データはコピーせずに参照だけを保持し，書き出す時に読み出す
+    def __init__(self, buf):
+        super().__init__(io.BytesIO(buf))
+        self.ref = buf
+
+    def _data(self):
+        return bytes(self.ref)
+
+
+def save_book(book, file_path):
+    archive = zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    book.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+
+    SharedImageExcelWriter(book, archive).save()
 
 
 def gen_text_pos(row, col):
@@ -46,142 +159,255 @@ def insert_table_header(sheet, row, sheet_def, base_style):
             )
 
 
-def gen_item_cell_style(base_style, cell_def):
-    style = base_style.copy()
+class ColumnWriter:
+    # NOTE: SHEET_DEF の各列を，値の取り出し方とスタイルに事前に変換したもの
+    __slots__ = ["col", "value_func", "style", "link_func"]
+
+    def __init__(self, col, value_func, style, link_func=None):
+        self.col = col
+        self.value_func = value_func
+        self.style = style
+        self.link_func = link_func
+
+
+def gen_item_style_name(sheet_def, key):
+    return "{label} {key}".format(label=sheet_def["SHEET_TITLE"], key=key)
+
+
+def gen_item_named_style(book, name, base_style, cell_def):
+    if name not in book.named_styles:
+        style = openpyxl.styles.NamedStyle(name=name)
+        style.font = copy.copy(book._named_styles["Normal"].font)
+        style.border = base_style["border"]
+
+        if cell_def is not None:
+            style.alignment = openpyxl.styles.Alignment(wrap_text=cell_def.get("wrap", False), vertical="top")
+            if "format" in cell_def:
+                style.number_format = cell_def["format"]
+
+        book.add_named_style(style)
 
-    if "format" in cell_def:
-        style["text_format"] = cell_def["format"]
+    # NOTE: セル毎にスタイルを解決しなくて済むように，スタイルの配列を使い回す
+    return book._named_styles[name].as_tuple()
 
-    if "wrap" in cell_def:
-        style["text_wrap"] = cell_def["wrap"]
+
+def gen_item_value_func(key, cell_def):
+    if "value" in cell_def:
+        get_func = lambda item: cell_def["value"]
+    elif "formal_key" in cell_def:
+        get_func = lambda item: item[cell_def["formal_key"]]
     else:
-        style["text_wrap"] = False
+        get_func = lambda item: item[key]
 
-    return style
+    if "conv_func" in cell_def:
+        conv_func = lambda item: cell_def["conv_func"](get_func(item))
+    else:
+        conv_func = get_func
 
+    if ("optional" in cell_def) and cell_def["optional"]:
+        return lambda item: conv_func(item) if key in item else None
+    else:
+        return conv_func
 
-def set_item_cell_style(sheet, row, col, value, style):
-    sheet.cell(row, col).value = value
-    sheet.cell(row, col).style = "Normal"
-    sheet.cell(row, col).border = style["border"]
-    sheet.cell(row, col).alignment = openpyxl.styles.Alignment(wrap_text=style["text_wrap"], vertical="top")
 
-    if "text_format" in style:
-        sheet.cell(row, col).number_format = style["text_format"]
+def gen_category_value_func(i):
+    return lambda item: item["category"][i] if i < len(item["category"]) else ""
 
 
-def insert_table_item(sheet, row, item, is_need_thumb, thumb_path, sheet_def, base_style):
-    for key in sheet_def["TABLE_HEADER"]["col"].keys():
-        col = sheet_def["TABLE_HEADER"]["col"][key]["pos"]
+def compile_sheet_def(book, sheet_def, base_style, is_need_thumb):
+    column_list = []
+    image_def = None
 
-        cell_style = gen_item_cell_style(base_style, sheet_def["TABLE_HEADER"]["col"][key])
+    for key, cell_def in sheet_def["TABLE_HEADER"]["col"].items():
+        col = cell_def["pos"]
+        style = gen_item_named_style(
+            book, gen_item_style_name(sheet_def, key), base_style, None if key == "image" else cell_def
+        )
 
         if key == "category":
-            for i in range(sheet_def["TABLE_HEADER"]["col"][key]["length"]):
-                if i < len(item["category"]):
-                    value = item[key][i]
-                else:
-                    value = ""
-                set_item_cell_style(sheet, row, col + i, value, cell_style)
+            for i in range(cell_def["length"]):
+                column_list.append(ColumnWriter(col + i, gen_category_value_func(i), style))
+            continue
         elif key == "image":
-            sheet.cell(row, col).border = cell_style["border"]
+            value_func = None
             if is_need_thumb:
-                insert_table_cell_image(
-                    sheet,
-                    row,
-                    col,
-                    thumb_path,
-                    sheet_def["TABLE_HEADER"]["col"]["image"]["width"],
-                    sheet_def["TABLE_HEADER"]["row"]["height"]["default"],
-                )
+                image_def = {
+                    "col": col,
+                    "width": cell_def["width"],
+                    "height": sheet_def["TABLE_HEADER"]["row"]["height"]["default"],
+                }
         else:
-            if (
-                ("optional" in sheet_def["TABLE_HEADER"]["col"][key])
-                and sheet_def["TABLE_HEADER"]["col"][key]["optional"]
-                and (key not in item)
-            ):
-                value = None
-            else:
-                if "value" in sheet_def["TABLE_HEADER"]["col"][key]:
-                    value = sheet_def["TABLE_HEADER"]["col"][key]["value"]
-                elif "formal_key" in sheet_def["TABLE_HEADER"]["col"][key]:
-                    value = item[sheet_def["TABLE_HEADER"]["col"][key]["formal_key"]]
-                else:
-                    value = item[key]
+            value_func = gen_item_value_func(key, cell_def)
+
+        column_list.append(ColumnWriter(col, value_func, style, cell_def.get("link_func")))
+
+    column_list.sort(key=lambda column: column.col)
+
+    return {
+        "column": column_list,
+        "image": image_def,
+        "col_last": column_list[-1].col,
+    }
+
+
+def conv_digest_value(value):
+    if isinstance(value, dict):
+        return [(key, conv_digest_value(value[key])) for key in value.keys()]
+    elif callable(value) and hasattr(value, "__code__"):
+        return conv_digest_value(value.__code__)
+    elif hasattr(value, "co_code"):
+        # NOTE: 関数は処理内容で比較する (repr にはアドレスが含まれるので使わない)
+        return [value.co_code, value.co_names, [conv_digest_value(const) for const in value.co_consts]]
+    else:
+        return value
+
 
-                if "conv_func" in sheet_def["TABLE_HEADER"]["col"][key]:
-                    value = sheet_def["TABLE_HEADER"]["col"][key]["conv_func"](value)
+def gen_sheet_def_digest(sheet_def, is_need_thumb, font):
+    return hashlib.sha1(
+        repr([conv_digest_value(sheet_def), is_need_thumb, font.name, font.sz]).encode("utf-8")
+    ).digest()
 
-            set_item_cell_style(sheet, row, col, value, cell_style)
 
-        if "link_func" in sheet_def["TABLE_HEADER"]["col"][key]:
-            sheet.cell(row, col).hyperlink = sheet_def["TABLE_HEADER"]["col"][key]["link_func"](item)
+def gen_item_digest(item, column_def, thumb_key=None):
+    # NOTE: thumb_key は画像を区別する値 (画像の内容を読まずに済むように，置き場所等を渡す)
+    value_list = [
+        (
+            None if column.value_func is None else column.value_func(item),
+            None if column.link_func is None else column.link_func(item),
+        )
+        for column in column_def["column"]
+    ]
 
+    if (column_def["image"] is not None) and (thumb_key is not None):
+        value_list.append(thumb_key)
 
-def insert_table_cell_image(sheet, row, col, thumb_path, cell_width, cell_height):
-    if (thumb_path is None) or (not thumb_path.exists()):
+    return hashlib.sha1(repr(value_list).encode("utf-8")).digest()
+
+
+def insert_table_cell_item_image(sheet, row, thumb_path, column_def, image_map=None):
+    if column_def["image"] is None:
         return
 
-    img = openpyxl.drawing.image.Image(thumb_path)
+    insert_table_cell_image(
+        sheet,
+        row,
+        column_def["image"]["col"],
+        thumb_path,
+        column_def["image"]["width"],
+        column_def["image"]["height"],
+        image_map,
+    )
+
+
+def insert_table_item(sheet, row, item, thumb_path, column_def, image_map=None):
+    for column in column_def["column"]:
+        cell = sheet.cell(row, column.col, None if column.value_func is None else column.value_func(item))
+        cell._style = copy.copy(column.style)
+
+        if column.link_func is not None:
+            cell.hyperlink = column.link_func(item)
 
+    insert_table_cell_item_image(sheet, row, thumb_path, column_def, image_map)
+
+
+def get_cell_size(cell_width, cell_height):
     # NOTE: マジックナンバー「8」は下記等を参考にして設定．(日本語フォントだと 8 が良さそう)
     # > In all honesty, I cannot tell you how many blogs and stack overflow answers
     # > I read before I stumbled across this magic number: 7.5
     # https://imranhugo.medium.com/how-to-right-align-an-image-in-excel-cell-using-python-and-openpyxl-7ca75a85b13a
-    cell_width_pix = cell_width * 8
-    cell_height_pix = openpyxl.utils.units.points_to_pixels(cell_height)
+    return (cell_width * 8, openpyxl.utils.units.points_to_pixels(cell_height))
+
+
+def get_cell_content_size(cell_width, cell_height, margin_pix=2):
+    cell_width_pix, cell_height_pix = get_cell_size(cell_width, cell_height)
+
+    return (cell_width_pix - (margin_pix * 2), cell_height_pix - (margin_pix * 2))
+
+
+def gen_image_share_key(thumb_path):
+    if isinstance(thumb_path, pathlib.Path):
+        return str(thumb_path)
+    else:
+        return hashlib.sha1(thumb_path).digest()
+
+
+def load_image(thumb_path, image_map=None):
+    share_key = gen_image_share_key(thumb_path)
+    if (image_map is not None) and (share_key in image_map):
+        # NOTE: 画像データは共有し，アンカーだけを別にする
+        return image_map[share_key]
+
+    if isinstance(thumb_path, pathlib.Path):
+        img = openpyxl.drawing.image.Image(thumb_path)
+    else:
+        # NOTE: ファイルではなく画像データが渡された場合
+        img = BufferImage(thumb_path)
+        if img.format not in ["gif", "jpeg", "png"]:
+            img = openpyxl.drawing.image.Image(io.BytesIO(thumb_path))
+    img.share_key = share_key
+
+    if image_map is not None:
+        image_map[share_key] = img
+
+    return img
+
+
+def insert_table_cell_image(sheet, row, col, thumb_path, cell_width, cell_height, image_map=None):
+    if thumb_path is None:
+        return
+
+    if isinstance(thumb_path, pathlib.Path) and (not thumb_path.exists()):
+        return
+
+    img = load_image(thumb_path, image_map)
+
+    cell_width_pix, cell_height_pix = get_cell_size(cell_width, cell_height)
 
     cell_width_emu = openpyxl.utils.units.pixels_to_EMU(cell_width_pix)
     cell_height_emu = openpyxl.utils.units.pixels_to_EMU(cell_height_pix)
 
-    margin_pix = 2
-    content_width_pix = cell_width_pix - (margin_pix * 2)
-    content_height_pix = cell_height_pix - (margin_pix * 2)
+    content_width_pix, content_height_pix = get_cell_content_size(cell_width, cell_height)
 
     content_ratio = content_width_pix / content_height_pix
     image_ratio = img.width / img.height
 
-    if (img.width > content_width_pix) or (img.height > content_height_pix):
+    image_width_pix, image_height_pix = img.width, img.height
+    if (image_width_pix > content_width_pix) or (image_height_pix > content_height_pix):
         if image_ratio > content_ratio:
             # NOTE: 画像の横幅をセルの横幅に合わせる
-            scale = content_width_pix / img.width
+            scale = content_width_pix / image_width_pix
         else:
             # NOTE: 画像の高さをセルの高さに合わせる
-            scale = content_height_pix / img.height
+            scale = content_height_pix / image_height_pix
 
-        img.width *= scale
-        img.height *= scale
+        image_width_pix *= scale
+        image_height_pix *= scale
 
-    image_width_emu = openpyxl.utils.units.pixels_to_EMU(img.width)
-    image_height_emu = openpyxl.utils.units.pixels_to_EMU(img.height)
+    image_width_emu = openpyxl.utils.units.pixels_to_EMU(image_width_pix)
+    image_height_emu = openpyxl.utils.units.pixels_to_EMU(image_height_pix)
 
     col_offset_emu = (cell_width_emu - image_width_emu) / 2
     row_offset_emu = (cell_height_emu - image_height_emu) / 2
 
-    marker_1 = openpyxl.drawing.spreadsheet_drawing.AnchorMarker(
-        col=col - 1, row=row - 1, colOff=col_offset_emu, rowOff=row_offset_emu
-    )
-    marker_2 = openpyxl.drawing.spreadsheet_drawing.AnchorMarker(
-        col=col, row=row, colOff=-col_offset_emu, rowOff=-row_offset_emu
-    )
-
-    img.anchor = openpyxl.drawing.spreadsheet_drawing.TwoCellAnchor(_from=marker_1, to=marker_2)
+    sheet.add_image(CellImage(img, col, row, col_offset_emu, row_offset_emu))
 
-    sheet.add_image(img)
 
-
-def setting_table_view(sheet, sheet_def, row_last, is_hidden):
+def set_table_column_group(sheet, sheet_def, is_hidden):
     sheet.column_dimensions.group(
         openpyxl.utils.get_column_letter(sheet_def["TABLE_HEADER"]["col"]["image"]["pos"]),
         openpyxl.utils.get_column_letter(sheet_def["TABLE_HEADER"]["col"]["image"]["pos"]),
         hidden=is_hidden,
     )
 
+
+def set_table_freeze_panes(sheet, sheet_def):
     sheet.freeze_panes = gen_text_pos(
         sheet_def["TABLE_HEADER"]["row"]["pos"] + 1,
         sheet_def["TABLE_HEADER"]["col"]["price"]["pos"] + 1,
     )
 
+
+def set_table_auto_filter(sheet, sheet_def, row_last):
     sheet.auto_filter.ref = "{start}:{end}".format(
         start=gen_text_pos(
             sheet_def["TABLE_HEADER"]["row"]["pos"],
@@ -189,9 +415,28 @@ def setting_table_view(sheet, sheet_def, row_last, is_hidden):
         ),
         end=gen_text_pos(row_last, max(map(lambda x: x["pos"], sheet_def["TABLE_HEADER"]["col"].values()))),
     )
+
+
+def setting_table_view(sheet, sheet_def, row_last, is_hidden):
+    set_table_column_group(sheet, sheet_def, is_hidden)
+    set_table_freeze_panes(sheet, sheet_def)
+    set_table_auto_filter(sheet, sheet_def, row_last)
+
     sheet.sheet_view.showGridLines = False
 
 
+def gen_sheet_title(sheet_def):
+    return "{label}アイテム一覧".format(label=sheet_def["SHEET_TITLE"])
+
+
+def gen_base_style():
+    side = openpyxl.styles.Side(border_style="thin", color="000000")
+    border = openpyxl.styles.Border(top=side, left=side, right=side, bottom=side)
+    fill = openpyxl.styles.PatternFill(patternType="solid", fgColor="F2F2F2")
+
+    return {"border": border, "fill": fill}
+
+
 def generate_list_sheet(
     book,
     item_list,
@@ -203,13 +448,9 @@ def generate_list_sheet(
     update_item_func,
 ):
     sheet = book.create_sheet()
-    sheet.title = "{label}アイテム一覧".format(label=sheet_def["SHEET_TITLE"])
+    sheet.title = gen_sheet_title(sheet_def)
 
-    side = openpyxl.styles.Side(border_style="thin", color="000000")
-    border = openpyxl.styles.Border(top=side, left=side, right=side, bottom=side)
-    fill = openpyxl.styles.PatternFill(patternType="solid", fgColor="F2F2F2")
-
-    base_style = {"border": border, "fill": fill}
+    base_style = gen_base_style()
 
     row = sheet_def["TABLE_HEADER"]["row"]["pos"]
 
@@ -225,10 +466,13 @@ def generate_list_sheet(
     else:
         cell_height = sheet_def["TABLE_HEADER"]["row"]["height"]["without_thumb"]
 
+    column_def = compile_sheet_def(book, sheet_def, base_style, is_need_thumb)
+    image_map = {}
+
     row += 1
     for item in item_list:
         sheet.row_dimensions[row].height = cell_height
-        insert_table_item(sheet, row, item, is_need_thumb, thumb_path_func(item), sheet_def, base_style)
+        insert_table_item(sheet, row, item, thumb_path_func(item), column_def, image_map)
         update_item_func()
 
         row += 1
@@ -244,3 +488,212 @@ def generate_list_sheet(
     update_seq_func()
 
     return sheet
+
+
+def get_table_col_last(sheet_def):
+    return max(
+        map(
+            lambda cell_def: cell_def["pos"] + cell_def.get("length", 1) - 1,
+            sheet_def["TABLE_HEADER"]["col"].values(),
+        )
+    )
+
+
+def gen_header_stream_cell(sheet, value, style):
+    cell = openpyxl.cell.WriteOnlyCell(sheet, value)
+    cell.style = "Normal"
+    cell.border = style["border"]
+    cell.fill = style["fill"]
+
+    return cell
+
+
+def gen_table_header_row(sheet, sheet_def, base_style):
+    row_value = [None] * get_table_col_last(sheet_def)
+
+    for key in sheet_def["TABLE_HEADER"]["col"].keys():
+        col = sheet_def["TABLE_HEADER"]["col"][key]["pos"]
+        width = sheet_def["TABLE_HEADER"]["col"][key].get("width")
+
+        if key == "category":
+            label_list = [
+                sheet_def["TABLE_HEADER"]["col"][key]["label"] + " ({i})".format(i=i + 1)
+                for i in range(sheet_def["TABLE_HEADER"]["col"][key]["length"])
+            ]
+        else:
+            label_list = [sheet_def["TABLE_HEADER"]["col"][key]["label"]]
+
+        for i, label in enumerate(label_list):
+            row_value[col + i - 1] = gen_header_stream_cell(sheet, label, base_style)
+
+            if width is not None:
+                sheet.column_dimensions[openpyxl.utils.get_column_letter(col + i)].width = width
+
+    return row_value
+
+
+def gen_table_item_row(sheet, row, item, thumb_path, column_def, image_map=None):
+    row_value = [None] * column_def["col_last"]
+
+    for column in column_def["column"]:
+        cell = openpyxl.cell.WriteOnlyCell(
+            sheet, None if column.value_func is None else column.value_func(item)
+        )
+        cell._style = copy.copy(column.style)
+
+        if column.link_func is not None:
+            cell.hyperlink = column.link_func(item)
+
+        row_value[column.col - 1] = cell
+
+    insert_table_cell_item_image(sheet, row, thumb_path, column_def, image_map)
+
+    return row_value
+
+
+def generate_list_sheet_stream(
+    book,
+    item_list,
+    sheet_def,
+    is_need_thumb,
+    thumb_path_func,
+    set_status_func,
+    update_seq_func,
+    update_item_func,
+    row_start=None,
+    image_map=None,
+):
+    # NOTE: book は openpyxl.Workbook(write_only=True) で作成したもの．
+    # 行は追加した時点で一時ファイルに書き出されるので，商品数によらずメモリ使用量は一定になる．
+    # row_start を指定すると，商品をその行から書き込む (追記用の差分を作る場合)
+    sheet = book.create_sheet(gen_sheet_title(sheet_def))
+
+    base_style = gen_base_style()
+
+    row = sheet_def["TABLE_HEADER"]["row"]["pos"]
+
+    set_status_func("テーブルのヘッダを設定しています...")
+    header_row_value = gen_table_header_row(sheet, sheet_def, base_style)
+
+    # NOTE: 列の幅やウィンドウ枠の固定は，行を書き出す前に設定しておく必要がある
+    set_table_column_group(sheet, sheet_def, not is_need_thumb)
+    set_table_freeze_panes(sheet, sheet_def)
+    sheet.sheet_view.showGridLines = False
+
+    for _ in range(row - 1):
+        sheet.append([])
+    sheet.append(header_row_value)
+
+    update_seq_func()
+
+    set_status_func("{label} - 商品の記載をしています...".format(label=sheet_def["SHEET_TITLE"]))
+
+    if is_need_thumb:
+        cell_height = sheet_def["TABLE_HEADER"]["row"]["height"]["default"]
+    else:
+        cell_height = sheet_def["TABLE_HEADER"]["row"]["height"]["without_thumb"]
+
+    column_def = compile_sheet_def(book, sheet_def, base_style, is_need_thumb)
+    if image_map is None:
+        image_map = {}
+
+    row += 1
+    if row_start is not None:
+        for _ in range(row, row_start):
+            sheet.append([])
+        row = row_start
+
+    for item in item_list:
+        sheet.row_dimensions[row].height = cell_height
+        sheet.append(gen_table_item_row(sheet, row, item, thumb_path_func(item), column_def, image_map))
+        # NOTE: 書き出し済みの行の設定は不要なので残さない
+        del sheet.row_dimensions[row]
+
+        update_item_func()
+
+        row += 1
+
+    row_last = row - 1
+
+    update_item_func()
+    update_seq_func()
+
+    set_status_func("テーブルの表示設定しています...")
+    set_table_auto_filter(sheet, sheet_def, row_last)
+
+    update_seq_func()
+
+    return sheet
+
+
+if __name__ == "__main__":
+    import logging
+    import tempfile
+
+    import PIL.Image
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    # NOTE: SharedImageExcelWriter は openpyxl の内部メソッドを置き換えているので，
+    # openpyxl を更新した際に壊れていないか，書き出したファイルを読み込んで確認する
+    thumb_list = []
+    for i in range(3):
+        buf = io.BytesIO()
+        PIL.Image.new("RGB", (80, 60), (0, i * 100, 0)).save(buf, format="PNG")
+        thumb_list.append(buf.getvalue())
+
+    item_count = 10
+    item_list = [
+        {"name": "商品 {i}".format(i=i), "price": 100 + i, "thumb": thumb_list[i % len(thumb_list)]}
+        for i in range(item_count)
+    ]
+    sheet_def = {
+        "SHEET_TITLE": "テスト",
+        "TABLE_HEADER": {
+            "row": {"pos": 2, "height": {"default": 80, "without_thumb": 25}},
+            "col": {
+                "name": {"label": "商品名", "pos": 2, "width": 70, "format": "@"},
+                "image": {"label": "画像", "pos": 3, "width": 12},
+                "price": {"label": "価格", "pos": 4, "width": 16},
+            },
+        },
+    }
+    temp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    for is_write_only in [False, True]:
+        file_path = temp_dir / "table_{mode}.xlsx".format(mode="stream" if is_write_only else "normal")
+
+        book = openpyxl.Workbook(write_only=is_write_only)
+        generate_list_sheet = generate_list_sheet_stream if is_write_only else generate_list_sheet
+        generate_list_sheet(
+            book,
+            item_list,
+            sheet_def,
+            True,
+            lambda item: item["thumb"],
+            lambda status: None,
+            lambda: None,
+            lambda: None,
+        )
+        if not is_write_only:
+            book.remove(book.worksheets[0])
+        save_book(book, file_path)
+
+        with zipfile.ZipFile(file_path) as archive:
+            media_list = [name for name in archive.namelist() if name.startswith("xl/media/")]
+        assert len(media_list) == len(thumb_list)
+
+        sheet = openpyxl.load_workbook(file_path).worksheets[0]
+        assert sheet.cell(sheet_def["TABLE_HEADER"]["row"]["pos"] + 1, 2).value == item_list[0]["name"]
+        assert len(sheet._images) == item_count
+        for i, img in enumerate(sorted(sheet._images, key=lambda img: img.anchor._from.row)):
+            assert img.anchor._from.row == sheet_def["TABLE_HEADER"]["row"]["pos"] + i
+            assert img.anchor._from.col == sheet_def["TABLE_HEADER"]["col"]["image"]["pos"] - 1
+        assert len(set(map(lambda img: img._data(), sheet._images))) == len(thumb_list)
+
+    logging.info("OK")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+トークンバケットでアクセスの間隔を調整します．
+エラーやチャレンジページが返ってきたら減速し，正常な応答が続いたら加速します．
+
+Usage:
+  pacing.py
+"""
+
+import logging
+import threading
+import time
+
+INCREASE_STEP = 0.05
+DECREASE_RATIO = 0.5
+
+
+class RateLimiter:
+    def __init__(self, rate=1.0, min_rate=0.1, max_rate=4.0, burst=1):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def acquire(self):
+        with self.lock:
+            self.refill()
+
+            if self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+
+            self.tokens -= 1
+
+    def success(self):
+        # NOTE: 加算的に加速し，乗算的に減速する (AIMD)
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + INCREASE_STEP)
+
+    def failure(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * DECREASE_RATIO)
+            self.tokens = min(self.tokens, 0)
+
+        logging.info("Slow down access rate to {rate:.2f} req/s".format(rate=self.rate))
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    limiter = RateLimiter(rate=20, min_rate=5, max_rate=40, burst=1)
+
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    assert time.monotonic() - start >= 9 / 20 * 0.9
+
+    limiter.failure()
+    assert limiter.rate == 10
+
+    for _ in range(1000):
+        limiter.success()
+    assert limiter.rate == 40
+
+    logging.info("OK")
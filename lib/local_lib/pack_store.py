@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小さなファイルを一つのデータファイルにまとめて保存します．
+
+データファイルには追記のみ行い，各レコードはキーと CRC を含むので，
+インデックスが無くても走査して復元できます．読み出しは mmap で行います．
+
+Usage:
+  pack_store.py migrate DIR PACK
+  pack_store.py compact PACK
+  pack_store.py stat PACK
+
+Options:
+  DIR           : 1 ファイル 1 画像の形式で保存されたフォルダ．
+  PACK          : まとめたデータファイル．
+"""
+
+import logging
+import mmap
+import os
+import pathlib
+import pickle
+import struct
+import tempfile
+import threading
+import uuid
+import zlib
+
+MAGIC = b"YHPACK01"
+FILE_ID_SIZE = 16
+DATA_OFFSET = len(MAGIC) + FILE_ID_SIZE
+
+RECORD_HEADER = struct.Struct("<HII")
+DELETED_SIZE = 0xFFFFFFFF
+
+
+def get_index_path(file_path):
+    return file_path.with_name(file_path.name + ".index")
+
+
+def init_data_file(file_path):
+    with open(file_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(uuid.uuid4().bytes)
+
+
+def scan(store, offset):
+    # NOTE: インデックスに含まれていない末尾のレコードを読み込む
+    store["file"].seek(0, os.SEEK_END)
+    file_size = store["file"].tell()
+
+    if offset > file_size:
+        # NOTE: インデックスの書き出し後にデータファイルの末尾が失われた場合は，先頭から読み直す
+        logging.warning(
+            "Index of {file_path} points past the end of the data, rescan it".format(
+                file_path=store["file_path"]
+            )
+        )
+        store["entry"] = {}
+        offset = DATA_OFFSET
+
+    while offset + RECORD_HEADER.size <= file_size:
+        store["file"].seek(offset)
+        key_size, size, crc = RECORD_HEADER.unpack(store["file"].read(RECORD_HEADER.size))
+        key_buf = store["file"].read(key_size)
+
+        # NOTE: CRC はデータ部分のみなので，キーが途中で切れている場合も末尾が壊れているとみなす
+        try:
+            key = key_buf.decode("utf-8") if len(key_buf) == key_size else None
+        except UnicodeDecodeError:
+            key = None
+
+        if (key is not None) and (size == DELETED_SIZE):
+            store["entry"].pop(key, None)
+            offset += RECORD_HEADER.size + key_size
+            continue
+
+        buf = store["file"].read(size) if key is not None else b""
+        if (key is None) or (len(buf) != size) or (zlib.crc32(buf) != crc):
+            logging.warning(
+                "Discard broken record of {file_path} at {offset}".format(
+                    file_path=store["file_path"], offset=offset
+                )
+            )
+            break
+
+        store["entry"][key] = (offset + RECORD_HEADER.size + key_size, size)
+        offset += RECORD_HEADER.size + key_size + size
+
+    # NOTE: 切り詰めでファイルを伸ばさないようにし，有効な範囲を超えるエントリは捨てる
+    offset = min(offset, file_size)
+    store["entry"] = {key: entry for key, entry in store["entry"].items() if entry[0] + entry[1] <= offset}
+
+    if (offset != file_size) and (not store["read_only"]):
+        store["file"].truncate(offset)
+
+    return offset
+
+
+def load_index(store):
+    index_path = get_index_path(store["file_path"])
+    if not index_path.exists():
+        return DATA_OFFSET
+
+    try:
+        with open(index_path, "rb") as f:
+            index = pickle.load(f)
+    except:
+        logging.warning("Failed to load {index_path}".format(index_path=index_path))
+        return DATA_OFFSET
+
+    # NOTE: まとめ直したデータファイルとは組み合わせない
+    if index["file_id"] != store["file_id"]:
+        return DATA_OFFSET
+
+    store["entry"] = index["entry"]
+
+    return index["size"]
+
+
+def store_index(store):
+    index_path = get_index_path(store["file_path"])
+
+    f = tempfile.NamedTemporaryFile(dir=str(index_path.parent), delete=False)
+    pickle.dump({"file_id": store["file_id"], "size": store["size"], "entry": store["entry"]}, f)
+    f.close()
+
+    os.replace(f.name, index_path)
+
+
+def load(file_path, read_only=False):
+    file_path = pathlib.Path(file_path)
+
+    if (not file_path.exists()) and (not read_only):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        init_data_file(file_path)
+
+    # NOTE: read_only の場合は，他のプロセスが書き込み中のファイルでも読み出せるように何も書き込まない
+    f = open(file_path, "rb" if read_only else "r+b")
+
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError("Not a pack file: {file_path}".format(file_path=file_path))
+
+    store = {
+        "file_path": file_path,
+        "file": f,
+        "file_id": f.read(FILE_ID_SIZE),
+        "entry": {},
+        "map": None,
+        "map_list": [],
+        "size": 0,
+        "lock": threading.Lock(),
+        "read_only": read_only,
+    }
+
+    store["size"] = scan(store, load_index(store))
+
+    return store
+
+
+def remap(store):
+    # NOTE: 渡したスライスが参照している可能性があるので，古い mmap は閉じずに残しておく
+    if store["map"] is not None:
+        store["map_list"].append(store["map"])
+
+    store["map"] = mmap.mmap(store["file"].fileno(), store["size"], access=mmap.ACCESS_READ)
+
+
+def put(store, key, buf):
+    key_buf = key.encode("utf-8")
+
+    with store["lock"]:
+        store["file"].seek(store["size"])
+        store["file"].write(RECORD_HEADER.pack(len(key_buf), len(buf), zlib.crc32(buf)))
+        store["file"].write(key_buf)
+        store["file"].write(buf)
+        store["file"].flush()
+
+        store["entry"][key] = (store["size"] + RECORD_HEADER.size + len(key_buf), len(buf))
+        store["size"] += RECORD_HEADER.size + len(key_buf) + len(buf)
+
+
+def delete(store, key):
+    key_buf = key.encode("utf-8")
+
+    with store["lock"]:
+        if key not in store["entry"]:
+            return
+
+        store["file"].seek(store["size"])
+        store["file"].write(RECORD_HEADER.pack(len(key_buf), DELETED_SIZE, 0))
+        store["file"].write(key_buf)
+        store["file"].flush()
+
+        del store["entry"][key]
+        store["size"] += RECORD_HEADER.size + len(key_buf)
+
+
+def exists(store, key):
+    return key in store["entry"]
+
+
+def get(store, key):
+    with store["lock"]:
+        if key not in store["entry"]:
+            return None
+
+        offset, size = store["entry"][key]
+        if (store["map"] is None) or (len(store["map"]) < offset + size):
+            remap(store)
+
+        # NOTE: コピーせずにファイルの内容を参照するスライスを返す
+        return memoryview(store["map"])[offset : offset + size]
+
+
+def get_size(store, key):
+    entry = store["entry"].get(key)
+
+    return None if entry is None else entry[1]
+
+
+def get_key_list(store):
+    return list(store["entry"].keys())
+
+
+def get_stat(store):
+    return {
+        "count": len(store["entry"]),
+        "size": store["size"],
+        "live_size": sum(map(lambda entry: entry[1], store["entry"].values())),
+    }
+
+
+def close(store):
+    with store["lock"]:
+        if not store["read_only"]:
+            store["file"].flush()
+            os.fsync(store["file"].fileno())
+            store_index(store)
+
+        for m in store["map_list"] + ([store["map"]] if store["map"] is not None else []):
+            try:
+                m.close()
+            except BufferError:
+                # NOTE: 参照中のスライスが残っている場合は GC に任せる
+                pass
+
+        store["file"].close()
+
+
+def compact(store):
+    # NOTE: 生きているレコードだけを新しいファイルに書き出して置き換える
+    file_path = store["file_path"]
+
+    f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), delete=False)
+    f.close()
+    init_data_file(pathlib.Path(f.name))
+
+    new_store = load(pathlib.Path(f.name))
+    for key in get_key_list(store):
+        put(new_store, key, get(store, key))
+    close(new_store)
+
+    close(store)
+    os.replace(f.name, file_path)
+    os.replace(get_index_path(pathlib.Path(f.name)), get_index_path(file_path))
+
+    return load(file_path)
+
+
+def migrate(store, dir_path):
+    # NOTE: 拡張子はファイルの形式によって異なるので，拡張子を除いた名前をキーにする．
+    # 同じキーのファイルが複数ある場合は，新しいものを使う
+    file_list = sorted(
+        filter(lambda file_path: file_path.is_file(), pathlib.Path(dir_path).glob("*")),
+        key=lambda file_path: file_path.stat().st_mtime,
+        reverse=True,
+    )
+
+    count = 0
+    for file_path in file_list:
+        key = file_path.stem
+        if file_path.suffix == "":
+            # NOTE: 書き込み途中で中断した一時ファイル等
+            logging.warning("Skip {file_path} (no suffix)".format(file_path=file_path))
+            continue
+        if exists(store, key):
+            logging.info("Skip {file_path} ({key} is already stored)".format(file_path=file_path, key=key))
+            continue
+
+        put(store, key, file_path.read_bytes())
+        count += 1
+
+    logging.info("Migrate {count} files from {dir_path}".format(count=count, dir_path=dir_path))
+
+    return count
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    store = load(pathlib.Path(args["PACK"]))
+
+    if args["migrate"]:
+        migrate(store, pathlib.Path(args["DIR"]))
+    elif args["compact"]:
+        before = get_stat(store)
+        store = compact(store)
+        logging.info(
+            "Compact {before:,} bytes to {after:,} bytes".format(
+                before=before["size"], after=get_stat(store)["size"]
+            )
+        )
+
+    stat = get_stat(store)
+    logging.info(
+        "{count:,} entries, {size:,} bytes ({live_size:,} bytes live)".format(
+            count=stat["count"], size=stat["size"], live_size=stat["live_size"]
+        )
+    )
+
+    close(store)
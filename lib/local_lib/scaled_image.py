@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+画像をセルの大きさに縮小して，符号化し直したものをキャッシュします．
+
+キャッシュは pack_store に保存し，縮小後の大きさが変わったら作り直します．
+元画像が変わった場合に備えて，キーには元画像のサイズを含めます．
+
+Usage:
+  scaled_image.py [-W WIDTH] [-H HEIGHT] IMAGE...
+
+Options:
+  -W WIDTH      : 縮小後の最大幅 [pix]．[default: 92]
+  -H HEIGHT     : 縮小後の最大高さ [pix]．[default: 102]
+"""
+
+import concurrent.futures
+import io
+import logging
+import os
+import pathlib
+
+import PIL.Image
+
+import local_lib.pack_store
+
+GEOMETRY_KEY = "__geometry__"
+JPEG_QUALITY = 85
+CHUNK_SIZE = 32
+
+
+def gen_key(key, source_size):
+    return "{key}:{size}".format(key=key, size=source_size)
+
+
+def gen_geometry(box):
+    return "{width}x{height}".format(width=int(box[0]), height=int(box[1])).encode("utf-8")
+
+
+def scale(source, box):
+    if isinstance(source, (str, pathlib.Path)):
+        img = PIL.Image.open(source)
+    else:
+        img = PIL.Image.open(io.BytesIO(source))
+
+    img.thumbnail((int(box[0]), int(box[1])), PIL.Image.LANCZOS)
+
+    buf = io.BytesIO()
+    if img.mode in ["RGBA", "LA", "P"]:
+        # NOTE: 透過がある場合は PNG のままにする
+        img.save(buf, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+
+    return buf.getvalue()
+
+
+def scale_worker(key, source, box):
+    try:
+        return (key, scale(source, box))
+    except:
+        return (key, None)
+
+
+def load(file_path, box):
+    file_path = pathlib.Path(file_path)
+    store = local_lib.pack_store.load(file_path)
+
+    geometry = local_lib.pack_store.get(store, GEOMETRY_KEY)
+    if (geometry is not None) and (bytes(geometry) == gen_geometry(box)):
+        return store
+
+    # NOTE: セルの大きさが変わったら，作り直す
+    if geometry is not None:
+        logging.info(
+            "Rebuild scaled image cache for {geometry}".format(geometry=gen_geometry(box).decode("utf-8"))
+        )
+    del geometry
+    local_lib.pack_store.close(store)
+
+    file_path.unlink()
+    local_lib.pack_store.get_index_path(file_path).unlink(missing_ok=True)
+
+    store = local_lib.pack_store.load(file_path)
+    local_lib.pack_store.put(store, GEOMETRY_KEY, gen_geometry(box))
+
+    return store
+
+
+def build(store, source_list, box, worker_count=None, progress_func=lambda: None):
+    source_list = list(filter(lambda source: not local_lib.pack_store.exists(store, source[0]), source_list))
+    if len(source_list) == 0:
+        return 0
+
+    logging.info("Scale {count} images".format(count=len(source_list)))
+
+    # NOTE: 縮小と符号化は CPU を使うので，プロセスを分けて並列に処理する
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=worker_count or os.cpu_count()) as executor:
+        for key, buf in executor.map(
+            scale_worker,
+            map(lambda source: source[0], source_list),
+            map(lambda source: source[1], source_list),
+            [box] * len(source_list),
+            chunksize=CHUNK_SIZE,
+        ):
+            if buf is None:
+                logging.warning("Failed to scale image of {key}".format(key=key))
+            else:
+                local_lib.pack_store.put(store, key, buf)
+                count += 1
+            progress_func()
+
+    return count
+
+
+def get(store, key):
+    return local_lib.pack_store.get(store, key)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    box = (int(args["-W"]), int(args["-H"]))
+    file_path = pathlib.Path(tempfile.mkdtemp(), "scaled.pack")
+
+    store = load(file_path, box)
+    build(store, [(str(i), pathlib.Path(path)) for i, path in enumerate(args["IMAGE"])], box)
+
+    for i, path in enumerate(args["IMAGE"]):
+        buf = get(store, str(i))
+        img = PIL.Image.open(io.BytesIO(buf))
+        logging.info(
+            "{path}: {before:,} bytes -> {after:,} bytes ({width}x{height})".format(
+                path=path,
+                before=pathlib.Path(path).stat().st_size,
+                after=len(buf),
+                width=img.width,
+                height=img.height,
+            )
+        )
+        del buf
+
+    local_lib.pack_store.close(store)
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import collections
 import datetime
 import inspect
+import json
 import logging
 import os
 import random
@@ -19,12 +21,25 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
 
 WAIT_RETRY_COUNT = 1
+TAB_WAIT_SEC = 5
+LOAD_WAIT_SEC = 30
+# NOTE: Network.setBlockedURLs はリソースの種類を指定できないので，拡張子で判定する．
+# Fetch.enable なら種類で判定できるが，止めたリクエストを CDP のイベントを受けて個別に
+# 処理する必要があり，execute_cdp_cmd では扱えないので使わない．
+# 拡張子の無い URL は判定できないので，ブロックは近似的なものになる．
+BLOCK_RESOURCE_EXT = {
+    "image": ["jpg", "jpeg", "png", "gif", "webp", "svg", "ico"],
+    "font": ["woff", "woff2", "ttf", "otf"],
+    "media": ["mp4", "webm", "mp3", "m4a"],
+    "stylesheet": ["css"],
+}
 AGENT_NAME = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
 
 
-def create_driver_impl(profile_name, data_path, agent_name, is_headless):
+def create_driver_impl(profile_name, data_path, agent_name, is_headless, is_perf_log):
     chrome_data_path = data_path / "chrome"
     log_path = data_path / "log"
 
@@ -50,6 +65,10 @@ def create_driver_impl(profile_name, data_path, agent_name, is_headless):
 
     options.add_argument("user-agent={agent_name}".format(agent_name=agent_name))
 
+    if is_perf_log:
+        # NOTE: 通信量を集計するため，DevTools のネットワークイベントを記録する
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
     driver = webdriver.Chrome(
         service=Service(
             log_path=str(log_path / "webdriver.log"),
@@ -87,12 +106,12 @@ def create_driver_impl(profile_name, data_path, agent_name, is_headless):
     return driver
 
 
-def create_driver(profile_name, data_path, agent_name=AGENT_NAME, is_headless=True):
+def create_driver(profile_name, data_path, agent_name=AGENT_NAME, is_headless=True, is_perf_log=False):
     # NOTE: 1回だけ自動リトライ
     try:
-        return create_driver_impl(profile_name, data_path, agent_name, is_headless)
+        return create_driver_impl(profile_name, data_path, agent_name, is_headless, is_perf_log)
     except:
-        return create_driver_impl(profile_name, data_path, agent_name, is_headless)
+        return create_driver_impl(profile_name, data_path, agent_name, is_headless, is_perf_log)
 
 
 def xpath_exists(driver, xpath):
@@ -125,6 +144,20 @@ def click_xpath(driver, xpath, wait=None, is_warn=True):
         return False
 
 
+def wait_for_ready(driver, wait):
+    wait.until(lambda driver: driver.execute_script("return document.readyState") == "complete")
+
+
+def wait_for_transition(driver, wait, elem):
+    # NOTE: 遷移前のページの要素が無効になるのを待ってから，読み込み完了を待つ
+    try:
+        wait.until(EC.staleness_of(elem))
+    except TimeoutException:
+        logging.debug("Page does not change")
+
+    wait_for_ready(driver, wait)
+
+
 def is_display(driver, xpath):
     return (len(driver.find_elements(By.XPATH, xpath)) != 0) and (
         driver.find_element(By.XPATH, xpath).is_displayed()
@@ -180,6 +213,88 @@ def dump_page(driver, index, dump_path):
     )
 
 
+def get_all_cookies(driver):
+    # NOTE: driver.get_cookies() は表示中のドメインの分しか返さないので CDP を使う
+    return driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+
+
+def prefetch_url(driver, url):
+    # NOTE: 次に表示するページをブラウザに先読みさせておく
+    driver.execute_script(
+        """
+const link = document.createElement("link");
+link.rel = "prefetch";
+link.href = arguments[0];
+document.head.appendChild(link);
+""",
+        url,
+    )
+
+
+def gen_resource_pattern_list(resource_type):
+    # NOTE: パスの途中やクエリに拡張子が含まれる URL まで対象にしないように，パスの末尾に限定する
+    pattern_list = []
+    for ext in BLOCK_RESOURCE_EXT[resource_type]:
+        pattern_list.extend(["*.{ext}".format(ext=ext), "*.{ext}?*".format(ext=ext)])
+
+    return pattern_list
+
+
+def gen_blocked_url_list(type_list, pattern_list, allow_list=[]):
+    url_list = []
+    for resource_type in type_list:
+        if resource_type not in allow_list:
+            url_list.extend(gen_resource_pattern_list(resource_type))
+
+    url_list.extend(filter(lambda pattern: pattern not in allow_list, pattern_list))
+
+    return url_list
+
+
+def set_blocked_url(driver, url_list):
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": url_list})
+
+
+def create_network_stat():
+    return {
+        "type": {},
+        "loaded": collections.defaultdict(lambda: {"count": 0, "size": 0}),
+        "blocked": collections.defaultdict(int),
+    }
+
+
+def update_network_stat(driver, network_stat):
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        params = message.get("params", {})
+
+        if message["method"] == "Network.responseReceived":
+            network_stat["type"][params["requestId"]] = params.get("type", "Other")
+        elif message["method"] == "Network.loadingFinished":
+            resource_type = network_stat["type"].pop(params["requestId"], "Other")
+            network_stat["loaded"][resource_type]["count"] += 1
+            network_stat["loaded"][resource_type]["size"] += params.get("encodedDataLength", 0)
+        elif (message["method"] == "Network.loadingFailed") and ("blockedReason" in params):
+            network_stat["blocked"][params.get("type", "Other")] += 1
+
+
+def summarize_network_stat(network_stat):
+    # NOTE: ブロックしたリクエストのサイズは分からないので，同じ種類の平均サイズで見積もる
+    saved_size = 0
+    for resource_type, count in network_stat["blocked"].items():
+        loaded = network_stat["loaded"].get(resource_type, {"count": 0, "size": 0})
+        if loaded["count"] != 0:
+            saved_size += count * loaded["size"] // loaded["count"]
+
+    return {
+        "loaded_count": sum(map(lambda loaded: loaded["count"], network_stat["loaded"].values())),
+        "loaded_size": sum(map(lambda loaded: loaded["size"], network_stat["loaded"].values())),
+        "blocked_count": sum(network_stat["blocked"].values()),
+        "saved_size": saved_size,
+    }
+
+
 def clear_cache(driver):
     driver.execute_cdp_cmd("Network.clearBrowserCache", {})
 
@@ -239,19 +354,39 @@ def warmup(driver, keyword, url_pattern):
 
 
 class browser_tab:
-    def __init__(self, driver, url):
+    def __init__(self, driver, url, blocked_url_list=None):
         self.driver = driver
         self.url = url
+        self.blocked_url_list = blocked_url_list
 
     def __enter__(self):
-        self.driver.execute_script("window.open('{url}', '_blank');".format(url=self.url))
+        handle_count = len(self.driver.window_handles)
+
+        # NOTE: ブロックの設定はタブ毎なので，空のタブを開いて設定してから読み込む
+        if self.blocked_url_list is None:
+            url = self.url
+        else:
+            url = "about:blank"
+
+        self.driver.execute_script("window.open('{url}', '_blank');".format(url=url))
+        WebDriverWait(self.driver, TAB_WAIT_SEC).until(
+            lambda driver: len(driver.window_handles) > handle_count
+        )
         self.driver.switch_to.window(self.driver.window_handles[-1])
-        time.sleep(0.1)
+
+        if self.blocked_url_list is not None:
+            set_blocked_url(self.driver, self.blocked_url_list)
+            self.driver.get(self.url)
+
+        # NOTE: 開いたタブは about:blank から始まるので，指定したページの読み込みが終わるまで待つ
+        WebDriverWait(self.driver, LOAD_WAIT_SEC).until(
+            lambda driver: (driver.current_url != "about:blank")
+            and (driver.execute_script("return document.readyState") == "complete")
+        )
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.driver.close()
         self.driver.switch_to.window(self.driver.window_handles[-1])
-        time.sleep(0.1)
 
 
 if __name__ == "__main__":
@@ -15,14 +15,23 @@ import traceback
 import shutil
 import os
 
+import local_lib.container
 
-def store(file_path_str, data):
+
+def store(file_path_str, data, codec=None, section_key_map={}):
     logging.debug("Store {file_path}".format(file_path=file_path_str))
 
     file_path = pathlib.Path(file_path_str)
     try:
         f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), delete=False)
-        pickle.dump(data, f)
+        if codec is None:
+            # NOTE: 以前 codec 付きで保存したものを読み込んだ場合，未復号のセクションを持つので展開しておく
+            if isinstance(data, local_lib.container.LazyData):
+                data = dict(data)
+            pickle.dump(data, f)
+        else:
+            # NOTE: セクション毎に符号化して，読み込み時に必要な部分だけ復号できるようにする
+            local_lib.container.dump(data, f, codec, section_key_map)
         f.close()
 
         if file_path.exists():
@@ -42,9 +51,18 @@ def load(file_path, init_value={}):
 
     try:
         with open(file_path, "rb") as f:
-            data = init_value.copy()
-            data.update(pickle.load(f))
+            buf = f.read()
+
+        if local_lib.container.is_container(buf):
+            data = local_lib.container.load(buf)
+            for key, value in init_value.items():
+                if key not in data:
+                    data[key] = value
             return data
+
+        data = init_value.copy()
+        data.update(pickle.loads(buf))
+        return data
     except:
         logging.error(traceback.format_exc())
         return init_value
@@ -66,3 +84,6 @@ if __name__ == "__main__":
     f.flush()
 
     assert load(file_path) == data
+
+    store(file_path, data, "zlib", {"item": ["b"]})
+    assert load(file_path, {"b": []}) == data | {"b": []}
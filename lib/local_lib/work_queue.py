@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+リトライと Dead Letter を備えた，永続化可能な作業キューです．
+
+Usage:
+  work_queue.py
+"""
+
+import collections
+import logging
+import time
+
+import local_lib.serializer
+
+RETRY_COUNT = 3
+BACKOFF_SEC = 5
+BACKOFF_MAX_SEC = 600
+
+
+def create(task=None, dead=None):
+    return {
+        "task": collections.OrderedDict() if task is None else collections.OrderedDict(task),
+        "dead": collections.OrderedDict() if dead is None else collections.OrderedDict(dead),
+    }
+
+
+def gen_task_id(stage, key):
+    return "{stage}:{key}".format(stage=stage, key=key)
+
+
+def push(queue, stage, key, payload):
+    task_id = gen_task_id(stage, key)
+
+    if task_id not in queue["task"]:
+        queue["task"][task_id] = {
+            "id": task_id,
+            "stage": stage,
+            "key": key,
+            "payload": payload,
+            "retry": 0,
+            "next_time": 0,
+            "error": None,
+        }
+
+    return queue["task"][task_id]
+
+
+def complete(queue, task):
+    queue["task"].pop(task["id"], None)
+
+
+def fail(queue, task, error, retry_count=RETRY_COUNT, backoff_sec=BACKOFF_SEC):
+    task["retry"] += 1
+    task["error"] = error
+
+    if task["retry"] > retry_count:
+        logging.warning("Give up task {id}: {error}".format(id=task["id"], error=error))
+        queue["task"].pop(task["id"], None)
+        queue["dead"][task["id"]] = task
+        return False
+
+    # NOTE: 失敗する度に待ち時間を倍にする
+    delay_sec = min(backoff_sec * (2 ** (task["retry"] - 1)), BACKOFF_MAX_SEC)
+    task["next_time"] = time.time() + delay_sec
+
+    logging.info(
+        "Retry task {id} after {delay:.0f} sec ({retry}/{retry_count})".format(
+            id=task["id"], delay=delay_sec, retry=task["retry"], retry_count=retry_count
+        )
+    )
+
+    return True
+
+
+def get_task_list(queue, stage=None):
+    return list(filter(lambda task: (stage is None) or (task["stage"] == stage), queue["task"].values()))
+
+
+def get_dead_list(queue):
+    return list(queue["dead"].values())
+
+
+def pop_ready(queue, stage=None, is_wait=True):
+    task_list = get_task_list(queue, stage)
+    if len(task_list) == 0:
+        return None
+
+    task = min(task_list, key=lambda task: task["next_time"])
+    wait_sec = task["next_time"] - time.time()
+    if wait_sec > 0:
+        if not is_wait:
+            return None
+        time.sleep(wait_sec)
+
+    return task
+
+
+def store(file_path, queue):
+    local_lib.serializer.store(file_path, {"task": queue["task"], "dead": queue["dead"]})
+
+
+def load(file_path):
+    data = local_lib.serializer.load(file_path, {"task": {}, "dead": {}})
+
+    return create(data["task"], data["dead"])
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    queue = create()
+    task = push(queue, "order", "a-1", {"no": "a-1"})
+    push(queue, "order", "a-1", {"no": "a-1"})
+    assert len(get_task_list(queue)) == 1
+
+    assert fail(queue, task, "error", retry_count=1, backoff_sec=0.01)
+    assert pop_ready(queue, "order", is_wait=False) is None
+    assert pop_ready(queue, "order")["key"] == "a-1"
+    assert not fail(queue, task, "error", retry_count=1)
+    assert len(get_dead_list(queue)) == 1
+
+    push(queue, "thumb", "b", {})
+    f = tempfile.NamedTemporaryFile()
+    store(pathlib.Path(f.name), queue)
+
+    queue = load(pathlib.Path(f.name))
+    complete(queue, pop_ready(queue))
+    assert len(get_task_list(queue)) == 0
+
+    logging.info("OK")
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+openpyxl_util で作成した Excel ファイルに，新しい行だけを追記します．
+
+追記する行は同じ設定で作成した差分のファイルから取り出し，既存の行や画像はそのままコピーします．
+どの行まで書き込んだかはマニフェストに保存し，ファイルが変更されていたら使いません．
+
+Usage:
+  xlsx_append.py [-n COUNT]
+
+Options:
+  -n COUNT      : 動作確認に使う商品の数．[default: 1000]
+"""
+
+import logging
+import os
+import pathlib
+import pickle
+import re
+import tempfile
+import zipfile
+
+# NOTE: 追記の仕方を変えたら上げて，古いマニフェストを使わないようにする
+MANIFEST_VERSION = 1
+
+SHEET_PATH = "xl/worksheets/sheet1.xml"
+SHEET_RELS_PATH = "xl/worksheets/_rels/sheet1.xml.rels"
+DRAWING_PATH = "xl/drawings/drawing1.xml"
+DRAWING_RELS_PATH = "xl/drawings/_rels/drawing1.xml.rels"
+STYLE_PATH = "xl/styles.xml"
+WORKBOOK_PATH = "xl/workbook.xml"
+CONTENT_TYPE_PATH = "[Content_Types].xml"
+
+ROW_PATTERN = re.compile(rb'<row r="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.DOTALL)
+HYPERLINK_PATTERN = re.compile(rb"<hyperlink [^>]*?/>")
+ANCHOR_PATTERN = re.compile(rb"<twoCellAnchor>.*?</twoCellAnchor>", re.DOTALL)
+REL_PATTERN = re.compile(rb"<Relationship [^>]*?/>")
+REL_ID_PATTERN = re.compile(rb' Id="(rId\d+)"')
+REL_ID_NUM_PATTERN = re.compile(rb' Id="rId(\d+)"')
+REL_ID_REF_PATTERN = re.compile(rb'r:id="(rId\d+)"')
+EMBED_PATTERN = re.compile(rb'r:embed="(rId\d+)"')
+PIC_ID_PATTERN = re.compile(rb'<cNvPr id="\d+" name="Image \d+"')
+TARGET_PATTERN = re.compile(rb'Target="([^"]*)"')
+RANGE_PATTERN = rb'(ref="[A-Z]+\d+:[A-Z]+)\d+(")'
+FILTER_PATTERN = rb"(<definedName name=\"_xlnm._FilterDatabase\"[^>]*>[^<]*:\$[A-Z]+\$)\d+(<)"
+MEDIA_PATTERN = re.compile(r"xl/media/image(\d+)\.")
+EXTENSION_PATTERN = rb'<Default Extension="{ext}" [^>]*?/>'
+
+
+def get_manifest_path(file_path):
+    return file_path.with_name(file_path.name + ".manifest")
+
+
+def get_file_stat(file_path):
+    stat = file_path.stat()
+
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def load_manifest(file_path, digest):
+    file_path = pathlib.Path(file_path)
+    manifest_path = get_manifest_path(file_path)
+
+    if (not file_path.exists()) or (not manifest_path.exists()):
+        return None
+
+    try:
+        with open(manifest_path, "rb") as f:
+            manifest = pickle.load(f)
+    except:
+        logging.warning("Failed to load {manifest_path}".format(manifest_path=manifest_path))
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if manifest["digest"] != digest:
+        logging.info("Sheet definition has changed")
+        return None
+    # NOTE: Excel 等で保存し直された場合は，内容が変わっているかもしれないので使わない
+    if manifest["file_stat"] != get_file_stat(file_path):
+        logging.info("{file_path} has been modified".format(file_path=file_path))
+        return None
+
+    return manifest
+
+
+def store_manifest(file_path, digest, item_digest_list, row_last, image_path_map):
+    file_path = pathlib.Path(file_path)
+    manifest_path = get_manifest_path(file_path)
+
+    f = tempfile.NamedTemporaryFile(dir=str(manifest_path.parent), delete=False)
+    pickle.dump(
+        {
+            "version": MANIFEST_VERSION,
+            "digest": digest,
+            "file_stat": get_file_stat(file_path),
+            "item": item_digest_list,
+            "row_last": row_last,
+            "image": image_path_map,
+        },
+        f,
+    )
+    f.close()
+
+    os.replace(f.name, manifest_path)
+
+
+def get_append_pos(manifest, item_digest_list):
+    # NOTE: 書き込み済みの行が先頭にそのまま並んでいる場合だけ追記できる．
+    # 途中に新しい行が入ったり，既存の行の内容が変わった場合は作り直す
+    if len(item_digest_list) < len(manifest["item"]):
+        return None
+    if item_digest_list[: len(manifest["item"])] != manifest["item"]:
+        return None
+
+    return len(manifest["item"])
+
+
+def get_part(part_map, name):
+    # NOTE: Excel 等で保存し直したファイルは構成が異なることがあるので，想定外の場合は ValueError にする．
+    # (呼び出し側は ValueError の場合に全体を作り直す)
+    if name not in part_map:
+        raise ValueError("{name} is not found".format(name=name))
+
+    return part_map[name]
+
+
+def search_part(pattern, buf, name):
+    m = re.search(pattern, buf)
+    if m is None:
+        raise ValueError("{name} does not match the expected layout".format(name=name))
+
+    return m
+
+
+def parse_rels(buf, name):
+    return {search_part(REL_ID_PATTERN, rel, name).group(1): rel for rel in REL_PATTERN.findall(buf)}
+
+
+def parse_rels_target(buf, name):
+    return {
+        rel_id: search_part(TARGET_PATTERN, rel, name).group(1)
+        for rel_id, rel in parse_rels(buf, name).items()
+    }
+
+
+def get_rel_id_max(buf):
+    return max(map(int, REL_ID_NUM_PATTERN.findall(buf)), default=0)
+
+
+def gen_rel_id(rel_id):
+    return "rId{rel_id}".format(rel_id=rel_id).encode("utf-8")
+
+
+def insert_before(buf, tag, part_list, name):
+    pos = buf.rfind(tag)
+    if pos == -1:
+        raise ValueError("{tag} is not found in {name}".format(tag=tag.decode("utf-8"), name=name))
+
+    return buf[:pos] + b"".join(part_list) + buf[pos:]
+
+
+def replace_row_last(buf, pattern, row_last):
+    return re.sub(pattern, lambda m: m.group(1) + str(row_last).encode("utf-8") + m.group(2), buf)
+
+
+def merge_sheet(src, delta, row_start, row_last):
+    delta_sheet = get_part(delta, SHEET_PATH)
+    row_list = [m.group(0) for m in ROW_PATTERN.finditer(delta_sheet) if int(m.group(1)) >= row_start]
+    if len(row_list) != row_last - row_start + 1:
+        raise ValueError("Rows of {name} do not match the expected layout".format(name=SHEET_PATH))
+
+    sheet = insert_before(get_part(src, SHEET_PATH), b"</sheetData>", row_list, SHEET_PATH)
+    sheet = replace_row_last(sheet, RANGE_PATTERN, row_last)
+
+    link_list = HYPERLINK_PATTERN.findall(delta_sheet)
+    if len(link_list) == 0:
+        return {SHEET_PATH: sheet}
+
+    # NOTE: 差分のリンク先を，既存の ID と重ならないように付け直して追加する
+    delta_rel_map = parse_rels(get_part(delta, SHEET_RELS_PATH), SHEET_RELS_PATH)
+    rel_id = get_rel_id_max(get_part(src, SHEET_RELS_PATH))
+
+    new_link_list = []
+    new_rel_list = []
+    for link in link_list:
+        delta_rel_id = search_part(REL_ID_REF_PATTERN, link, SHEET_PATH).group(1)
+        if delta_rel_id not in delta_rel_map:
+            continue
+
+        rel_id += 1
+        new_link_list.append(REL_ID_REF_PATTERN.sub(lambda m: b'r:id="' + gen_rel_id(rel_id) + b'"', link))
+        new_rel_list.append(
+            REL_ID_PATTERN.sub(lambda m: b' Id="' + gen_rel_id(rel_id) + b'"', delta_rel_map[delta_rel_id])
+        )
+
+    return {
+        SHEET_PATH: insert_before(sheet, b"</hyperlinks>", new_link_list, SHEET_PATH),
+        SHEET_RELS_PATH: insert_before(
+            src[SHEET_RELS_PATH], b"</Relationships>", new_rel_list, SHEET_RELS_PATH
+        ),
+    }
+
+
+def merge_drawing(src, delta, src_name_list, delta_image_map, image_path_map):
+    if DRAWING_PATH not in delta:
+        return ({}, {})
+
+    src_drawing = get_part(src, DRAWING_PATH)
+    src_rels = get_part(src, DRAWING_RELS_PATH)
+    src_rel_map = {
+        target: rel_id for rel_id, target in parse_rels_target(src_rels, DRAWING_RELS_PATH).items()
+    }
+    delta_rel_map = parse_rels_target(get_part(delta, DRAWING_RELS_PATH), DRAWING_RELS_PATH)
+    rel_id = get_rel_id_max(src_rels)
+    image_id = max(
+        [int(m.group(1)) for m in map(MEDIA_PATTERN.match, src_name_list) if m is not None], default=0
+    )
+    pic_id = src_drawing.count(b"<twoCellAnchor>")
+
+    media_map = {}
+    new_rel_list = []
+    anchor_list = []
+    for anchor in ANCHOR_PATTERN.findall(delta[DRAWING_PATH]):
+        delta_rel_id = search_part(EMBED_PATTERN, anchor, DRAWING_PATH).group(1)
+        if delta_rel_id not in delta_rel_map:
+            raise ValueError(
+                "{rel_id} is not found in {name}".format(rel_id=delta_rel_id, name=DRAWING_RELS_PATH)
+            )
+        delta_target = delta_rel_map[delta_rel_id].decode("utf-8")
+        share_key = delta_image_map[delta_target]
+
+        # NOTE: 既に埋め込んである画像は使い回し，新しい画像だけを追加する
+        if share_key not in image_path_map:
+            image_id += 1
+            image_path_map[share_key] = "/xl/media/image{id}{suffix}".format(
+                id=image_id, suffix=pathlib.PurePosixPath(delta_target).suffix
+            )
+            media_map[image_path_map[share_key][1:]] = delta_target[1:]
+
+        target = image_path_map[share_key].encode("utf-8")
+        if target not in src_rel_map:
+            rel_id += 1
+            src_rel_map[target] = gen_rel_id(rel_id)
+            new_rel_list.append(
+                b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+                + b'Target="'
+                + target
+                + b'" Id="'
+                + gen_rel_id(rel_id)
+                + b'"/>'
+            )
+
+        pic_id += 1
+        anchor = EMBED_PATTERN.sub(lambda m: b'r:embed="' + src_rel_map[target] + b'"', anchor)
+        anchor = PIC_ID_PATTERN.sub(
+            lambda m: '<cNvPr id="{id}" name="Image {id}"'.format(id=pic_id).encode("utf-8"), anchor
+        )
+        anchor_list.append(anchor)
+
+    return (
+        {
+            DRAWING_PATH: insert_before(src_drawing, b"</wsDr>", anchor_list, DRAWING_PATH),
+            DRAWING_RELS_PATH: insert_before(src_rels, b"</Relationships>", new_rel_list, DRAWING_RELS_PATH),
+        },
+        media_map,
+    )
+
+
+def merge_content_type(src, delta, media_map):
+    content_type = get_part(src, CONTENT_TYPE_PATH)
+    for path in media_map.keys():
+        ext = pathlib.PurePosixPath(path).suffix[1:].encode("utf-8")
+        pattern = EXTENSION_PATTERN.replace(b"{ext}", re.escape(ext))
+        if re.search(pattern, content_type) is None:
+            content_type = insert_before(
+                content_type,
+                b"<Override ",
+                [search_part(pattern, get_part(delta, CONTENT_TYPE_PATH), CONTENT_TYPE_PATH).group(0)],
+                CONTENT_TYPE_PATH,
+            )
+
+    return content_type
+
+
+def append(file_path, delta_path, row_start, row_last, delta_image_map, image_path_map):
+    """
+    delta_path のファイルの row_start 行目以降を file_path のファイルに追加します．
+    delta_image_map は差分のファイル中の画像のパスから共有キーへの辞書，
+    image_path_map は既存のファイル中の共有キーから画像のパスへの辞書で，追加した画像も登録されます．
+    """
+    file_path = pathlib.Path(file_path)
+
+    try:
+        src_zip = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        raise ValueError("{file_path} is not a zip file".format(file_path=file_path))
+    delta_zip = zipfile.ZipFile(delta_path)
+
+    part_list = [
+        SHEET_PATH,
+        SHEET_RELS_PATH,
+        DRAWING_PATH,
+        DRAWING_RELS_PATH,
+        STYLE_PATH,
+        WORKBOOK_PATH,
+        CONTENT_TYPE_PATH,
+    ]
+    src = {name: src_zip.read(name) for name in part_list if name in src_zip.namelist()}
+    delta = {name: delta_zip.read(name) for name in part_list if name in delta_zip.namelist()}
+
+    # NOTE: 行はスタイルの番号を含むので，スタイルが一致しない場合は追記できない
+    try:
+        if get_part(src, STYLE_PATH) != get_part(delta, STYLE_PATH):
+            raise ValueError("Style is not matched")
+
+        update_map = merge_sheet(src, delta, row_start, row_last)
+        drawing_map, media_map = merge_drawing(
+            src, delta, src_zip.namelist(), delta_image_map, image_path_map
+        )
+        update_map.update(drawing_map)
+        update_map[WORKBOOK_PATH] = replace_row_last(get_part(src, WORKBOOK_PATH), FILTER_PATTERN, row_last)
+        update_map[CONTENT_TYPE_PATH] = merge_content_type(src, delta, media_map)
+    except:
+        src_zip.close()
+        delta_zip.close()
+        raise
+
+    f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), suffix=file_path.suffix, delete=False)
+    f.close()
+
+    with zipfile.ZipFile(f.name, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as dst_zip:
+        for info in src_zip.infolist():
+            if info.filename in update_map:
+                dst_zip.writestr(info, update_map[info.filename])
+            else:
+                # NOTE: 既存の行や画像はそのままコピーする (全体をメモリに読み込まない)
+                with src_zip.open(info) as src_file, dst_zip.open(info, "w", force_zip64=True) as dst_file:
+                    while True:
+                        buf = src_file.read(1024 * 1024)
+                        if len(buf) == 0:
+                            break
+                        dst_file.write(buf)
+
+        for path, delta_path in media_map.items():
+            dst_zip.writestr(path, delta_zip.read(delta_path))
+
+    src_zip.close()
+    delta_zip.close()
+
+    os.replace(f.name, file_path)
+
+    logging.info(
+        "Append {row_count} rows and {image_count} images to {file_path}".format(
+            row_count=row_last - row_start + 1, image_count=len(media_map), file_path=file_path
+        )
+    )
+
+
+if __name__ == "__main__":
+    import datetime
+    import io
+
+    import openpyxl
+    import PIL.Image
+    from docopt import docopt
+
+    import local_lib.logger
+    import local_lib.openpyxl_util
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    item_count = int(args["-n"])
+
+    thumb_list = []
+    for i in range(10):
+        buf = io.BytesIO()
+        PIL.Image.new("RGB", (80, 80), (i * 20, 0, 0)).save(buf, format="JPEG")
+        thumb_list.append(buf.getvalue())
+
+    item_list = [
+        {
+            "name": "商品 {i}".format(i=i),
+            "price": 100 + i,
+            "date": datetime.datetime(2020, 1, 1) + datetime.timedelta(hours=i),
+            "url": "https://example.com/{i}".format(i=i),
+        }
+        for i in range(item_count)
+    ]
+    sheet_def = {
+        "SHEET_TITLE": "テスト",
+        "TABLE_HEADER": {
+            "row": {"pos": 2, "height": {"default": 80, "without_thumb": 25}},
+            "col": {
+                "date": {"label": "日付", "pos": 2, "width": 23, "format": "yyyy/mm/dd"},
+                "name": {"label": "商品名", "pos": 3, "width": 70, "wrap": True, "format": "@"},
+                "image": {"label": "画像", "pos": 4, "width": 12},
+                "price": {
+                    "label": "価格",
+                    "pos": 5,
+                    "width": 16,
+                    "link_func": lambda item: item["url"],
+                },
+            },
+        },
+    }
+
+    def get_thumb(item):
+        return thumb_list[(item["price"] - 100) * len(thumb_list) // item_count]
+
+    def generate(file_path, item_list, row_start=None, thumb_func=get_thumb):
+        book = openpyxl.Workbook(write_only=True)
+        image_map = {}
+        local_lib.openpyxl_util.generate_list_sheet_stream(
+            book,
+            item_list,
+            sheet_def,
+            True,
+            thumb_func,
+            lambda status: None,
+            lambda: None,
+            lambda: None,
+            row_start=row_start,
+            image_map=image_map,
+        )
+        local_lib.openpyxl_util.save_book(book, file_path)
+
+        return {img.path: share_key for share_key, img in image_map.items()}
+
+    temp_dir = pathlib.Path(tempfile.mkdtemp())
+    half = item_count // 2
+    row_start = sheet_def["TABLE_HEADER"]["row"]["pos"] + 1
+
+    image_path_map = {
+        share_key: path for path, share_key in generate(temp_dir / "table.xlsx", item_list[:half]).items()
+    }
+    delta_image_map = generate(temp_dir / "delta.xlsx", item_list[half:], row_start + half)
+    append(
+        temp_dir / "table.xlsx",
+        temp_dir / "delta.xlsx",
+        row_start + half,
+        row_start + item_count - 1,
+        delta_image_map,
+        image_path_map,
+    )
+    generate(temp_dir / "full.xlsx", item_list)
+
+    appended = openpyxl.load_workbook(temp_dir / "table.xlsx").worksheets[0]
+    full = openpyxl.load_workbook(temp_dir / "full.xlsx").worksheets[0]
+
+    assert appended.max_row == full.max_row
+    for appended_row, full_row in zip(appended.iter_rows(), full.iter_rows()):
+        for appended_cell, full_cell in zip(appended_row, full_row):
+            assert appended_cell.value == full_cell.value
+            assert appended_cell.number_format == full_cell.number_format
+            assert (appended_cell.hyperlink is None) == (full_cell.hyperlink is None)
+            if appended_cell.hyperlink is not None:
+                assert appended_cell.hyperlink.target == full_cell.hyperlink.target
+    assert appended.auto_filter.ref == full.auto_filter.ref
+    assert len(appended._images) == len(full._images) == item_count
+    for appended_img, full_img in zip(appended._images, full._images):
+        assert appended_img.anchor._from.row == full_img.anchor._from.row
+        assert appended_img._data() == full_img._data()
+    assert len(image_path_map) == min(len(thumb_list), item_count)
+
+    def assert_append_error(file_path, message):
+        file_stat = get_file_stat(file_path)
+        try:
+            append(
+                file_path,
+                temp_dir / "delta.xlsx",
+                row_start + half,
+                row_start + item_count - 1,
+                delta_image_map,
+                {},
+            )
+        except ValueError as e:
+            assert message in str(e), str(e)
+        else:
+            raise AssertionError("ValueError is not raised")
+        assert get_file_stat(file_path) == file_stat
+
+    # NOTE: 画像がまだ無いファイルには追記できない (呼び出し側で作り直す)
+    generate(temp_dir / "no_drawing.xlsx", item_list[:half], thumb_func=lambda item: None)
+    assert_append_error(temp_dir / "no_drawing.xlsx", DRAWING_PATH)
+
+    # NOTE: Excel 等で保存し直して，シートの構成が変わった場合も追記できない
+    with zipfile.ZipFile(temp_dir / "full.xlsx") as src_zip:
+        with zipfile.ZipFile(temp_dir / "other_sheet.xlsx", "w") as dst_zip:
+            for info in src_zip.infolist():
+                buf = src_zip.read(info)
+                if info.filename == SHEET_PATH:
+                    buf = buf.replace(b"<sheetData", b"<x:sheetData").replace(
+                        b"</sheetData>", b"</x:sheetData>"
+                    )
+                dst_zip.writestr(info, buf)
+    assert_append_error(temp_dir / "other_sheet.xlsx", SHEET_PATH)
+
+    logging.info("OK")
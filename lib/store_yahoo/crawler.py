@@ -10,22 +10,26 @@ Options:
   -c CONFIG     : CONFIG を設定ファイルとして読み込んで実行します．[default: config.yaml]
 """
 
+import concurrent.futures
 import logging
 import random
 import math
 import re
 import datetime
-import time
 import traceback
+import urllib.parse
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 
 import store_yahoo.const
 import store_yahoo.handle
+import store_yahoo.parser
 
 import local_lib.captcha
 import local_lib.selenium_util
+import local_lib.http_util
+import local_lib.work_queue
 
 STATUS_ORDER_COUNT = "[collect] Count of year"
 STATUS_ORDER_ITEM_ALL = "[collect] All orders"
@@ -34,20 +38,69 @@ STATUS_ORDER_ITEM_BY_YEAR = "[collect] Year {year} orders"
 LOGIN_RETRY_COUNT = 2
 FETCH_RETRY_COUNT = 3
 
+ORDER_LIST_KEY = ["seller", "no", "kind", "onclick"]
+ITEM_LIST_KEY = ["name", "url", "price_text", "count_text", "thumb_url"]
+
+
+ITEM_XPATH = (
+    '//div[contains(@class, "mdOrderItem")]/div[contains(@class, "elItem")]/ul[contains(@class, "elList")]/li'
+)
+
+# NOTE: 注文一覧ページの情報を 1 回の execute_script でまとめて取得する
+ORDER_LIST_SCRIPT = """
+const getText = (elem) => (elem === null ? null : elem.innerText.trim());
+
+return Array.from(document.querySelectorAll('li[class*="elOrderItem"]')).map((dateElem) => ({
+    date: getText(dateElem.querySelector('p[class*="elDate"] > span')),
+    order_list: Array.from(dateElem.querySelectorAll('li[class*="elItemList"]')).map((orderElem) => {
+        const button = orderElem.querySelector('div[class*="elControl"] > p[class*="elButton"] > a');
+        return {
+            onclick: button === null ? null : button.getAttribute("onclick"),
+            kind: button === null ? null : getText(button.querySelector(":scope > span")),
+            no: getText(orderElem.querySelector('dd[class*="elOrderData"]')),
+            seller: getText(
+                orderElem.querySelector('div[class*="elStoreInfo"] > p[class*="elName"] > a > span')
+            ),
+        };
+    }),
+}));
+"""
 
-def wait_for_loading(handle, xpath='//div[@class="front-delivery-display"]', sec=1):
-    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+# NOTE: 注文詳細ページの商品情報を 1 回の execute_script でまとめて取得する
+ITEM_LIST_SCRIPT = """
+const getText = (elem) => (elem === null ? null : elem.innerText.trim());
+
+return Array.from(
+    document.querySelectorAll('div[class*="mdOrderItem"] > div[class*="elItem"] > ul[class*="elList"] > li')
+).map((itemElem) => {
+    const link = itemElem.querySelector('dl[class*="elDetail"] > dd[class*="elName"] > a');
+    const image = itemElem.querySelector('dl[class*="elDetail"] > dt[class*="elImage"] > a > img');
+    return {
+        name: link === null ? null : getText(link.querySelector(":scope > span")),
+        url: link === null ? null : link.href,
+        price_text: getText(itemElem.querySelector('dd[class*="elInfo"] > span[class="elPrice"]')),
+        count_text: getText(itemElem.querySelector('dd[class*="elInfo"] > span[class="elNum"]')),
+        thumb_url: image === null ? null : image.src,
+    };
+});
+"""
 
-    wait.until(EC.visibility_of_all_elements_located((By.XPATH, xpath)))
-    time.sleep(sec)
 
+class LoginError(Exception):
+    # NOTE: ログインできない場合は，以降の処理も全て失敗するので，リトライせずに中断する
+    pass
 
-def parse_date(date_text):
-    return datetime.datetime.strptime(date_text, "%Y年%m月%d日")
 
+def wait_for_loading(handle, xpath='//div[@class="front-delivery-display"]'):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-def parse_datetime(datetime_text):
-    return datetime.datetime.strptime(datetime_text, "%Y年%m月%d日 %H:%M")
+    wait.until(EC.visibility_of_all_elements_located((By.XPATH, xpath)))
+    local_lib.selenium_util.wait_for_ready(driver, wait)
+
+
+def wait_for_pace(handle):
+    # NOTE: アクセス間隔の調整はここでのみ行う
+    store_yahoo.handle.get_rate_limiter(handle).acquire()
 
 
 def gen_hist_url(year, page):
@@ -56,12 +109,6 @@ def gen_hist_url(year, page):
     )
 
 
-def gen_item_id_from_url(url):
-    m = re.match(r"https://store.shopping.yahoo.co.jp/([^/]+)/([^.]+).html", url)
-
-    return "{store_id}_{item_id}".format(store_id=m.group(1), item_id=m.group(2))
-
-
 def gen_order_url_from_no(no):
     m = re.match(r"(.*)-(\d+)$", no)
     store_id = m.group(1)
@@ -75,27 +122,145 @@ def gen_status_label_by_year(year):
 
 def visit_url(handle, url, xpath='//div[@class="front-delivery-display"]'):
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    wait_for_pace(handle)
     driver.get(url)
 
-    wait_for_loading(handle, xpath)
+    try:
+        wait_for_loading(handle, xpath)
+    except:
+        store_yahoo.handle.get_rate_limiter(handle).failure()
+        raise
+
+    store_yahoo.handle.get_rate_limiter(handle).success()
+    store_yahoo.handle.update_network_stat(handle)
+
+
+def is_login_required(res):
+    return (urllib.parse.urlparse(res.url).hostname == "login.yahoo.co.jp") or (
+        store_yahoo.parser.is_login_required(res.text)
+    )
+
+
+def fetch_response(handle, url):
+    try:
+        return local_lib.http_util.fetch(
+            store_yahoo.handle.get_http_session(handle),
+            url,
+            limit=store_yahoo.handle.get_http_throttle(handle),
+        )
+    except:
+        store_yahoo.handle.get_rate_limiter(handle).failure()
+        raise
+
+
+def fetch_page(handle, url, is_check_login=True, is_recover=True):
+    res = fetch_response(handle, url)
+
+    if is_check_login and is_login_required(res):
+        store_yahoo.handle.get_rate_limiter(handle).failure()
+
+        if not is_recover:
+            raise LoginError("ログインが必要です．")
+
+        # NOTE: セッションが切れていたら，ブラウザでログインし直してから Cookie を引き継ぐ
+        logging.info("Session is not valid, recover it with the browser")
+
+        visit_url(handle, url)
+        keep_logged_on(handle)
+
+        store_yahoo.handle.renew_http_session(handle)
+        res = fetch_response(handle, url)
+
+        if is_login_required(res):
+            raise LoginError("ログイン状態を引き継げませんでした．")
+
+    store_yahoo.handle.get_rate_limiter(handle).success()
+
+    return res.text
 
 
 def save_thumbnail(handle, item, thumb_url):
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-    with local_lib.selenium_util.browser_tab(driver, thumb_url):
-        png_data = driver.find_element(By.XPATH, "//img").screenshot_as_png
+    wait_for_pace(handle)
+    with local_lib.selenium_util.browser_tab(
+        driver, thumb_url, store_yahoo.handle.get_blocked_url_list(handle, "thumb")
+    ):
+        png_data = wait.until(EC.presence_of_element_located((By.XPATH, "//img"))).screenshot_as_png
+
+        store_yahoo.handle.save_thumb(handle, item, png_data, "image/png")
+
+    store_yahoo.handle.set_thumb_stat(handle, item, {"content_type": "image/png", "size": len(png_data)})
+
+
+def save_thumbnail_by_http(handle, item, thumb_url):
+    content, thumb_stat = local_lib.http_util.fetch_content(
+        store_yahoo.handle.get_http_session(handle),
+        thumb_url,
+        limit=store_yahoo.handle.get_http_throttle(handle),
+    )
+
+    store_yahoo.handle.save_thumb(handle, item, content, thumb_stat["content_type"])
+    store_yahoo.handle.set_thumb_stat(handle, item, thumb_stat)
 
-        with open(store_yahoo.handle.get_thumb_path(handle, item), "wb") as f:
-            f.write(png_data)
+
+def save_thumbnail_list(handle, thumb_list):
+    if store_yahoo.handle.get_thumb_mode(handle) != "http":
+        for item, thumb_url in thumb_list:
+            save_thumbnail(handle, item, thumb_url)
+        return
+
+    # NOTE: ワーカーはブラウザを操作できないので，Cookie の引き継ぎは投入前に済ませておく
+    store_yahoo.handle.get_http_session(handle)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(store_yahoo.handle.get_worker_count(handle), 1)
+    ) as executor:
+        future_list = list(
+            map(
+                lambda thumb: (thumb[0], thumb[1], executor.submit(save_thumbnail_by_http, handle, *thumb)),
+                thumb_list,
+            )
+        )
+
+    for item, thumb_url, future in future_list:
+        try:
+            future.result()
+        except:
+            # NOTE: 画像を直接取得できなかった場合は，ブラウザでのスクリーンショットで代用する
+            logging.warning(
+                "Failed to download thumbnail of {id}, fallback to screenshot".format(id=item["id"])
+            )
+            logging.debug(traceback.format_exc())
+            submit_task(
+                handle,
+                "thumb",
+                item["id"],
+                {"item": {"id": item["id"]}, "thumb_url": thumb_url},
+                lambda: save_thumbnail(handle, item, thumb_url),
+            )
 
 
 def fetch_item_detail(handle, item):
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        item["category"] = store_yahoo.parser.parse_item_category(
+            fetch_page(handle, item["url"], is_check_login=False)
+        )
+        return
+
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-    with local_lib.selenium_util.browser_tab(driver, item["url"]):
+    wait_for_pace(handle)
+    with local_lib.selenium_util.browser_tab(
+        driver, item["url"], store_yahoo.handle.get_blocked_url_list(handle, "crawl")
+    ):
         wait_for_loading(handle, '//div[contains(@class, "Masthead")]')
 
+        if store_yahoo.handle.get_extract_mode(handle) == "lxml":
+            item["category"] = store_yahoo.parser.parse_item_category(driver.page_source)
+            return
+
         breadcrumb_list = driver.find_elements(By.XPATH, '//div[contains(@id, "bclst")]/ol/li')
         category = list(map(lambda x: x.text, breadcrumb_list))
 
@@ -106,49 +271,178 @@ def fetch_item_detail(handle, item):
         item["category"] = category
 
 
-def parse_item(handle, item_xpath):
+def parse_item_list_by_xpath(handle):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    item_list = []
+    for i in range(len(driver.find_elements(By.XPATH, ITEM_XPATH))):
+        item_xpath = "(" + ITEM_XPATH + ")[{index}]".format(index=i + 1)
+
+        name = driver.find_element(
+            By.XPATH,
+            item_xpath + '//dl[contains(@class, "elDetail")]/dd[contains(@class, "elName")]/a/span',
+        ).text
+
+        url = driver.find_element(
+            By.XPATH,
+            item_xpath + '//dl[contains(@class, "elDetail")]/dd[contains(@class, "elName")]/a',
+        ).get_attribute("href")
+
+        price_text = driver.find_element(
+            By.XPATH, item_xpath + '//dd[contains(@class, "elInfo")]/span[@class="elPrice"]'
+        ).text
+
+        count_text = driver.find_element(
+            By.XPATH, item_xpath + '//dd[contains(@class, "elInfo")]/span[@class="elNum"]'
+        ).text
+
+        thumb_url = driver.find_element(
+            By.XPATH,
+            item_xpath + '//dl[contains(@class, "elDetail")]/dt[contains(@class, "elImage")]/a/img',
+        ).get_attribute("src")
+
+        item_list.append(
+            {
+                "name": name,
+                "url": url,
+                "price_text": price_text,
+                "count_text": count_text,
+                "thumb_url": thumb_url,
+            }
+        )
+
+    return item_list
+
+
+def parse_item_list_by_script(handle):
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-    name = driver.find_element(
-        By.XPATH,
-        item_xpath + '//dl[contains(@class, "elDetail")]/dd[contains(@class, "elName")]/a/span',
-    ).text
+    try:
+        item_list = driver.execute_script(ITEM_LIST_SCRIPT)
+    except:
+        logging.warning(traceback.format_exc())
+        return None
 
-    url = driver.find_element(
-        By.XPATH,
-        item_xpath + '//dl[contains(@class, "elDetail")]/dd[contains(@class, "elName")]/a',
-    ).get_attribute("href")
+    if not isinstance(item_list, list):
+        return None
 
-    item_id = gen_item_id_from_url(url)
+    for item_info in item_list:
+        # NOTE: 想定と異なる構造の場合は None を返し，XPath による解析に任せる
+        if (not isinstance(item_info, dict)) or (not all(map(lambda key: item_info.get(key), ITEM_LIST_KEY))):
+            return None
+        try:
+            store_yahoo.parser.parse_price(item_info["price_text"])
+            store_yahoo.parser.parse_count(item_info["count_text"])
+            store_yahoo.parser.gen_item_id_from_url(item_info["url"])
+        except (AttributeError, TypeError):
+            return None
 
-    price_text = driver.find_element(
-        By.XPATH, item_xpath + '//dd[contains(@class, "elInfo")]/span[@class="elPrice"]'
-    ).text
-    price = int(re.match(r".*?(\d{1,3}(?:,\d{3})*)", price_text).group(1).replace(",", ""))
+    return item_list
 
-    count_text = driver.find_element(
-        By.XPATH, item_xpath + '//dd[contains(@class, "elInfo")]/span[@class="elNum"]'
-    ).text
-    count = int(re.match(r"\D+(\d+)", count_text).group(1))
 
-    item = {"name": name, "price": price, "count": count, "url": url, "id": item_id}
+def parse_item_list(handle):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-    fetch_item_detail(handle, item)
+    if store_yahoo.handle.get_extract_mode(handle) == "lxml":
+        return store_yahoo.parser.parse_item_list(driver.page_source, driver.current_url)
+    elif store_yahoo.handle.get_extract_mode(handle) == "script":
+        item_list = parse_item_list_by_script(handle)
+        if item_list is not None:
+            return item_list
+
+        logging.warning("Failed to parse item list by script, fallback to XPath")
 
-    thumb_url = driver.find_element(
-        By.XPATH,
-        item_xpath + '//dl[contains(@class, "elDetail")]/dt[contains(@class, "elImage")]/a/img',
-    ).get_attribute("src")
-    save_thumbnail(handle, item, thumb_url)
+    return parse_item_list_by_xpath(handle)
+
+
+def parse_item(handle, item_info):
+    item = store_yahoo.parser.build_item(item_info)
+
+    item_meta = store_yahoo.handle.get_item_meta(handle, item["id"])
+    if item_meta is not None:
+        logging.debug("Item detail of {id} [cached]".format(id=item["id"]))
+        item["category"] = item_meta["category"]
+        return item
+
+    if "category" in item_info:
+        item["category"] = item_info["category"]
+    elif not submit_task(
+        handle,
+        "item",
+        item["id"],
+        {"id": item["id"], "name": item["name"], "url": item["url"]},
+        lambda: fetch_item_detail(handle, item),
+    ):
+        # NOTE: カテゴリは後でリトライした時に埋める
+        item["category"] = []
+        return item
+
+    store_yahoo.handle.set_item_meta(handle, item)
 
     return item
 
 
-def parse_order(handle, order_info):
-    ITEM_XPATH = '//div[contains(@class, "mdOrderItem")]/div[contains(@class, "elItem")]/ul[contains(@class, "elList")]/li'
+def fetch_order_detail(handle, order_info, is_recover=True):
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        url = gen_order_url_from_no(order_info["no"])
+        html = fetch_page(handle, url, is_recover=is_recover)
+
+        return {
+            "date": store_yahoo.parser.parse_order_date(html),
+            "item_info_list": store_yahoo.parser.parse_item_list(html, url),
+        }
 
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
+    if store_yahoo.handle.get_extract_mode(handle) == "lxml":
+        date = store_yahoo.parser.parse_order_date(driver.page_source)
+    else:
+        datetime_label = driver.find_element(
+            By.XPATH, '//div[contains(@class, "elOrderInfo")]/p[@class="elOrderDate"]'
+        ).text
+        date = store_yahoo.parser.parse_order_datetime(datetime_label)
+
+    return {"date": date, "item_info_list": parse_item_list(handle)}
+
+
+def prefetch_order_detail(handle, order_info):
+    # NOTE: ワーカースレッドで実行されるので，ブラウザは操作しない
+    order_detail = fetch_order_detail(handle, order_info, is_recover=False)
+
+    for item_info in order_detail["item_info_list"]:
+        item_id = store_yahoo.parser.gen_item_id_from_url(item_info["url"])
+        if store_yahoo.handle.get_item_meta(handle, item_id) is not None:
+            continue
+
+        item_info["category"] = store_yahoo.parser.parse_item_category(
+            fetch_page(handle, item_info["url"], is_check_login=False)
+        )
+
+    return order_detail
+
+
+def prefetch_order_detail_list(handle, executor, order_list):
+    return {
+        order_info["no"]: executor.submit(prefetch_order_detail, handle, order_info)
+        for order_info in order_list
+        if not store_yahoo.handle.get_order_stat(handle, order_info["no"])
+    }
+
+
+def get_prefetched_order_detail(future_map, order_info):
+    if order_info["no"] not in future_map:
+        return None
+
+    try:
+        return future_map[order_info["no"]].result()
+    except:
+        # NOTE: 失敗した場合は，改めて逐次処理で取得する
+        logging.warning("Failed to prefetch order of {no}, retry sequentially".format(no=order_info["no"]))
+        logging.debug(traceback.format_exc())
+        return None
+
+
+def parse_order(handle, order_info, order_detail=None):
     logging.info(
         "Parse order: {date} - {seller} - {no}".format(
             date=order_info["date"].strftime("%Y-%m-%d"),
@@ -157,79 +451,41 @@ def parse_order(handle, order_info):
         )
     )
 
-    datetime_label = driver.find_element(
-        By.XPATH, '//div[contains(@class, "elOrderInfo")]/p[@class="elOrderDate"]'
-    ).text
-    datetime_text = re.match(r".*日時：(.*)", datetime_label).group(1)
-    date = parse_datetime(datetime_text)
+    if order_detail is None:
+        order_detail = fetch_order_detail(handle, order_info)
 
     item_base = {
-        "date": date,
+        "date": order_detail["date"],
         "no": order_info["no"],
         "seller": order_info["seller"],
         "kind": order_info["kind"],
     }
 
-    is_unempty = False
-    for i in range(len(driver.find_elements(By.XPATH, ITEM_XPATH))):
-        item_xpath = "(" + ITEM_XPATH + ")[{index}]".format(index=i + 1)
-
-        item = parse_item(handle, item_xpath)
+    item_list = []
+    thumb_list = []
+    for item_info in order_detail["item_info_list"]:
+        item = parse_item(handle, item_info)
         item |= item_base
 
-        logging.info("{name} {price:,}円".format(name=item["name"], price=item["price"]))
-
-        store_yahoo.handle.record_item(handle, item)
-        is_unempty = True
-
-    return is_unempty
+        item_list.append(item)
+        if not store_yahoo.handle.get_item_thumb_cached(handle, item):
+            thumb_list.append((item, item_info["thumb_url"]))
 
+    save_thumbnail_list(handle, thumb_list)
 
-def fetch_order_item_list_by_order_info(handle, order_info):
-    wait_for_loading(handle)
+    for item in item_list:
+        logging.info("{name} {price:,}円".format(name=item["name"], price=item["price"]))
 
-    if not parse_order(handle, order_info):
-        logging.warning("Failed to parse order of {no}".format(no=order_info["no"]))
+    store_yahoo.handle.record_order(handle, item_list)
 
-    time.sleep(1)
+    return len(item_list) != 0
 
 
-def skip_order_item_list_by_year_page(handle, year, page):
-    logging.info("Skip check order of {year} page {page} [cached]".format(year=year, page=page))
-    incr_order = min(
-        store_yahoo.handle.get_order_count(handle, year)
-        - store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).count,
-        store_yahoo.const.ORDER_COUNT_PER_PAGE,
-    )
-    store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).update(incr_order)
-    store_yahoo.handle.get_progress_bar(handle, STATUS_ORDER_ITEM_ALL).update(incr_order)
-
-    # NOTE: これ，状況によっては最終ページで成り立たないので，良くない
-    return incr_order != store_yahoo.const.ORDER_COUNT_PER_PAGE
-
-
-def fetch_order_item_list_by_year_page(handle, year, page, retry=0):
+def parse_order_list_by_xpath(handle):
     ORDER_DATE_XPATH = '//li[contains(@class, "elOrderItem")]'
 
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
-    total_page = math.ceil(
-        store_yahoo.handle.get_order_count(handle, year) / store_yahoo.const.ORDER_COUNT_PER_PAGE
-    )
-
-    store_yahoo.handle.set_status(
-        handle,
-        "注文履歴を解析しています... {year}年 {page}/{total_page} ページ".format(year=year, page=page, total_page=total_page),
-    )
-
-    visit_url(handle, gen_hist_url(year, page))
-    keep_logged_on(handle)
-
-    logging.info(
-        "Check order of {year} page {page}/{total_page}".format(year=year, page=page, total_page=total_page)
-    )
-    logging.info("URL: {url}".format(url=driver.current_url))
-
     order_list = []
     for i in range(len(driver.find_elements(By.XPATH, ORDER_DATE_XPATH))):
         order_date_xpath = "(" + ORDER_DATE_XPATH + "[{index}])".format(index=i + 1)
@@ -237,7 +493,7 @@ def fetch_order_item_list_by_year_page(handle, year, page, retry=0):
         date_text = driver.find_element(
             By.XPATH, order_date_xpath + '//p[contains(@class, "elDate")]/span'
         ).text
-        date = parse_date(date_text)
+        date = store_yahoo.parser.parse_date(date_text)
 
         order_xpath_base = order_date_xpath + '//li[contains(@class, "elItemList")]'
         for j in range(len(driver.find_elements(By.XPATH, order_xpath_base))):
@@ -252,10 +508,7 @@ def fetch_order_item_list_by_year_page(handle, year, page, retry=0):
                 By.XPATH,
                 order_xpath + '//div[contains(@class, "elControl")]/p[contains(@class,"elButton")]/a/span',
             ).text
-            if re.match(r"寄付詳細", kind_text):
-                kind = "tax"
-            else:
-                kind = "normal"
+            kind = store_yahoo.parser.parse_order_kind(kind_text)
 
             no = driver.find_element(By.XPATH, order_xpath + '//dd[contains(@class, "elOrderData")]').text
 
@@ -266,39 +519,359 @@ def fetch_order_item_list_by_year_page(handle, year, page, retry=0):
 
             order_list.append({"date": date, "seller": seller, "no": no, "kind": kind, "onclick": onclick})
 
-    for order_info in order_list:
-        if not store_yahoo.handle.get_order_stat(handle, order_info["no"]):
-            driver.execute_script(order_info["onclick"])
-            fetch_order_item_list_by_order_info(handle, order_info)
-            driver.back()
-        else:
-            logging.info(
-                "Done order: {date} - {no} [cached]".format(
-                    date=order_info["date"].strftime("%Y-%m-%d"), no=order_info["no"]
-                )
+    return order_list
+
+
+def parse_order_list_by_script(handle):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    try:
+        date_list = driver.execute_script(ORDER_LIST_SCRIPT)
+    except:
+        logging.warning(traceback.format_exc())
+        return None
+
+    if not isinstance(date_list, list):
+        return None
+
+    order_list = []
+    for date_info in date_list:
+        # NOTE: 想定と異なる構造の場合は None を返し，XPath による解析に任せる
+        if (not isinstance(date_info, dict)) or (not isinstance(date_info.get("order_list"), list)):
+            return None
+        try:
+            date = store_yahoo.parser.parse_date(date_info["date"])
+        except (TypeError, ValueError):
+            return None
+
+        for order in date_info["order_list"]:
+            if (not isinstance(order, dict)) or (not all(map(lambda key: order.get(key), ORDER_LIST_KEY))):
+                return None
+
+            order_list.append(
+                {
+                    "date": date,
+                    "seller": order["seller"],
+                    "no": order["no"],
+                    "kind": store_yahoo.parser.parse_order_kind(order["kind"]),
+                    "onclick": order["onclick"],
+                }
             )
 
-        store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).update()
-        store_yahoo.handle.get_progress_bar(handle, STATUS_ORDER_ITEM_ALL).update()
+    return order_list
+
+
+def parse_order_list(handle):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    if store_yahoo.handle.get_extract_mode(handle) == "lxml":
+        return store_yahoo.parser.parse_order_list(driver.page_source, driver.current_url)
+    elif store_yahoo.handle.get_extract_mode(handle) == "script":
+        order_list = parse_order_list_by_script(handle)
+        if order_list is not None:
+            return order_list
+
+        logging.warning("Failed to parse order list by script, fallback to XPath")
+
+    return parse_order_list_by_xpath(handle)
+
+
+def fetch_order_item_list_by_order_info(handle, order_info, order_detail=None):
+    if store_yahoo.handle.get_fetch_mode(handle) != "http":
+        wait_for_loading(handle)
+
+    if not parse_order(handle, order_info, order_detail):
+        logging.warning("Failed to parse order of {no}".format(no=order_info["no"]))
 
-        if year == datetime.datetime.now().year:
-            last_item = store_yahoo.handle.get_last_item(handle, year)
-            if (
-                store_yahoo.handle.get_year_checked(handle, year)
-                and (last_item != None)
-                and (last_item["no"] == order_info["no"])
-            ):
-                logging.info("Latest order found, skipping analysis of subsequent pages")
-                for i in range(total_page):
-                    store_yahoo.handle.set_page_checked(handle, year, i + 1)
+
+def run_task(handle, task, func):
+    queue = store_yahoo.handle.get_work_queue(handle)
+
+    try:
+        func()
+    except LoginError:
+        raise
+    except Exception:
+        logging.warning(traceback.format_exc())
+        local_lib.work_queue.fail(
+            queue,
+            task,
+            traceback.format_exc().splitlines()[-1],
+            store_yahoo.handle.get_retry_config(handle).get("count", FETCH_RETRY_COUNT),
+            store_yahoo.handle.get_retry_config(handle).get("backoff", local_lib.work_queue.BACKOFF_SEC),
+        )
+        return False
+
+    local_lib.work_queue.complete(queue, task)
+
+    return True
+
+
+def submit_task(handle, stage, key, payload, func):
+    task = local_lib.work_queue.push(store_yahoo.handle.get_work_queue(handle), stage, key, payload)
+
+    return run_task(handle, task, func)
+
+
+def prepare_progress_bar(handle, year):
+    for desc in [STATUS_ORDER_ITEM_ALL, gen_status_label_by_year(year)]:
+        if not store_yahoo.handle.has_progress_bar(handle, desc):
+            store_yahoo.handle.set_progress_bar(handle, desc, None)
+
+
+def retry_list_task(handle, payload):
+    prepare_progress_bar(handle, payload["year"])
+
+    fetch_order_item_list_by_year_page(handle, payload["year"], payload["page"])
+    store_yahoo.handle.set_page_checked(handle, payload["year"], payload["page"])
+
+
+def retry_order_task(handle, order_info):
+    if store_yahoo.handle.get_order_stat(handle, order_info["no"]):
+        return
+
+    if store_yahoo.handle.get_fetch_mode(handle) != "http":
+        visit_order_page(handle, order_info, None)
+
+    fetch_order_item_list_by_order_info(handle, order_info)
+
+    if order_info.get("is_uncounted", False) and store_yahoo.handle.get_order_stat(handle, order_info["no"]):
+        store_yahoo.handle.add_order_count(handle, order_info["date"].year, 1)
+
+
+def retry_item_task(handle, payload):
+    item = payload.copy()
+
+    fetch_item_detail(handle, item)
+
+    store_yahoo.handle.set_item_meta(handle, item)
+    store_yahoo.handle.update_item_category(handle, item["id"], item["category"])
+
+
+def retry_thumb_task(handle, payload):
+    if store_yahoo.handle.get_thumb_mode(handle) == "http":
+        try:
+            save_thumbnail_by_http(handle, payload["item"], payload["thumb_url"])
+            return
+        except:
+            logging.debug(traceback.format_exc())
+
+    save_thumbnail(handle, payload["item"], payload["thumb_url"])
+
+
+def process_work_queue(handle):
+    TASK_FUNC = {
+        "list": retry_list_task,
+        "order": retry_order_task,
+        "item": retry_item_task,
+        "thumb": retry_thumb_task,
+    }
+
+    queue = store_yahoo.handle.get_work_queue(handle)
+
+    if len(local_lib.work_queue.get_task_list(queue)) != 0:
+        logging.info(
+            "Process {count} pending task(s)".format(count=len(local_lib.work_queue.get_task_list(queue)))
+        )
+        store_yahoo.handle.set_status(handle, "失敗した処理をやり直しています...")
+
+    while True:
+        task = local_lib.work_queue.pop_ready(queue)
+        if task is None:
+            break
+
+        logging.info("Retry task {id}".format(id=task["id"]))
+        run_task(handle, task, lambda: TASK_FUNC[task["stage"]](handle, task["payload"]))
+
+        store_yahoo.handle.store_order_info(handle)
+
+    dead_list = local_lib.work_queue.get_dead_list(queue)
+    if len(dead_list) != 0:
+        logging.warning("{count} task(s) failed permanently".format(count=len(dead_list)))
+        for task in dead_list:
+            logging.warning("  {id}: {error}".format(id=task["id"], error=task["error"]))
+
+
+def fetch_order(handle, order_info, order_detail=None, next_order_info=None):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        fetch_order_item_list_by_order_info(handle, order_info, order_detail)
+    elif store_yahoo.handle.get_navigate_mode(handle) == "url":
+        # NOTE: 一覧ページには戻らず，注文詳細ページを URL で直接開く
+        visit_order_page(handle, order_info, next_order_info)
+        fetch_order_item_list_by_order_info(handle, order_info)
+    else:
+        wait_for_pace(handle)
+        # NOTE: 詳細ページにも一覧ページと同じ要素があるので，一覧ページが無効になるのを待つ
+        page_elem = driver.find_element(By.TAG_NAME, "html")
+        driver.execute_script(order_info["onclick"])
+        local_lib.selenium_util.wait_for_transition(driver, wait, page_elem)
+
+        fetch_order_item_list_by_order_info(handle, order_info)
+
+        page_elem = driver.find_element(By.TAG_NAME, "html")
+        driver.back()
+        local_lib.selenium_util.wait_for_transition(driver, wait, page_elem)
+
+
+def visit_order_page(handle, order_info, next_order_info):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    visit_url(handle, gen_order_url_from_no(order_info["no"]))
+
+    if next_order_info is not None:
+        local_lib.selenium_util.prefetch_url(driver, gen_order_url_from_no(next_order_info["no"]))
+
+
+def is_concurrent_mode(handle):
+    # NOTE: WebDriver はスレッドセーフではないので，並列化は HTTP で取得する場合のみ
+    return (store_yahoo.handle.get_fetch_mode(handle) == "http") and (
+        store_yahoo.handle.get_worker_count(handle) > 1
+    )
+
+
+def skip_order_item_list_by_year_page(handle, year, page):
+    logging.info("Skip check order of {year} page {page} [cached]".format(year=year, page=page))
+    incr_order = min(
+        store_yahoo.handle.get_order_count(handle, year)
+        - store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).count,
+        store_yahoo.const.ORDER_COUNT_PER_PAGE,
+    )
+    store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).update(incr_order)
+    store_yahoo.handle.get_progress_bar(handle, STATUS_ORDER_ITEM_ALL).update(incr_order)
+
+    # NOTE: これ，状況によっては最終ページで成り立たないので，良くない
+    return incr_order != store_yahoo.const.ORDER_COUNT_PER_PAGE
+
+
+def get_total_page(handle, year):
+    return math.ceil(
+        store_yahoo.handle.get_order_count(handle, year) / store_yahoo.const.ORDER_COUNT_PER_PAGE
+    )
+
+
+def fetch_order_list_page(handle, year, page):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        url = gen_hist_url(year, page)
+        logging.info("URL: {url}".format(url=url))
+
+        return store_yahoo.parser.parse_order_list(fetch_page(handle, url), url)
+    else:
+        visit_url(handle, gen_hist_url(year, page))
+        keep_logged_on(handle)
+
+        logging.info("URL: {url}".format(url=driver.current_url))
+
+        return parse_order_list(handle)
+
+
+def fetch_order_item_list_by_order_list(handle, year, order_list):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
+    if is_concurrent_mode(handle):
+        # NOTE: ワーカーはブラウザを操作できないので，Cookie の引き継ぎは投入前に済ませておく
+        store_yahoo.handle.get_http_session(handle)
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=store_yahoo.handle.get_worker_count(handle)
+        )
+        future_map = prefetch_order_detail_list(handle, executor, order_list)
+    else:
+        executor = None
+        future_map = {}
+
+    # NOTE: 途中で例外が発生しても，先読み中のワーカーを残さない
+    try:
+        pending_order_list = list(
+            filter(
+                lambda order_info: not store_yahoo.handle.get_order_stat(handle, order_info["no"]), order_list
+            )
+        )
+        list_url = driver.current_url
+
+        for order_info in order_list:
+            if not store_yahoo.handle.get_order_stat(handle, order_info["no"]):
+                index = pending_order_list.index(order_info)
+                next_order_info = (
+                    pending_order_list[index + 1] if index + 1 < len(pending_order_list) else None
+                )
+
+                if not submit_task(
+                    handle,
+                    "order",
+                    order_info["no"],
+                    order_info,
+                    lambda: fetch_order(
+                        handle,
+                        order_info,
+                        get_prefetched_order_detail(future_map, order_info),
+                        next_order_info,
+                    ),
+                ) and (store_yahoo.handle.get_fetch_mode(handle) != "http"):
+                    # NOTE: 失敗した注文は後でリトライする．ブラウザは一覧ページに戻しておく
+                    visit_url(handle, list_url)
+            else:
+                logging.info(
+                    "Done order: {date} - {no} [cached]".format(
+                        date=order_info["date"].strftime("%Y-%m-%d"), no=order_info["no"]
+                    )
+                )
+
+            store_yahoo.handle.get_progress_bar(handle, gen_status_label_by_year(year)).update()
+            store_yahoo.handle.get_progress_bar(handle, STATUS_ORDER_ITEM_ALL).update()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def fetch_order_item_list_by_year_page(handle, year, page, retry=0):
+    total_page = get_total_page(handle, year)
+
+    store_yahoo.handle.set_status(
+        handle,
+        "注文履歴を解析しています... {year}年 {page}/{total_page} ページ".format(
+            year=year, page=page, total_page=total_page
+        ),
+    )
+
+    logging.info(
+        "Check order of {year} page {page}/{total_page}".format(year=year, page=page, total_page=total_page)
+    )
+
+    order_list = fetch_order_list_page(handle, year, page)
+    fetch_order_item_list_by_order_list(handle, year, order_list)
+
+    skip_checked_page(handle, year, order_list)
 
     return page >= total_page
 
 
+def skip_checked_page(handle, year, order_list):
+    # NOTE: sync が full の場合も今年の分は毎回巡回し直すので，前回までに収集した最新の注文が
+    # 見つかったら残りのページは省略する．incremental の場合はウォーターマークで同じ判定を
+    # 行うので，fetch_order_item_list_incremental からは呼ばない．
+    if year != datetime.datetime.now().year:
+        return
+
+    last_item = store_yahoo.handle.get_last_item(handle, year)
+    if (
+        store_yahoo.handle.get_year_checked(handle, year)
+        and (last_item is not None)
+        and any(map(lambda order_info: order_info["no"] == last_item["no"], order_list))
+    ):
+        logging.info("Latest order found, skipping analysis of subsequent pages")
+        for i in range(get_total_page(handle, year)):
+            store_yahoo.handle.set_page_checked(handle, year, i + 1)
+
+
 def fetch_order_item_list_by_year(handle, year, start_page=1):
-    visit_url(handle, gen_hist_url(year, start_page))
+    if store_yahoo.handle.get_fetch_mode(handle) != "http":
+        visit_url(handle, gen_hist_url(year, start_page))
 
-    keep_logged_on(handle)
+        keep_logged_on(handle)
 
     year_list = store_yahoo.handle.get_year_list(handle)
 
@@ -317,8 +890,15 @@ def fetch_order_item_list_by_year(handle, year, start_page=1):
     page = start_page
     while True:
         if not store_yahoo.handle.get_page_checked(handle, year, page):
-            is_last = fetch_order_item_list_by_year_page(handle, year, page)
-            store_yahoo.handle.set_page_checked(handle, year, page)
+            if submit_task(
+                handle,
+                "list",
+                "{year}-{page}".format(year=year, page=page),
+                {"year": year, "page": page},
+                lambda: fetch_order_item_list_by_year_page(handle, year, page),
+            ):
+                store_yahoo.handle.set_page_checked(handle, year, page)
+            is_last = page >= get_total_page(handle, year)
         else:
             is_last = skip_order_item_list_by_year_page(handle, year, page)
 
@@ -337,6 +917,12 @@ def fetch_order_item_list_by_year(handle, year, start_page=1):
 def fetch_year_list(handle):
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        year_list = store_yahoo.parser.parse_year_list(fetch_page(handle, gen_hist_url("", 1)))
+        store_yahoo.handle.set_year_list(handle, year_list)
+
+        return year_list
+
     visit_url(handle, gen_hist_url("", 1))
 
     keep_logged_on(handle)
@@ -360,6 +946,9 @@ def fetch_order_count_by_year(handle, year):
 
     store_yahoo.handle.set_status(handle, "注文件数を調べています... {year}年".format(year=year))
 
+    if store_yahoo.handle.get_fetch_mode(handle) == "http":
+        return store_yahoo.parser.parse_order_count(fetch_page(handle, gen_hist_url(year, 1)))
+
     visit_url(handle, gen_hist_url(year, 1))
 
     return int(
@@ -395,10 +984,98 @@ def fetch_order_count(handle):
     store_yahoo.handle.store_order_info(handle)
 
 
-def fetch_order_item_list_all_year(handle):
-    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+def is_incremental_ready(handle, year_list):
+    watermark = store_yahoo.handle.get_watermark(handle)
+
+    if (store_yahoo.handle.get_sync_mode(handle) != "incremental") or (watermark is None):
+        return False
 
+    # NOTE: 前回までの収集が完了している場合のみ，差分だけを収集する
+    return all(
+        map(
+            lambda year: store_yahoo.handle.get_year_checked(handle, year),
+            filter(lambda year: year <= watermark["date"].year, year_list),
+        )
+    )
+
+
+def fetch_order_item_list_incremental(handle, year_list):
+    watermark = store_yahoo.handle.get_watermark(handle)
+
+    logging.info(
+        "Check new orders after {date} - {no}".format(
+            date=watermark["date"].strftime("%Y-%m-%d"), no=watermark["no"]
+        )
+    )
+
+    store_yahoo.handle.set_progress_bar(handle, STATUS_ORDER_ITEM_ALL, None)
+
+    # NOTE: 新しい順に見ていき，既知の注文が現れたらそれ以降は収集済みなので終了する
+    for year in reversed(year_list):
+        if year < watermark["date"].year:
+            break
+
+        store_yahoo.handle.set_progress_bar(handle, gen_status_label_by_year(year), None)
+
+        page = 1
+        while True:
+            store_yahoo.handle.set_status(
+                handle, "新しい注文を探しています... {year}年 {page} ページ".format(year=year, page=page)
+            )
+            logging.info("Check new order of {year} page {page}".format(year=year, page=page))
+
+            order_list = fetch_order_list_page(handle, year, page)
+            # NOTE: 注文数は取得できた注文だけ加える．失敗してリトライ待ちになった注文は，
+            # リトライで取得できた時に加えるので，印を付けておく
+            new_order_list = [
+                order_info | {"is_uncounted": True}
+                for order_info in order_list
+                if not store_yahoo.handle.get_order_stat(handle, order_info["no"])
+            ]
+
+            fetch_order_item_list_by_order_list(handle, year, new_order_list)
+            store_yahoo.handle.add_order_count(
+                handle,
+                year,
+                sum(
+                    map(
+                        lambda order_info: store_yahoo.handle.get_order_stat(handle, order_info["no"]),
+                        new_order_list,
+                    )
+                ),
+            )
+            store_yahoo.handle.store_order_info(handle)
+
+            if len(new_order_list) != len(order_list):
+                logging.info("Known order found, new orders are all collected")
+                store_yahoo.handle.update_watermark(handle)
+                return
+
+            if len(order_list) < store_yahoo.const.ORDER_COUNT_PER_PAGE:
+                break
+
+            page += 1
+
+        store_yahoo.handle.set_year_checked(handle, year)
+
+    store_yahoo.handle.update_watermark(handle)
+
+
+def fetch_order_item_list_all_year(handle):
     year_list = fetch_year_list(handle)
+
+    # NOTE: 前回失敗した処理から再開する
+    process_work_queue(handle)
+
+    if is_incremental_ready(handle, year_list):
+        fetch_order_item_list_incremental(handle, year_list)
+    else:
+        fetch_order_item_list_full(handle, year_list)
+
+    process_work_queue(handle)
+
+
+def fetch_order_item_list_full(handle, year_list):
     fetch_order_count(handle)
 
     store_yahoo.handle.set_progress_bar(
@@ -424,6 +1101,9 @@ def fetch_order_item_list_all_year(handle):
 
     store_yahoo.handle.get_progress_bar(handle, STATUS_ORDER_ITEM_ALL).update()
 
+    store_yahoo.handle.update_watermark(handle)
+    store_yahoo.handle.store_order_info(handle)
+
 
 def fetch_order_item_list(handle):
     store_yahoo.handle.set_status(handle, "巡回ロボットの準備をします...")
@@ -439,9 +1119,24 @@ def fetch_order_item_list(handle):
         )
         raise
 
+    log_network_stat(handle)
+
     store_yahoo.handle.set_status(handle, "注文履歴の収集が完了しました．")
 
 
+def log_network_stat(handle):
+    network_stat = store_yahoo.handle.get_network_stat(handle)
+    if network_stat is None:
+        return
+
+    logging.info(
+        (
+            "Network: {loaded_count:,} requests, {loaded_size:,} bytes loaded / "
+            + "{blocked_count:,} requests, {saved_size:,} bytes (estimated) saved by blocking"
+        ).format(**network_stat)
+    )
+
+
 def execute_login(handle):
     driver, wait = store_yahoo.handle.get_selenium_driver(handle)
 
@@ -468,17 +1163,18 @@ def execute_login(handle):
         driver, '//div[contains(@class, "errorMessage")]/span[contains(text(), "時間をおいてから再度")]'
     ):
         logging.error("It is necessary to leave extra time because of the continuous failures...")
-        raise "ログインの失敗が続いたので，30分空ける必要があります．"
+        raise LoginError("ログインの失敗が続いたので，30分空ける必要があります．")
 
     logging.info("確認コードの対応を行います．")
     code = input("SMS で送られてきた確認コードを入力してください: ")
 
     driver.find_element(By.XPATH, '//input[@id="code"]').send_keys(code)
+    page_elem = driver.find_element(By.TAG_NAME, "html")
     local_lib.selenium_util.click_xpath(
         driver, '//button[contains(@type, "submit") and contains(text(), "ログイン")]'
     )
 
-    time.sleep(2)
+    local_lib.selenium_util.wait_for_transition(driver, wait, page_elem)
 
     if local_lib.selenium_util.xpath_exists(driver, '//div[@class="loginAreaBox"]'):
         local_lib.selenium_util.click_xpath(
@@ -488,11 +1184,12 @@ def execute_login(handle):
         driver.find_element(By.XPATH, '//input[@name="aq_answer"]').send_keys(
             store_yahoo.handle.get_login_mail(handle)
         )
+        page_elem = driver.find_element(By.TAG_NAME, "html")
         local_lib.selenium_util.click_xpath(
             driver, '//button[contains(@type, "submit") and contains(text(), "入力する")]'
         )
 
-        time.sleep(2)
+        local_lib.selenium_util.wait_for_transition(driver, wait, page_elem)
 
 
 def keep_logged_on(handle):
@@ -507,6 +1204,19 @@ def keep_logged_on(handle):
 
     logging.info("Try to login")
 
+    # NOTE: ログインを求められるのはアクセスが多過ぎる兆候でもあるので減速する
+    store_yahoo.handle.get_rate_limiter(handle).failure()
+
+    store_yahoo.handle.set_block_phase(handle, "login")
+    try:
+        keep_logged_on_impl(handle)
+    finally:
+        store_yahoo.handle.set_block_phase(handle, "crawl")
+
+
+def keep_logged_on_impl(handle):
+    driver, wait = store_yahoo.handle.get_selenium_driver(handle)
+
     for i in range(LOGIN_RETRY_COUNT):
         if i != 0:
             logging.info("Retry to login")
@@ -527,7 +1237,7 @@ def keep_logged_on(handle):
         )
 
     logging.error("Give up to login")
-    raise Exception("ログインに失敗しました．")
+    raise LoginError("ログインに失敗しました．")
 
 
 if __name__ == "__main__":
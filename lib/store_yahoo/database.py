@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+収集した購入履歴を SQLite に保存します．
+
+Usage:
+  database.py [-m CACHE] DB
+
+Options:
+  -m CACHE      : 以前の形式のキャッシュ (cache.dat) を DB に取り込みます．
+"""
+
+import datetime
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+
+import local_lib.serializer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    no TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    seller TEXT,
+    kind TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_date ON orders(date);
+
+CREATE TABLE IF NOT EXISTS items (
+    no TEXT NOT NULL REFERENCES orders(no),
+    seq INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    price INTEGER,
+    count INTEGER,
+    url TEXT,
+    category TEXT,
+    date TEXT NOT NULL,
+    PRIMARY KEY (no, seq)
+);
+CREATE INDEX IF NOT EXISTS items_id ON items(id);
+CREATE INDEX IF NOT EXISTS items_date ON items(date);
+
+CREATE TABLE IF NOT EXISTS page_stat (
+    year INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    PRIMARY KEY (year, page)
+);
+
+CREATE TABLE IF NOT EXISTS year_count (
+    year INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    checked INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS thumb_stat (
+    id TEXT PRIMARY KEY,
+    content_type TEXT,
+    size INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+ITEM_COLUMN = "items.no, items.id, items.name, items.price, items.count, items.url, items.category, "
+ITEM_COLUMN += "items.date, orders.seller, orders.kind"
+ITEM_SELECT = "SELECT " + ITEM_COLUMN + " FROM items JOIN orders ON items.no = orders.no"
+
+
+def connect(file_path):
+    conn = sqlite3.connect(str(file_path), check_same_thread=False)
+
+    # NOTE: 書き込み中でも読み出せるように WAL にし，fsync はチェックポイント時に限定する
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+
+    # NOTE: サムネイルは複数スレッドから保存されるので，ロックで排他する
+    return {"conn": conn, "lock": threading.RLock()}
+
+
+def close(db):
+    with db["lock"]:
+        db["conn"].commit()
+        db["conn"].close()
+
+
+def commit(db):
+    with db["lock"]:
+        db["conn"].commit()
+
+
+def is_empty(db):
+    with db["lock"]:
+        return db["conn"].execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0
+
+
+def to_text(date):
+    return date.isoformat(sep=" ")
+
+
+def to_date(text):
+    return datetime.datetime.fromisoformat(text)
+
+
+def to_item(row):
+    return {
+        "no": row[0],
+        "id": row[1],
+        "name": row[2],
+        "price": row[3],
+        "count": row[4],
+        "url": row[5],
+        "category": json.loads(row[6]),
+        "date": to_date(row[7]),
+        "seller": row[8],
+        "kind": row[9],
+    }
+
+
+def upsert_order_impl(conn, item_list):
+    conn.execute(
+        "INSERT INTO orders (no, date, seller, kind) VALUES (?, ?, ?, ?) "
+        + "ON CONFLICT(no) DO UPDATE SET date=excluded.date, seller=excluded.seller, kind=excluded.kind",
+        (item_list[0]["no"], to_text(item_list[0]["date"]), item_list[0]["seller"], item_list[0]["kind"]),
+    )
+    conn.execute("DELETE FROM items WHERE no = ?", (item_list[0]["no"],))
+    conn.executemany(
+        "INSERT INTO items (no, seq, id, name, price, count, url, category, date) "
+        + "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                item["no"],
+                seq,
+                item["id"],
+                item["name"],
+                item["price"],
+                item["count"],
+                item["url"],
+                json.dumps(item["category"], ensure_ascii=False),
+                to_text(item["date"]),
+            )
+            for seq, item in enumerate(item_list)
+        ],
+    )
+
+
+def upsert_order(db, item_list):
+    if len(item_list) == 0:
+        return
+
+    # NOTE: 注文単位でトランザクションにして，途中で中断しても注文の一部だけが残らないようにする
+    with db["lock"], db["conn"]:
+        upsert_order_impl(db["conn"], item_list)
+
+
+def update_item_category(db, item_id, category):
+    with db["lock"]:
+        db["conn"].execute(
+            "UPDATE items SET category = ? WHERE id = ?", (json.dumps(category, ensure_ascii=False), item_id)
+        )
+
+
+def get_item_list(db):
+    # NOTE: 起動時にまとめて読み込み，以降の問い合わせは OrderIndex で行う
+    with db["lock"]:
+        return list(
+            map(to_item, db["conn"].execute(ITEM_SELECT + " ORDER BY items.date, items.no, items.seq"))
+        )
+
+
+def set_page_checked(db, year, page):
+    with db["lock"]:
+        db["conn"].execute("INSERT OR IGNORE INTO page_stat (year, page) VALUES (?, ?)", (year, page))
+
+
+def clear_page_checked(db, year):
+    with db["lock"]:
+        db["conn"].execute("DELETE FROM page_stat WHERE year = ?", (year,))
+
+
+def set_order_count(db, year, order_count):
+    with db["lock"]:
+        db["conn"].execute(
+            "INSERT INTO year_count (year, count) VALUES (?, ?) "
+            + "ON CONFLICT(year) DO UPDATE SET count=excluded.count",
+            (year, order_count),
+        )
+
+
+def set_year_checked(db, year):
+    with db["lock"]:
+        db["conn"].execute(
+            "INSERT INTO year_count (year, checked) VALUES (?, 1) ON CONFLICT(year) DO UPDATE SET checked=1",
+            (year,),
+        )
+
+
+def set_thumb_stat(db, item_id, thumb_stat):
+    with db["lock"]:
+        db["conn"].execute(
+            "INSERT OR REPLACE INTO thumb_stat (id, content_type, size) VALUES (?, ?, ?)",
+            (item_id, thumb_stat["content_type"], thumb_stat["size"]),
+        )
+
+
+def set_meta(db, key, value):
+    with db["lock"]:
+        db["conn"].execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def get_meta(db, key):
+    with db["lock"]:
+        row = db["conn"].execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+    return None if row is None else row[0]
+
+
+def store_meta(db, order):
+    set_meta(db, "year_list", json.dumps(order["year_list"]))
+    set_meta(
+        db,
+        "watermark",
+        (
+            None
+            if order["watermark"] is None
+            else json.dumps({"no": order["watermark"]["no"], "date": to_text(order["watermark"]["date"])})
+        ),
+    )
+    set_meta(db, "last_modified", to_text(order["last_modified"]))
+
+
+def load(db, init_value):
+    order = init_value.copy()
+
+    year_list = get_meta(db, "year_list")
+    if year_list is not None:
+        order["year_list"] = json.loads(year_list)
+
+    watermark = get_meta(db, "watermark")
+    if watermark is not None:
+        watermark = json.loads(watermark)
+        order["watermark"] = {"no": watermark["no"], "date": to_date(watermark["date"])}
+
+    last_modified = get_meta(db, "last_modified")
+    if last_modified is not None:
+        order["last_modified"] = to_date(last_modified)
+
+    with db["lock"]:
+        conn = db["conn"]
+
+        order["year_count"] = {
+            year: count for year, count in conn.execute("SELECT year, count FROM year_count")
+        }
+        order["year_stat"] = {
+            year: True for (year,) in conn.execute("SELECT year FROM year_count WHERE checked = 1")
+        }
+
+        order["page_stat"] = {}
+        for year, page in conn.execute("SELECT year, page FROM page_stat"):
+            order["page_stat"].setdefault(year, {})[page] = True
+
+        order["thumb_stat"] = {
+            item_id: {"content_type": content_type, "size": size}
+            for item_id, content_type, size in conn.execute("SELECT id, content_type, size FROM thumb_stat")
+        }
+        order["order_no_stat"] = {no: True for (no,) in conn.execute("SELECT no FROM orders")}
+
+    order["item_list"] = get_item_list(db)
+
+    return order
+
+
+def migrate(db, cache_file_path, init_value):
+    order = local_lib.serializer.load(cache_file_path, init_value)
+
+    logging.info(
+        "Migrate {count} items from {file_path}".format(
+            count=len(order["item_list"]), file_path=cache_file_path
+        )
+    )
+
+    item_map = {}
+    for item in order["item_list"]:
+        item_map.setdefault(item["no"], []).append(item)
+
+    with db["lock"], db["conn"]:
+        for item_list in item_map.values():
+            upsert_order_impl(db["conn"], item_list)
+
+        for year, order_count in order["year_count"].items():
+            set_order_count(db, year, order_count)
+        for year in order["year_stat"].keys():
+            set_year_checked(db, year)
+        for year, page_stat in order["page_stat"].items():
+            for page in page_stat.keys():
+                set_page_checked(db, year, page)
+        for item_id, thumb_stat in order["thumb_stat"].items():
+            set_thumb_stat(db, item_id, thumb_stat)
+
+        store_meta(db, order)
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    init_value = {
+        "year_list": [],
+        "year_count": {},
+        "year_stat": {},
+        "page_stat": {},
+        "item_list": [],
+        "order_no_stat": {},
+        "thumb_stat": {},
+        "watermark": None,
+        "last_modified": datetime.datetime(1994, 7, 5),
+    }
+
+    db = connect(pathlib.Path(args["DB"]))
+    if args["-m"] is not None:
+        migrate(db, pathlib.Path(args["-m"]), init_value)
+
+    order = load(db, init_value)
+    logging.info(
+        "{order} orders, {item} items, last modified {last_modified}".format(
+            order=len(order["order_no_stat"]),
+            item=len(order["item_list"]),
+            last_modified=order["last_modified"],
+        )
+    )
+    for year in order["year_list"]:
+        year_item_list = list(filter(lambda item: item["date"].year == year, order["item_list"]))
+        logging.info(
+            "{year}: {item}".format(year=year, item=year_item_list[-1] if len(year_item_list) != 0 else None)
+        )
+
+    close(db)
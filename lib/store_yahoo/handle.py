@@ -3,13 +3,41 @@
 import pathlib
 import enlighten
 import datetime
-import functools
+import threading
 
 from selenium.webdriver.support.wait import WebDriverWait
 import openpyxl.styles
 
 import local_lib.serializer
+import local_lib.journal
+import local_lib.lru_cache
+import local_lib.work_queue
 import local_lib.selenium_util
+import local_lib.http_util
+import local_lib.pacing
+import local_lib.pack_store
+import local_lib.scaled_image
+
+import store_yahoo.database
+import store_yahoo.order_index
+import store_yahoo.item_record
+
+# NOTE: 件数に比例して大きくなるものは別のセクションにして，使う時まで復号しない
+THUMB_EXT = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+# NOTE: 以前は画像の形式によらず，この拡張子で保存していた
+THUMB_LEGACY_EXT = ".png"
+
+ORDER_SECTION_KEY_MAP = {
+    "item": ["item_list"],
+    "order": ["order_no_stat"],
+    "thumb": ["thumb_stat"],
+    "page": ["page_stat", "year_stat"],
+}
 
 
 def create(config):
@@ -17,12 +45,17 @@ def create(config):
         "progress_manager": enlighten.get_manager(),
         "progress_bar": {},
         "config": config,
+        "http_lock": threading.Lock(),
     }
 
     load_order_info(handle)
+    load_item_cache(handle)
+    load_work_queue(handle)
 
     prepare_directory(handle)
 
+    load_thumb_store(handle)
+
     return handle
 
 
@@ -34,6 +67,46 @@ def get_login_mail(handle):
     return handle["config"]["login"]["yahoo"]["mail"]
 
 
+def get_crawl_config(handle):
+    return handle["config"].get("crawl", {})
+
+
+def get_extract_mode(handle):
+    return get_crawl_config(handle).get("extract", "script")
+
+
+def get_fetch_mode(handle):
+    return get_crawl_config(handle).get("fetch", "selenium")
+
+
+def get_navigate_mode(handle):
+    return get_crawl_config(handle).get("navigate", "onclick")
+
+
+def get_sync_mode(handle):
+    return get_crawl_config(handle).get("sync", "full")
+
+
+def get_thumb_mode(handle):
+    return get_crawl_config(handle).get("thumb", "http")
+
+
+def get_worker_count(handle):
+    return get_crawl_config(handle).get("worker", 1)
+
+
+def get_pacing_config(handle):
+    return get_crawl_config(handle).get("pacing", {})
+
+
+def get_block_config(handle):
+    return get_crawl_config(handle).get("block", {})
+
+
+def is_block_enabled(handle):
+    return get_block_config(handle).get("enable", False)
+
+
 def prepare_directory(handle):
     get_selenium_data_dir_path(handle).mkdir(parents=True, exist_ok=True)
     get_debug_dir_path(handle).mkdir(parents=True, exist_ok=True)
@@ -47,18 +120,94 @@ def get_excel_font(handle):
     return openpyxl.styles.Font(name=font_config["name"], size=font_config["size"])
 
 
+def get_excel_mode(handle):
+    return handle["config"]["output"]["excel"].get("mode", "normal")
+
+
+def get_excel_split_config(handle):
+    return handle["config"]["output"]["excel"].get("split", {})
+
+
 def get_caceh_file_path(handle):
     return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["order"])
 
 
+def get_item_cache_file_path(handle):
+    if "item" in handle["config"]["data"]["yahoo"]["cache"]:
+        return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["item"])
+    else:
+        return get_caceh_file_path(handle).with_name("item.dat")
+
+
+def get_db_file_path(handle):
+    if "db" in handle["config"]["data"]["yahoo"]["cache"]:
+        return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["db"])
+    else:
+        return None
+
+
+def get_db(handle):
+    return handle.get("db")
+
+
+def is_journal_enabled(handle):
+    return handle["config"]["data"]["yahoo"]["cache"].get("journal", False)
+
+
+def get_journal(handle):
+    return handle.get("journal")
+
+
+def get_queue_file_path(handle):
+    if "queue" in handle["config"]["data"]["yahoo"]["cache"]:
+        return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["queue"])
+    else:
+        return get_caceh_file_path(handle).with_name("queue.dat")
+
+
+def get_cache_codec(handle):
+    return handle["config"]["data"]["yahoo"]["cache"].get("codec")
+
+
+def get_retry_config(handle):
+    return get_crawl_config(handle).get("retry", {})
+
+
+def get_item_cache_config(handle):
+    return get_crawl_config(handle).get("item_cache", {})
+
+
 def get_excel_file_path(handle):
     return pathlib.Path(handle["config"]["base_dir"], handle["config"]["output"]["excel"]["table"])
 
 
+def get_export_file_path(handle, suffix):
+    # NOTE: エクセルファイルと同じ場所に，拡張子だけ変えて出力する
+    return get_excel_file_path(handle).with_suffix(suffix)
+
+
 def get_thumb_dir_path(handle):
     return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["thumb"])
 
 
+def get_thumb_pack_path(handle):
+    if "thumb_pack" in handle["config"]["data"]["yahoo"]["cache"]:
+        return pathlib.Path(
+            handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["thumb_pack"]
+        )
+    else:
+        return None
+
+
+def get_scaled_thumb_path(handle):
+    if "thumb_scaled" in handle["config"]["data"]["yahoo"]["cache"]:
+        return pathlib.Path(
+            handle["config"]["base_dir"], handle["config"]["data"]["yahoo"]["cache"]["thumb_scaled"]
+        )
+    else:
+        return get_thumb_dir_path(handle).with_name("thumb_scaled.pack")
+
+
 def get_selenium_data_dir_path(handle):
     return pathlib.Path(handle["config"]["base_dir"], handle["config"]["data"]["selenium"])
 
@@ -71,7 +220,9 @@ def get_selenium_driver(handle):
     if "selenium" in handle:
         return (handle["selenium"]["driver"], handle["selenium"]["wait"])
     else:
-        driver = local_lib.selenium_util.create_driver("Yahist", get_selenium_data_dir_path(handle))
+        driver = local_lib.selenium_util.create_driver(
+            "Yahist", get_selenium_data_dir_path(handle), is_perf_log=is_block_enabled(handle)
+        )
         wait = WebDriverWait(driver, 5)
 
         local_lib.selenium_util.clear_cache(driver)
@@ -81,28 +232,177 @@ def get_selenium_driver(handle):
             "wait": wait,
         }
 
+        set_block_phase(handle, "crawl")
+
         return (driver, wait)
 
 
+def get_blocked_url_list(handle, phase):
+    if not is_block_enabled(handle):
+        return None
+
+    block_config = get_block_config(handle)
+
+    return local_lib.selenium_util.gen_blocked_url_list(
+        block_config.get("type", []),
+        block_config.get("pattern", []),
+        block_config.get("allow", {}).get(phase, []),
+    )
+
+
+def set_block_phase(handle, phase):
+    if not is_block_enabled(handle):
+        return
+
+    driver, wait = get_selenium_driver(handle)
+    local_lib.selenium_util.set_blocked_url(driver, get_blocked_url_list(handle, phase))
+
+
+def update_network_stat(handle):
+    if not is_block_enabled(handle):
+        return
+
+    if "network_stat" not in handle:
+        handle["network_stat"] = local_lib.selenium_util.create_network_stat()
+
+    driver, wait = get_selenium_driver(handle)
+    local_lib.selenium_util.update_network_stat(driver, handle["network_stat"])
+
+
+def get_network_stat(handle):
+    update_network_stat(handle)
+
+    if "network_stat" not in handle:
+        return None
+
+    return local_lib.selenium_util.summarize_network_stat(handle["network_stat"])
+
+
+def create_http_session(handle):
+    # NOTE: WebDriver はスレッドセーフではないので，Cookie の取得はメインスレッドでのみ行う
+    if threading.current_thread() is not threading.main_thread():
+        raise RuntimeError("HTTP session must be created on the main thread")
+
+    driver, wait = get_selenium_driver(handle)
+
+    # NOTE: ログイン済みの Selenium のセッションを引き継ぐ
+    session = local_lib.http_util.create_session()
+    local_lib.http_util.import_cookie(session, local_lib.selenium_util.get_all_cookies(driver))
+
+    return session
+
+
+def get_http_session(handle):
+    # NOTE: ワーカースレッドから使う場合は，タスクを投入する前にメインスレッドで呼んで作成しておく
+    with handle["http_lock"]:
+        if "http" in handle:
+            return handle["http"]
+
+    session = create_http_session(handle)
+
+    with handle["http_lock"]:
+        handle["http"] = session
+
+    return session
+
+
+def get_rate_limiter(handle):
+    if "rate_limiter" not in handle:
+        pacing_config = get_pacing_config(handle)
+
+        handle["rate_limiter"] = local_lib.pacing.RateLimiter(
+            rate=pacing_config.get("rate", 1.0),
+            min_rate=pacing_config.get("min_rate", 0.1),
+            max_rate=pacing_config.get("max_rate", 4.0),
+            burst=pacing_config.get("burst", 1),
+        )
+
+    return handle["rate_limiter"]
+
+
+def get_http_throttle(handle):
+    if "http_throttle" not in handle:
+        handle["http_throttle"] = local_lib.http_util.throttle(
+            get_worker_count(handle), get_rate_limiter(handle)
+        )
+
+    return handle["http_throttle"]
+
+
+def renew_http_session(handle):
+    # NOTE: ワーカーが使っている間も無くならないように，新しいセッションに入れ替えてから閉じる
+    session = create_http_session(handle)
+
+    with handle["http_lock"]:
+        old_session = handle.pop("http", None)
+        handle["http"] = session
+
+    if old_session is not None:
+        old_session.close()
+
+
+def reset_http_session(handle):
+    with handle["http_lock"]:
+        session = handle.pop("http", None)
+
+    if session is not None:
+        session.close()
+
+
+def get_order_index(handle):
+    # NOTE: codec 付きで保存した場合に item_list のセクションを起動毎に復号しないように，
+    # 索引は初めて使う時に作成する (触らなければ，保存時に元の内容をそのまま書き戻せる)
+    if "index" not in handle:
+        # NOTE: 以前の形式のキャッシュや DB から読み込んだ辞書は，省メモリな形式に変換しておく
+        handle["order"]["item_list"] = list(
+            map(store_yahoo.item_record.from_dict, handle["order"]["item_list"])
+        )
+
+        handle["index"] = store_yahoo.order_index.OrderIndex(
+            handle["order"]["item_list"], handle["order"]["year_count"]
+        )
+
+    return handle["index"]
+
+
+def update_order(handle, op, path, value=None):
+    if get_journal(handle) is not None:
+        local_lib.journal.update(get_journal(handle), handle["order"], op, path, value)
+    else:
+        local_lib.journal.apply(handle["order"], op, path, value)
+
+
 def record_item(handle, item):
-    handle["order"]["item_list"].append(item)
-    handle["order"]["order_no_stat"][item["no"]] = True
+    item = store_yahoo.item_record.from_dict(item)
+    index = get_order_index(handle)
+
+    update_order(handle, "append", ["item_list"], item)
+    update_order(handle, "set", ["order_no_stat", item["no"]], True)
+    index.add(item)
+
+
+def record_order(handle, item_list):
+    for item in item_list:
+        record_item(handle, item)
+
+    if get_db(handle) is not None:
+        store_yahoo.database.upsert_order(get_db(handle), item_list)
 
 
 def get_order_stat(handle, no):
-    return no in handle["order"]["order_no_stat"]
+    return get_order_index(handle).has_order(no)
 
 
 def get_item_list(handle):
-    return sorted(handle["order"]["item_list"], key=lambda x: x["date"])
+    return get_order_index(handle).get_item_list()
 
 
 def get_last_item(handle, year):
-    return next(filter(lambda item: item["date"].year == year, reversed(get_item_list(handle))), None)
+    return get_order_index(handle).get_last_item(year)
 
 
 def set_year_list(handle, year_list):
-    handle["order"]["year_list"] = year_list
+    update_order(handle, "set", ["year_list"], year_list)
 
 
 def get_year_list(handle):
@@ -110,14 +410,24 @@ def get_year_list(handle):
 
 
 def set_order_count(handle, year, order_count):
-    handle["order"]["year_count"][year] = order_count
+    update_order(handle, "set", ["year_count", year], order_count)
+    # NOTE: 索引を作成していない場合は，作成時に year_count から読み込まれる
+    if "index" in handle:
+        handle["index"].set_order_count(year, order_count)
+
+    if get_db(handle) is not None:
+        store_yahoo.database.set_order_count(get_db(handle), year, order_count)
+
+
+def add_order_count(handle, year, order_count):
+    set_order_count(handle, year, handle["order"]["year_count"].get(year, 0) + order_count)
 
 
 def set_page_checked(handle, year, page):
-    if year in handle["order"]["page_stat"]:
-        handle["order"]["page_stat"][year][page] = True
-    else:
-        handle["order"]["page_stat"][year] = {page: True}
+    update_order(handle, "set", ["page_stat", year, page], True)
+
+    if get_db(handle) is not None:
+        store_yahoo.database.set_page_checked(get_db(handle), year, page)
 
 
 def get_page_checked(handle, year, page):
@@ -128,7 +438,11 @@ def get_page_checked(handle, year, page):
 
 
 def set_year_checked(handle, year):
-    handle["order"]["year_stat"][year] = True
+    update_order(handle, "set", ["year_stat", year], True)
+
+    if get_db(handle) is not None:
+        store_yahoo.database.set_year_checked(get_db(handle), year)
+
     store_order_info(handle)
 
 
@@ -137,15 +451,189 @@ def get_year_checked(handle, year):
 
 
 def get_order_count(handle, year):
-    return handle["order"]["year_count"][year]
+    return get_order_index(handle).get_order_count(year)
 
 
 def get_total_order_count(handle):
-    return functools.reduce(lambda a, b: a + b, handle["order"]["year_count"].values())
+    return get_order_index(handle).get_total_order_count()
+
+
+def update_watermark(handle):
+    last_item = get_order_index(handle).get_last_item()
+    if last_item is None:
+        return
+
+    update_order(handle, "set", ["watermark"], {"no": last_item["no"], "date": last_item["date"]})
+
+
+def get_watermark(handle):
+    return handle["order"]["watermark"]
+
+
+def get_thumb_ext(content_type):
+    if content_type is None:
+        return THUMB_LEGACY_EXT
+
+    return THUMB_EXT.get(content_type.split(";")[0].strip().lower(), THUMB_LEGACY_EXT)
+
+
+def get_thumb_path(handle, item, content_type=None):
+    if content_type is None:
+        thumb_stat = get_thumb_stat(handle, item)
+        if thumb_stat is not None:
+            content_type = thumb_stat.get("content_type")
+
+    file_path = get_thumb_dir_path(handle) / (item["id"] + get_thumb_ext(content_type))
+    legacy_path = get_thumb_dir_path(handle) / (item["id"] + THUMB_LEGACY_EXT)
+
+    # NOTE: 以前の形式で保存したファイルしか無い場合は，そちらを使う
+    if (not file_path.exists()) and legacy_path.exists():
+        return legacy_path
+
+    return file_path
+
+
+def get_thumb_store(handle):
+    return handle.get("thumb_store")
+
+
+def has_thumb(handle, item):
+    if get_thumb_store(handle) is not None:
+        return local_lib.pack_store.exists(get_thumb_store(handle), item["id"])
+    else:
+        return get_thumb_path(handle, item).exists()
+
+
+def save_thumb(handle, item, buf, content_type):
+    if get_thumb_store(handle) is not None:
+        local_lib.pack_store.put(get_thumb_store(handle), item["id"], buf)
+        return
+
+    # NOTE: 取得した画像は変換せずに保存するので，拡張子は画像の形式に合わせる
+    file_path = get_thumb_dir_path(handle) / (item["id"] + get_thumb_ext(content_type))
+    legacy_path = get_thumb_dir_path(handle) / (item["id"] + THUMB_LEGACY_EXT)
+
+    local_lib.http_util.write_file(file_path, buf)
+
+    if file_path != legacy_path:
+        legacy_path.unlink(missing_ok=True)
+
+
+def get_thumb_image(handle, item):
+    # NOTE: まとめて保存している場合は，ファイルの内容を参照するスライスを返す
+    if get_thumb_store(handle) is not None:
+        return local_lib.pack_store.get(get_thumb_store(handle), item["id"])
+    else:
+        return get_thumb_path(handle, item)
+
+
+def get_thumb_size(handle, item):
+    if get_thumb_store(handle) is not None:
+        return local_lib.pack_store.get_size(get_thumb_store(handle), item["id"])
+    elif get_thumb_path(handle, item).exists():
+        return get_thumb_path(handle, item).stat().st_size
+    else:
+        return None
+
+
+def get_scaled_thumb_key(handle, item):
+    thumb_size = get_thumb_size(handle, item)
+    if thumb_size is None:
+        return None
+
+    return local_lib.scaled_image.gen_key(item["id"], thumb_size)
+
+
+def load_scaled_thumb(handle, box):
+    handle["scaled_thumb"] = local_lib.scaled_image.load(get_scaled_thumb_path(handle), box)
+    handle["scaled_thumb_box"] = box
+
+
+def build_scaled_thumb(handle, item_list, progress_func):
+    source_list = []
+    key_set = set()
+    for item in item_list:
+        key = get_scaled_thumb_key(handle, item)
+        if (key is None) or (key in key_set):
+            continue
+        key_set.add(key)
+
+        # NOTE: 縮小済みのものは元画像を読み出さない
+        if local_lib.pack_store.exists(handle["scaled_thumb"], key):
+            continue
+
+        # NOTE: 別プロセスに渡すので，まとめて保存している場合はコピーする
+        source = get_thumb_image(handle, item)
+        source_list.append((key, source if isinstance(source, pathlib.Path) else bytes(source)))
+
+    return local_lib.scaled_image.build(
+        handle["scaled_thumb"], source_list, handle["scaled_thumb_box"], progress_func=progress_func
+    )
+
+
+def get_scaled_thumb_image(handle, item):
+    key = get_scaled_thumb_key(handle, item)
+    if (key is not None) and ("scaled_thumb" in handle):
+        buf = local_lib.scaled_image.get(handle["scaled_thumb"], key)
+        if buf is not None:
+            return buf
 
+    # NOTE: 縮小できなかった場合は元の画像を使う
+    return get_thumb_image(handle, item)
 
-def get_thumb_path(handle, item):
-    return get_thumb_dir_path(handle) / (item["id"] + ".png")
+
+def get_scaled_thumb_ref(handle, item):
+    # NOTE: 別プロセスで読み出せるように，画像の内容ではなく置き場所を返す
+    key = get_scaled_thumb_key(handle, item)
+    if (key is not None) and ("scaled_thumb" in handle):
+        if local_lib.pack_store.exists(handle["scaled_thumb"], key):
+            return (get_scaled_thumb_path(handle), key)
+
+    if get_thumb_store(handle) is not None:
+        if local_lib.pack_store.exists(get_thumb_store(handle), item["id"]):
+            return (get_thumb_pack_path(handle), item["id"])
+        else:
+            return None
+    else:
+        return get_thumb_path(handle, item)
+
+
+def set_thumb_stat(handle, item, thumb_stat):
+    update_order(handle, "set", ["thumb_stat", item["id"]], thumb_stat)
+    local_lib.lru_cache.update(handle["item_cache"], item["id"], {"thumb": True})
+
+    if get_db(handle) is not None:
+        store_yahoo.database.set_thumb_stat(get_db(handle), item["id"], thumb_stat)
+
+
+def get_thumb_stat(handle, item):
+    return handle["order"]["thumb_stat"].get(item["id"])
+
+
+def get_item_meta(handle, item_id):
+    return local_lib.lru_cache.get(handle["item_cache"], item_id)
+
+
+def set_item_meta(handle, item):
+    local_lib.lru_cache.put(
+        handle["item_cache"], item["id"], {"name": item["name"], "category": item["category"], "thumb": False}
+    )
+
+
+def update_item_category(handle, item_id, category):
+    for i in get_order_index(handle).get_item_pos_list(item_id):
+        update_order(handle, "set", ["item_list", i, "category"], category)
+
+    local_lib.lru_cache.update(handle["item_cache"], item_id, {"category": category})
+
+    if get_db(handle) is not None:
+        store_yahoo.database.update_item_category(get_db(handle), item_id, category)
+
+
+def get_item_thumb_cached(handle, item):
+    item_meta = get_item_meta(handle, item["id"])
+
+    return (item_meta is not None) and item_meta["thumb"] and has_thumb(handle, item)
 
 
 def get_cache_last_modified(handle):
@@ -185,40 +673,137 @@ def set_status(handle, status, is_error=False):
 
 
 def finish(handle):
+    reset_http_session(handle)
+
+    store_item_cache(handle, True)
+
     if "selenium" in handle:
         handle["selenium"]["driver"].quit()
         handle.pop("selenium")
 
+    if get_db(handle) is not None:
+        store_yahoo.database.close(handle.pop("db"))
+
+    if get_journal(handle) is not None:
+        local_lib.journal.close(handle.pop("journal"), handle["order"])
+
+    if get_thumb_store(handle) is not None:
+        local_lib.pack_store.close(handle.pop("thumb_store"))
+
+    if "scaled_thumb" in handle:
+        local_lib.pack_store.close(handle.pop("scaled_thumb"))
+
     handle["progress_manager"].stop()
 
 
 def store_order_info(handle):
-    handle["order"]["last_modified"] = datetime.datetime.now()
+    update_order(handle, "set", ["last_modified"], datetime.datetime.now())
+
+    if get_db(handle) is not None:
+        # NOTE: 注文や各ページの状態は変更時に書き込み済みなので，ここでは確定させるだけ
+        store_yahoo.database.store_meta(get_db(handle), handle["order"])
+        store_yahoo.database.commit(get_db(handle))
+    elif get_journal(handle) is not None:
+        # NOTE: 変更はジャーナルに追記済みなので，確定させて必要ならまとめるだけ
+        local_lib.journal.store(get_journal(handle), handle["order"])
+    else:
+        local_lib.serializer.store(
+            get_caceh_file_path(handle), handle["order"], get_cache_codec(handle), ORDER_SECTION_KEY_MAP
+        )
+    store_item_cache(handle)
+    local_lib.work_queue.store(get_queue_file_path(handle), handle["work_queue"])
 
-    local_lib.serializer.store(get_caceh_file_path(handle), handle["order"])
 
+def store_item_cache(handle, is_force=False):
+    # NOTE: 商品情報のキャッシュは大きいので，変更があった場合に何回かに 1 回だけ書き出す
+    handle["item_cache_checkpoint"] = handle.get("item_cache_checkpoint", 0) + 1
+    if not local_lib.lru_cache.is_dirty(handle["item_cache"]):
+        return
+    if (not is_force) and (
+        handle["item_cache_checkpoint"] < get_item_cache_config(handle).get("store_interval", 10)
+    ):
+        return
 
-def load_order_info(handle):
-    handle["order"] = local_lib.serializer.load(
-        get_caceh_file_path(handle),
-        {
-            "year_list": [],
-            "year_count": {},
-            "year_stat": {},
-            "page_stat": {},
-            "item_list": [],
-            "order_no_stat": {},
-            "last_modified": datetime.datetime(1994, 7, 5),
-        },
+    local_lib.lru_cache.store(get_item_cache_file_path(handle), handle["item_cache"])
+    handle["item_cache_checkpoint"] = 0
+
+
+def get_work_queue(handle):
+    return handle["work_queue"]
+
+
+def load_work_queue(handle):
+    handle["work_queue"] = local_lib.work_queue.load(get_queue_file_path(handle))
+
+
+def load_thumb_store(handle):
+    if get_thumb_pack_path(handle) is None:
+        return
+
+    is_new = not get_thumb_pack_path(handle).exists()
+
+    handle["thumb_store"] = local_lib.pack_store.load(get_thumb_pack_path(handle))
+
+    # NOTE: 初回は 1 商品 1 ファイルで保存していた画像を取り込む
+    if is_new:
+        local_lib.pack_store.migrate(handle["thumb_store"], get_thumb_dir_path(handle))
+
+
+def load_item_cache(handle):
+    handle["item_cache"] = local_lib.lru_cache.load(
+        get_item_cache_file_path(handle),
+        get_item_cache_config(handle).get("size", 100000),
+        get_item_cache_config(handle).get("ttl", 180) * 24 * 60 * 60,
     )
 
+
+def load_order_db(handle, init_value):
+    db = store_yahoo.database.connect(get_db_file_path(handle))
+
+    # NOTE: 以前の形式のキャッシュがあれば，初回だけ DB に取り込む
+    if store_yahoo.database.is_empty(db) and get_caceh_file_path(handle).exists():
+        store_yahoo.database.migrate(db, get_caceh_file_path(handle), init_value)
+
+    handle["db"] = db
+    handle["order"] = store_yahoo.database.load(db, init_value)
+
+
+def load_order_info(handle):
+    init_value = {
+        "year_list": [],
+        "year_count": {},
+        "year_stat": {},
+        "page_stat": {},
+        "item_list": [],
+        "order_no_stat": {},
+        "thumb_stat": {},
+        "watermark": None,
+        "last_modified": datetime.datetime(1994, 7, 5),
+    }
+
+    if get_db_file_path(handle) is not None:
+        get_db_file_path(handle).parent.mkdir(parents=True, exist_ok=True)
+        load_order_db(handle, init_value)
+    elif is_journal_enabled(handle):
+        get_caceh_file_path(handle).parent.mkdir(parents=True, exist_ok=True)
+        handle["journal"], handle["order"] = local_lib.journal.load(get_caceh_file_path(handle), init_value)
+    else:
+        handle["order"] = local_lib.serializer.load(get_caceh_file_path(handle), init_value)
+
     # NOTE: 再開した時には巡回すべきなので削除しておく
     for year in [
         datetime.datetime.now().year,
         get_cache_last_modified(handle).year,
     ]:
         if year in handle["order"]["page_stat"]:
-            del handle["order"]["page_stat"][year]
+            update_order(handle, "delete", ["page_stat", year])
+
+            if get_db(handle) is not None:
+                store_yahoo.database.clear_page_checked(get_db(handle), year)
+
+
+def has_progress_bar(handle, desc):
+    return desc in handle["progress_bar"]
 
 
 def get_progress_bar(handle, desc):
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+購入した商品の情報を，辞書よりも少ないメモリで保持します．
+
+辞書と同じように item["name"] でアクセスできるので，SHEET_DEF 等はそのまま使えます．
+
+Usage:
+  item_record.py
+"""
+
+import collections.abc
+import sys
+
+KEY_LIST = ["name", "price", "count", "url", "id", "date", "no", "seller", "kind", "category"]
+
+# NOTE: 同じカテゴリの並びは一つのタプルを共有する
+CATEGORY_POOL = {}
+
+
+def intern_text(text):
+    # NOTE: 以前のキャッシュには None 等が入っていることがあるので，文字列以外はそのまま返す
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+def intern_category(category):
+    category = tuple(map(intern_text, category or ()))
+
+    return CATEGORY_POOL.setdefault(category, category)
+
+
+class ItemRecord:
+    __slots__ = KEY_LIST
+
+    # NOTE: 値で比較するが変更可能なので，ハッシュ化はできないようにしておく
+    __hash__ = None
+
+    def __init__(self, name, price, count, url, id, date, no, seller, kind, category=()):
+        self.name = name
+        self.price = price
+        self.count = count
+        self.url = url
+        self.id = id
+        self.date = date
+        self.no = no
+        self.seller = intern_text(seller)
+        self.kind = intern_text(kind)
+        self.category = intern_category(category)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in KEY_LIST:
+            raise KeyError(key)
+
+        if key == "category":
+            value = intern_category(value)
+        elif key in ["seller", "kind"]:
+            value = intern_text(value)
+
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        # NOTE: 辞書と同じく，値が設定されているかどうかを返す
+        return (key in KEY_LIST) and hasattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, (ItemRecord, collections.abc.Mapping)):
+            return NotImplemented
+
+        return dict(self) == dict(other)
+
+    def __repr__(self):
+        return "ItemRecord({item})".format(item=dict(self))
+
+    def __reduce__(self):
+        # NOTE: キー名を含めずに値だけを並べて保存する
+        return (ItemRecord, tuple(getattr(self, key) for key in KEY_LIST))
+
+    def keys(self):
+        return [key for key in KEY_LIST if key in self]
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+
+def from_dict(item):
+    if isinstance(item, ItemRecord):
+        return item
+
+    return ItemRecord(**{key: item[key] for key in KEY_LIST if key in item})
+
+
+if __name__ == "__main__":
+    import datetime
+    import logging
+    import pickle
+
+    from docopt import docopt
+
+    import local_lib.logger
+    import store_yahoo.order_history
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    item = {
+        "name": "商品",
+        "price": 1000,
+        "count": 2,
+        "url": "https://store.shopping.yahoo.co.jp/store/item.html",
+        "id": "store_item",
+        "date": datetime.datetime(2024, 1, 1, 12, 0),
+        "no": "store-10000001",
+        "seller": "ストア",
+        "kind": "normal",
+        "category": ["食品", "お菓子"],
+    }
+
+    record_list = [from_dict(item | {"category": list(item["category"])}) for _ in range(1000)]
+    record = record_list[0]
+
+    assert record["price"] == 1000
+    assert record["category"][1] == "お菓子"
+    assert record_list[1]["category"] is record["category"]
+    assert ("optional" not in record) and ("url" in record)
+    assert dict(record)["no"] == item["no"]
+
+    record["category"] = ["日用品"]
+    assert record["category"] == ("日用品",)
+
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert (record != None) and (record != "商品") and (record == dict(record))
+
+    del record.kind
+    assert ("kind" not in record) and (record.get("kind", "none") == "none")
+    assert "kind" not in dict(record)
+
+    record = from_dict(item | {"seller": None, "kind": None, "category": None})
+    assert (record["seller"] is None) and (record["category"] == ())
+
+    part_map = store_yahoo.order_history.gen_part_map([record, from_dict(item), record], "seller")
+    assert list(part_map.keys()) == ["ストア", None]
+    assert len(part_map[None]) == 2
+
+    logging.info("OK")
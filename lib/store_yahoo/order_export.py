@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Yahoo!ストアの購入履歴情報を CSV，JSON Lines，Parquet のいずれかの形式で書き出します．
+
+商品を一つずつ (Parquet の場合は BATCH_SIZE 毎に) 書き出すので，商品数が増えてもメモリは増えません．
+
+Usage:
+  order_export.py [-c CONFIG] [-f FORMAT] [-o FILE]
+
+Options:
+  -c CONFIG     : CONFIG を設定ファイルとして読み込んで実行します．[default: config.yaml]
+  -f FORMAT     : 出力形式 (csv, jsonl, parquet) を指定します．[default: csv]
+  -o FILE       : 生成するファイルを指定します．省略時はエクセルファイルの拡張子を変えたものになります．
+"""
+
+import csv
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import store_yahoo.handle
+
+STATUS_EXPORT_ITEM = "[export] Export item"
+STATUS_ALL = "[export] Export file"
+
+BATCH_SIZE = 10000
+CATEGORY_SEP = " > "
+
+COLUMN_LIST = ["date", "no", "name", "count", "price", "seller", "category", "id", "url", "kind"]
+LIST_COLUMN_LIST = ["category"]
+
+
+def get_item_value(item, key):
+    # NOTE: 無い項目は，リストの列は空のリスト，それ以外は None にする
+    value = item.get(key)
+    if key in LIST_COLUMN_LIST:
+        return list(value or ())
+    else:
+        return value
+
+
+def conv_csv_value(key, value):
+    if key in LIST_COLUMN_LIST:
+        return CATEGORY_SEP.join(map(str, value))
+    elif value is None:
+        return ""
+    elif key == "date":
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        return value
+
+
+def conv_json_value(key, value):
+    if (key == "date") and (value is not None):
+        return value.isoformat()
+    else:
+        return value
+
+
+def export_csv(file_path, item_list, progress_func):
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMN_LIST)
+
+        for item in item_list:
+            writer.writerow([conv_csv_value(key, get_item_value(item, key)) for key in COLUMN_LIST])
+            progress_func(1)
+
+
+def export_jsonl(file_path, item_list, progress_func):
+    with open(file_path, "w", encoding="utf-8") as f:
+        for item in item_list:
+            f.write(
+                json.dumps(
+                    {key: conv_json_value(key, get_item_value(item, key)) for key in COLUMN_LIST},
+                    ensure_ascii=False,
+                )
+            )
+            f.write("\n")
+            progress_func(1)
+
+
+def gen_parquet_schema():
+    dict_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+    # NOTE: 値の種類が少ない列は辞書符号化して，ファイルを小さく，読み込みを速くする
+    return pyarrow.schema(
+        [
+            ("date", pyarrow.timestamp("ms")),
+            ("no", pyarrow.string()),
+            ("name", pyarrow.string()),
+            ("count", pyarrow.int32()),
+            ("price", pyarrow.int64()),
+            ("seller", dict_type),
+            ("category", pyarrow.list_(dict_type)),
+            ("id", pyarrow.string()),
+            ("url", pyarrow.string()),
+            ("kind", dict_type),
+        ]
+    )
+
+
+def gen_parquet_batch(item_list, schema):
+    return pyarrow.record_batch(
+        [
+            pyarrow.array(
+                [get_item_value(item, key) for item in item_list],
+                type=schema.field(key).type,
+            )
+            for key in COLUMN_LIST
+        ],
+        schema=schema,
+    )
+
+
+def export_parquet(file_path, item_list, progress_func):
+    if pyarrow is None:
+        raise RuntimeError("Parquet 形式で書き出すには pyarrow をインストールしてください．")
+
+    schema = gen_parquet_schema()
+    with pyarrow.parquet.ParquetWriter(file_path, schema, compression="zstd") as writer:
+        for i in range(0, len(item_list), BATCH_SIZE):
+            batch = item_list[i : i + BATCH_SIZE]
+            writer.write_batch(gen_parquet_batch(batch, schema))
+            progress_func(len(batch))
+
+
+EXPORT_DEF = {
+    "csv": {"suffix": ".csv", "func": export_csv},
+    "jsonl": {"suffix": ".jsonl", "func": export_jsonl},
+    "parquet": {"suffix": ".parquet", "func": export_parquet},
+}
+
+
+def get_export_file_path(handle, export_format):
+    return store_yahoo.handle.get_export_file_path(handle, EXPORT_DEF[export_format]["suffix"])
+
+
+def write_table(file_path, item_list, export_format, progress_func=lambda count: None):
+    file_path = pathlib.Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # NOTE: 書き出し中のファイルを読まれないように，一時ファイルに書いてから置き換える
+    f = tempfile.NamedTemporaryFile(dir=str(file_path.parent), delete=False)
+    f.close()
+
+    try:
+        EXPORT_DEF[export_format]["func"](f.name, item_list, progress_func)
+        os.replace(f.name, file_path)
+    except:
+        os.unlink(f.name)
+        raise
+
+
+def generate_table_export(handle, export_format, file_path=None):
+    if export_format not in EXPORT_DEF:
+        raise ValueError("Unknown export format: {export_format}".format(export_format=export_format))
+
+    if file_path is None:
+        file_path = get_export_file_path(handle, export_format)
+
+    store_yahoo.handle.set_status(handle, "ファイルの書き出しを開始します...")
+    store_yahoo.handle.set_progress_bar(handle, STATUS_ALL, 2)
+
+    logging.info("Start to export {export_format} file".format(export_format=export_format))
+
+    item_list = store_yahoo.handle.get_item_list(handle)
+
+    store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update()
+
+    store_yahoo.handle.set_status(handle, "購入商品を書き出しています...")
+    store_yahoo.handle.set_progress_bar(handle, STATUS_EXPORT_ITEM, len(item_list))
+
+    write_table(
+        file_path,
+        item_list,
+        export_format,
+        lambda count: store_yahoo.handle.get_progress_bar(handle, STATUS_EXPORT_ITEM).update(count),
+    )
+
+    store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update()
+
+    store_yahoo.handle.set_status(handle, "完了しました！")
+
+    logging.info("Complete to export {file_path}".format(file_path=file_path))
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    import local_lib.logger
+    import local_lib.config
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    config = local_lib.config.load(args["-c"])
+    export_format = args["-f"]
+    file_path = args["-o"]
+
+    handle = store_yahoo.handle.create(config)
+
+    generate_table_export(handle, export_format, file_path)
+
+    store_yahoo.handle.finish(handle)
@@ -12,7 +12,14 @@ Options:
   -N            : サムネイル画像を含めないようにします．
 """
 
+import concurrent.futures
+import functools
+import hashlib
 import logging
+import os
+import pathlib
+import re
+import traceback
 
 import openpyxl
 import openpyxl.utils
@@ -22,9 +29,12 @@ import openpyxl.drawing.xdr
 import openpyxl.drawing.spreadsheet_drawing
 
 import local_lib.openpyxl_util
+import local_lib.pack_store
+import local_lib.xlsx_append
 import store_yahoo.handle
 import store_yahoo.crawler
 
+STATUS_SCALE_THUMB = "[generate] Scale thumbnail"
 STATUS_INSERT_ITEM = "[generate] Insert item"
 STATUS_ALL = "[generate] Excel file"
 
@@ -110,46 +120,365 @@ SHEET_DEF = {
 }
 
 
-def generate_sheet(handle, book, is_need_thumb=True):
-    item_list = store_yahoo.handle.get_item_list(handle)
+INDEX_SHEET_DEF = {
+    "SHEET_TITLE": "【{shop_name}】購入履歴".format(shop_name=SHOP_NAME),
+    "TABLE_HEADER": {
+        "row": {
+            "pos": 2,
+        },
+        "col": {
+            "label": {
+                "label": "区分",
+                "pos": 2,
+                "width": 15,
+                "format": "@",
+            },
+            "count": {
+                "label": "商品数",
+                "pos": 3,
+                "width": 10,
+                "format": "0_ ",
+            },
+            "price": {
+                "label": "合計金額",
+                "pos": 4,
+                "width": 18,
+                "format": SHEET_DEF["TABLE_HEADER"]["col"]["price"]["format"],
+            },
+            "file": {
+                "label": "ファイル",
+                "pos": 5,
+                "width": 40,
+                "format": "@",
+                "link_func": lambda part: part["file"],
+            },
+        },
+    },
+}
+
+SPLIT_KEY_FUNC = {
+    "year": lambda item: item["date"].year,
+    "seller": lambda item: item["seller"],
+}
+
 
+def prepare_thumb(handle, item_list):
+    # NOTE: 画像は画像列のセルに収まる大きさに縮小したものを使う
+    store_yahoo.handle.load_scaled_thumb(
+        handle,
+        local_lib.openpyxl_util.get_cell_content_size(
+            SHEET_DEF["TABLE_HEADER"]["col"]["image"]["width"],
+            SHEET_DEF["TABLE_HEADER"]["row"]["height"]["default"],
+        ),
+    )
+
+    store_yahoo.handle.set_status(handle, "サムネイル画像を縮小しています...")
+    store_yahoo.handle.set_progress_bar(handle, STATUS_SCALE_THUMB, None)
+
+    store_yahoo.handle.build_scaled_thumb(
+        handle, item_list, lambda: store_yahoo.handle.get_progress_bar(handle, STATUS_SCALE_THUMB).update()
+    )
+
+
+def generate_sheet(handle, book, item_list, is_need_thumb=True, row_start=None, image_map=None):
     store_yahoo.handle.set_progress_bar(handle, STATUS_INSERT_ITEM, len(item_list))
 
-    local_lib.openpyxl_util.generate_list_sheet(
+    if book.write_only:
+        generate_list_sheet = functools.partial(
+            local_lib.openpyxl_util.generate_list_sheet_stream, row_start=row_start, image_map=image_map
+        )
+    else:
+        generate_list_sheet = local_lib.openpyxl_util.generate_list_sheet
+
+    generate_list_sheet(
         book,
         item_list,
         SHEET_DEF,
         is_need_thumb,
-        lambda item: store_yahoo.handle.get_thumb_path(handle, item),
+        lambda item: store_yahoo.handle.get_scaled_thumb_image(handle, item),
         lambda status: store_yahoo.handle.set_status(handle, status),
         lambda: store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update(),
         lambda: store_yahoo.handle.get_progress_bar(handle, STATUS_INSERT_ITEM).update(),
     )
 
 
-def generate_table_excel(handle, excel_file, is_need_thumb=True):
-    store_yahoo.handle.set_status(handle, "エクセルファイルの作成を開始します...")
-    store_yahoo.handle.set_progress_bar(handle, STATUS_ALL, 5)
+def create_book(handle, is_write_only):
+    # NOTE: write_only の場合は，行を追加した時点で書き出してメモリに残さない
+    book = openpyxl.Workbook(write_only=is_write_only)
+    book._named_styles["Normal"].font = store_yahoo.handle.get_excel_font(handle)
 
-    logging.info("Start to Generate excel file")
+    return book
 
-    book = openpyxl.Workbook()
-    book._named_styles["Normal"].font = store_yahoo.handle.get_excel_font(handle)
+
+def write_table_excel(handle, excel_file, item_list, is_need_thumb, is_write_only, row_start=None):
+    book = create_book(handle, is_write_only)
+    image_map = {}
 
     store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update()
 
-    generate_sheet(handle, book, is_need_thumb)
+    generate_sheet(handle, book, item_list, is_need_thumb, row_start, image_map)
 
-    book.remove(book.worksheets[0])
+    if not book.write_only:
+        book.remove(book.worksheets[0])
 
     store_yahoo.handle.set_status(handle, "エクセルファイルを書き出しています...")
 
-    book.save(excel_file)
+    local_lib.openpyxl_util.save_book(book, excel_file)
 
     store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update()
 
     book.close()
 
+    # NOTE: 追記時に使い回せるように，埋め込んだ画像のパスを返す
+    return {share_key: img.path for share_key, img in image_map.items()}
+
+
+def gen_thumb_digest_key(thumb_ref):
+    # NOTE: 全ての画像を読み出すと追記の意味が薄れるので，置き場所とサイズで区別する．
+    # まとめたファイル中の画像のキーには，元画像のサイズが含まれている．
+    if thumb_ref is None:
+        return None
+    elif isinstance(thumb_ref, pathlib.Path):
+        return (str(thumb_ref), thumb_ref.stat().st_size if thumb_ref.exists() else None)
+    else:
+        file_path, key = thumb_ref
+        return (str(file_path), key)
+
+
+def gen_item_digest_list(handle, item_list, is_need_thumb):
+    book = create_book(handle, True)
+    column_def = local_lib.openpyxl_util.compile_sheet_def(
+        book, SHEET_DEF, local_lib.openpyxl_util.gen_base_style(), is_need_thumb
+    )
+
+    return [
+        local_lib.openpyxl_util.gen_item_digest(
+            item,
+            column_def,
+            (
+                gen_thumb_digest_key(store_yahoo.handle.get_scaled_thumb_ref(handle, item))
+                if is_need_thumb
+                else None
+            ),
+        )
+        for item in item_list
+    ]
+
+
+def append_table_excel(handle, excel_file, item_list, is_need_thumb):
+    excel_file = pathlib.Path(excel_file)
+
+    digest = local_lib.openpyxl_util.gen_sheet_def_digest(
+        SHEET_DEF, is_need_thumb, store_yahoo.handle.get_excel_font(handle)
+    )
+    item_digest_list = gen_item_digest_list(handle, item_list, is_need_thumb)
+
+    manifest = local_lib.xlsx_append.load_manifest(excel_file, digest)
+    pos = None if manifest is None else local_lib.xlsx_append.get_append_pos(manifest, item_digest_list)
+
+    if pos == len(item_list):
+        logging.info("No item to append")
+        return
+    elif pos is not None:
+        row_start = manifest["row_last"] + 1
+        row_last = row_start + len(item_list) - pos - 1
+        delta_file = excel_file.with_name(excel_file.stem + ".delta" + excel_file.suffix)
+
+        logging.info("Append {count} items".format(count=len(item_list) - pos))
+
+        try:
+            delta_image_map = write_table_excel(
+                handle, delta_file, item_list[pos:], is_need_thumb, True, row_start
+            )
+            image_path_map = manifest["image"]
+            local_lib.xlsx_append.append(
+                excel_file,
+                delta_file,
+                row_start,
+                row_last,
+                {path: share_key for share_key, path in delta_image_map.items()},
+                image_path_map,
+            )
+            local_lib.xlsx_append.store_manifest(
+                excel_file, digest, item_digest_list, row_last, image_path_map
+            )
+            return
+        except (ValueError, KeyError):
+            logging.warning(traceback.format_exc())
+        finally:
+            delta_file.unlink(missing_ok=True)
+
+    # NOTE: 追記できない場合は，全体を作り直す
+    logging.info("Rebuild whole excel file")
+
+    image_path_map = write_table_excel(handle, excel_file, item_list, is_need_thumb, True)
+    local_lib.xlsx_append.store_manifest(
+        excel_file,
+        digest,
+        item_digest_list,
+        SHEET_DEF["TABLE_HEADER"]["row"]["pos"] + len(item_list),
+        image_path_map,
+    )
+
+
+def gen_part_map(item_list, split_key):
+    part_map = {}
+    for item in item_list:
+        part_map.setdefault(SPLIT_KEY_FUNC[split_key](item), []).append(item)
+
+    # NOTE: 以前のキャッシュにはストアが None の商品があるので，None は末尾に並べる
+    return dict(sorted(part_map.items(), key=lambda kv: (kv[0] is None, "" if kv[0] is None else kv[0])))
+
+
+def get_part_file_path(excel_file, label, name_set):
+    name = re.sub(r'[\\/:*?"<>|\s]', "_", str(label))
+
+    # NOTE: 記号を置き換えると別の区分と同じ名前になることがあるので，その場合は元の名前のハッシュを付ける．
+    # Windows ではファイル名の大文字と小文字を区別しないので，小文字にして比較する．
+    if name.lower() in name_set:
+        name = "{name}_{hash}".format(
+            name=name, hash=hashlib.sha1(str(label).encode("utf-8")).hexdigest()[:8]
+        )
+    name_set.add(name.lower())
+
+    return excel_file.with_name(
+        "{stem}_{name}{suffix}".format(stem=excel_file.stem, name=name, suffix=excel_file.suffix)
+    )
+
+
+def load_part_thumb(thumb_ref, store_map):
+    if (thumb_ref is None) or isinstance(thumb_ref, pathlib.Path):
+        return thumb_ref
+
+    file_path, key = thumb_ref
+    if file_path not in store_map:
+        store_map[file_path] = local_lib.pack_store.load(file_path, read_only=True)
+
+    return local_lib.pack_store.get(store_map[file_path], key)
+
+
+def generate_part_excel(excel_file, item_list, thumb_ref_list, is_need_thumb, font):
+    # NOTE: 別プロセスで実行されるので，handle は使わずに必要なものは引数で受け取る
+    store_map = {}
+    thumb_ref_map = {id(item): thumb_ref for item, thumb_ref in zip(item_list, thumb_ref_list)}
+
+    book = openpyxl.Workbook(write_only=True)
+    book._named_styles["Normal"].font = font
+
+    local_lib.openpyxl_util.generate_list_sheet_stream(
+        book,
+        item_list,
+        SHEET_DEF,
+        is_need_thumb,
+        lambda item: load_part_thumb(thumb_ref_map[id(item)], store_map),
+        lambda status: None,
+        lambda: None,
+        lambda: None,
+    )
+
+    local_lib.openpyxl_util.save_book(book, excel_file)
+    book.close()
+
+    for store in store_map.values():
+        local_lib.pack_store.close(store)
+
+    return len(item_list)
+
+
+def generate_index_sheet(book, part_list):
+    sheet = book.create_sheet()
+    sheet.title = "{label}ファイル一覧".format(label=INDEX_SHEET_DEF["SHEET_TITLE"])
+
+    base_style = local_lib.openpyxl_util.gen_base_style()
+
+    row = INDEX_SHEET_DEF["TABLE_HEADER"]["row"]["pos"]
+    local_lib.openpyxl_util.insert_table_header(sheet, row, INDEX_SHEET_DEF, base_style)
+
+    column_def = local_lib.openpyxl_util.compile_sheet_def(book, INDEX_SHEET_DEF, base_style, False)
+    for part in part_list:
+        row += 1
+        local_lib.openpyxl_util.insert_table_item(sheet, row, part, None, column_def)
+
+    sheet.freeze_panes = local_lib.openpyxl_util.gen_text_pos(
+        INDEX_SHEET_DEF["TABLE_HEADER"]["row"]["pos"] + 1, 1
+    )
+    sheet.sheet_view.showGridLines = False
+
+
+def generate_split_excel(handle, excel_file, item_list, is_need_thumb):
+    excel_file = pathlib.Path(excel_file)
+    split_config = store_yahoo.handle.get_excel_split_config(handle)
+
+    part_map = gen_part_map(item_list, split_config.get("key", "year"))
+
+    store_yahoo.handle.set_status(handle, "エクセルファイルを分割して作成しています...")
+    store_yahoo.handle.set_progress_bar(handle, STATUS_INSERT_ITEM, len(item_list))
+
+    part_list = []
+    name_set = set()
+    # NOTE: セルの書き込みや画像の読み込みは CPU を使うので，分割した単位毎にプロセスを分けて並列に処理する
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=split_config.get("worker", os.cpu_count())
+    ) as executor:
+        future_map = {}
+        for label, part_item_list in part_map.items():
+            part_file = get_part_file_path(excel_file, label, name_set)
+
+            future = executor.submit(
+                generate_part_excel,
+                part_file,
+                part_item_list,
+                [
+                    store_yahoo.handle.get_scaled_thumb_ref(handle, item) if is_need_thumb else None
+                    for item in part_item_list
+                ],
+                is_need_thumb,
+                store_yahoo.handle.get_excel_font(handle),
+            )
+            future_map[future] = part_file
+
+            part_list.append(
+                {
+                    "label": str(label),
+                    "count": len(part_item_list),
+                    "price": sum(map(lambda item: item["price"] * item["count"], part_item_list)),
+                    "file": part_file.name,
+                }
+            )
+
+        for future in concurrent.futures.as_completed(future_map):
+            store_yahoo.handle.get_progress_bar(handle, STATUS_INSERT_ITEM).update(future.result())
+            logging.info("Generate {part_file}".format(part_file=future_map[future]))
+
+    store_yahoo.handle.set_status(handle, "一覧のエクセルファイルを書き出しています...")
+
+    book = create_book(handle, False)
+    generate_index_sheet(book, part_list)
+    book.remove(book.worksheets[0])
+
+    local_lib.openpyxl_util.save_book(book, excel_file)
+    book.close()
+
+
+def generate_table_excel(handle, excel_file, is_need_thumb=True):
+    store_yahoo.handle.set_status(handle, "エクセルファイルの作成を開始します...")
+    store_yahoo.handle.set_progress_bar(handle, STATUS_ALL, 5)
+
+    logging.info("Start to Generate excel file")
+
+    item_list = store_yahoo.handle.get_item_list(handle)
+
+    if is_need_thumb:
+        prepare_thumb(handle, item_list)
+
+    mode = store_yahoo.handle.get_excel_mode(handle)
+    if mode == "incremental":
+        append_table_excel(handle, excel_file, item_list, is_need_thumb)
+    elif mode == "split":
+        generate_split_excel(handle, excel_file, item_list, is_need_thumb)
+    else:
+        write_table_excel(handle, excel_file, item_list, is_need_thumb, mode == "stream")
+
     store_yahoo.handle.get_progress_bar(handle, STATUS_ALL).update()
 
     store_yahoo.handle.set_status(handle, "完了しました！")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+収集した商品を日付順に保持し，年毎・注文番号毎に引けるようにします．
+
+Usage:
+  order_index.py
+"""
+
+import bisect
+
+
+def get_date(item):
+    return item["date"]
+
+
+class SortedBucket:
+    # NOTE: 同じ日付の場合は登録順になるように，末尾側に挿入する (sorted と同じ順序)
+    def __init__(self, item_list=[]):
+        # NOTE: 最初にまとめて登録する分は，一つずつ挿入せずに一度だけ並べ替える
+        self.item_list = sorted(item_list, key=get_date)
+
+    def add(self, item):
+        bisect.insort_right(self.item_list, item, key=get_date)
+
+    def last(self):
+        return self.item_list[-1] if len(self.item_list) != 0 else None
+
+
+class OrderIndex:
+    def __init__(self, item_list=[], year_count={}):
+        self.order_map = {}
+        self.id_map = {}
+        self.item_count = 0
+
+        self.year_count = {}
+        self.total_order_count = 0
+
+        year_item_list = {}
+        for item in item_list:
+            year_item_list.setdefault(item["date"].year, []).append(item)
+            self.add_map(item)
+
+        self.all = SortedBucket(item_list)
+        self.year_bucket = {year: SortedBucket(item_list) for year, item_list in year_item_list.items()}
+
+        for year, order_count in year_count.items():
+            self.set_order_count(year, order_count)
+
+    def add(self, item):
+        self.all.add(item)
+
+        year = item["date"].year
+        if year not in self.year_bucket:
+            self.year_bucket[year] = SortedBucket()
+        self.year_bucket[year].add(item)
+        self.add_map(item)
+
+    def add_map(self, item):
+        self.order_map.setdefault(item["no"], []).append(item)
+
+        # NOTE: item_list 中の位置も覚えておき，ジャーナルでの更新に使う
+        self.id_map.setdefault(item["id"], []).append(self.item_count)
+
+        self.item_count += 1
+
+    # NOTE: 呼び出し側で変更されても索引が壊れないように，コピーを返す
+    def get_item_list(self):
+        return list(self.all.item_list)
+
+    def get_year_item_list(self, year):
+        return list(self.year_bucket[year].item_list) if year in self.year_bucket else []
+
+    def get_last_item(self, year=None):
+        if year is None:
+            return self.all.last()
+
+        return self.year_bucket[year].last() if year in self.year_bucket else None
+
+    def has_order(self, no):
+        return no in self.order_map
+
+    def get_order_item_list(self, no):
+        return self.order_map.get(no, [])
+
+    def get_item_pos_list(self, item_id):
+        return self.id_map.get(item_id, [])
+
+    def set_order_count(self, year, order_count):
+        self.total_order_count += order_count - self.year_count.get(year, 0)
+        self.year_count[year] = order_count
+
+    def get_order_count(self, year):
+        return self.year_count[year]
+
+    def get_total_order_count(self):
+        return self.total_order_count
+
+
+if __name__ == "__main__":
+    import datetime
+    import logging
+    import random
+
+    from docopt import docopt
+
+    import local_lib.logger
+
+    args = docopt(__doc__)
+
+    local_lib.logger.init("test", level=logging.INFO)
+
+    item_list = [
+        {
+            "no": "order-{no}".format(no=i // 3),
+            "id": "item-{id}".format(id=i % 7),
+            "date": datetime.datetime(2020, 1, 1) + datetime.timedelta(days=random.randint(0, 1000)),
+            "price": 100,
+            "count": 1,
+        }
+        for i in range(300)
+    ]
+
+    index = OrderIndex(item_list[:100], {2020: 10, 2021: 20})
+    for item in item_list[100:]:
+        index.add(item)
+    index.set_order_count(2020, 15)
+
+    assert index.get_item_list() == sorted(item_list, key=lambda x: x["date"])
+    for year in [2020, 2021, 2022]:
+        assert index.get_last_item(year) == next(
+            filter(lambda item: item["date"].year == year, reversed(index.get_item_list()))
+        )
+    assert index.get_last_item(2019) is None
+    assert len(index.get_order_item_list("order-0")) == 3
+    assert index.get_item_pos_list("item-0")[:2] == [0, 7]
+    assert index.get_total_order_count() == 35
+
+    logging.info("OK")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Yahoo!ストアの注文履歴ページの HTML を解析します．
+
+Usage:
+  parser.py (list|order|item) HTML
+
+Options:
+  HTML          : driver.page_source や dump_page で保存した HTML ファイル．
+"""
+
+import datetime
+import re
+import urllib.parse
+
+import lxml.etree
+import lxml.html
+
+BASE_URL = "https://odhistory.shopping.yahoo.co.jp/"
+
+# NOTE: 要素を何度も探索するので，XPath は事前にコンパイルしておく
+XPATH_ORDER_DATE = lxml.etree.XPath('//li[contains(@class, "elOrderItem")]')
+XPATH_ORDER_DATE_TEXT = lxml.etree.XPath('.//p[contains(@class, "elDate")]/span')
+XPATH_ORDER = lxml.etree.XPath('.//li[contains(@class, "elItemList")]')
+XPATH_ORDER_BUTTON = lxml.etree.XPath(
+    './/div[contains(@class, "elControl")]/p[contains(@class,"elButton")]/a'
+)
+XPATH_ORDER_NO = lxml.etree.XPath('.//dd[contains(@class, "elOrderData")]')
+XPATH_ORDER_SELLER = lxml.etree.XPath(
+    './/div[contains(@class, "elStoreInfo")]/p[contains(@class, "elName")]/a/span'
+)
+XPATH_ORDER_COUNT = lxml.etree.XPath(
+    '//h2[contains(@class, "elResultCount")]/span[contains(@class, "elCount")]'
+)
+XPATH_YEAR = lxml.etree.XPath('//select[@id="year"]/option[contains(@value, "20")]')
+
+XPATH_ORDER_DATETIME = lxml.etree.XPath('//div[contains(@class, "elOrderInfo")]/p[@class="elOrderDate"]')
+XPATH_ITEM = lxml.etree.XPath(
+    '//div[contains(@class, "mdOrderItem")]/div[contains(@class, "elItem")]/ul[contains(@class, "elList")]/li'
+)
+XPATH_ITEM_LINK = lxml.etree.XPath('.//dl[contains(@class, "elDetail")]/dd[contains(@class, "elName")]/a')
+XPATH_ITEM_PRICE = lxml.etree.XPath('.//dd[contains(@class, "elInfo")]/span[@class="elPrice"]')
+XPATH_ITEM_COUNT = lxml.etree.XPath('.//dd[contains(@class, "elInfo")]/span[@class="elNum"]')
+XPATH_ITEM_IMAGE = lxml.etree.XPath(
+    './/dl[contains(@class, "elDetail")]/dt[contains(@class, "elImage")]/a/img'
+)
+
+XPATH_BREADCRUMB = lxml.etree.XPath('//div[contains(@id, "bclst")]/ol/li')
+XPATH_LOGIN_BUTTON = lxml.etree.XPath(
+    '//p[contains(@class, "elButton")]/a/span[contains(text(), "ログイン")]'
+)
+
+
+def parse_date(date_text):
+    return datetime.datetime.strptime(date_text, "%Y年%m月%d日")
+
+
+def parse_datetime(datetime_text):
+    return datetime.datetime.strptime(datetime_text, "%Y年%m月%d日 %H:%M")
+
+
+def parse_order_datetime(datetime_label):
+    return parse_datetime(re.match(r".*日時：(.*)", datetime_label).group(1))
+
+
+def parse_price(price_text):
+    return int(re.match(r".*?(\d{1,3}(?:,\d{3})*)", price_text).group(1).replace(",", ""))
+
+
+def parse_count(count_text):
+    return int(re.match(r"\D+(\d+)", count_text).group(1))
+
+
+def parse_order_kind(kind_text):
+    if re.match(r"寄付詳細", kind_text):
+        return "tax"
+    else:
+        return "normal"
+
+
+def gen_item_id_from_url(url):
+    m = re.match(r"https://store.shopping.yahoo.co.jp/([^/]+)/([^.]+).html", url)
+
+    return "{store_id}_{item_id}".format(store_id=m.group(1), item_id=m.group(2))
+
+
+def build_item(item_info):
+    return {
+        "name": item_info["name"],
+        "price": parse_price(item_info["price_text"]),
+        "count": parse_count(item_info["count_text"]),
+        "url": item_info["url"],
+        "id": gen_item_id_from_url(item_info["url"]),
+    }
+
+
+def get_text(elem):
+    # NOTE: Selenium の .text に合わせて，前後の空白を除去する
+    return elem.text_content().strip()
+
+
+def get_first(elem_list):
+    if len(elem_list) == 0:
+        raise ValueError("Element is not found")
+    return elem_list[0]
+
+
+def load_html(html, base_url=BASE_URL):
+    return lxml.html.fromstring(html, base_url=base_url)
+
+
+def is_login_required(html):
+    return len(XPATH_LOGIN_BUTTON(load_html(html))) != 0
+
+
+def parse_year_list(html):
+    return list(sorted(map(lambda elem: int(elem.get("value")), XPATH_YEAR(load_html(html)))))
+
+
+def parse_order_count(html):
+    return int(get_text(get_first(XPATH_ORDER_COUNT(load_html(html)))))
+
+
+def parse_order_list(html, base_url=BASE_URL):
+    root = load_html(html, base_url)
+
+    order_list = []
+    for date_elem in XPATH_ORDER_DATE(root):
+        date = parse_date(get_text(get_first(XPATH_ORDER_DATE_TEXT(date_elem))))
+
+        for order_elem in XPATH_ORDER(date_elem):
+            button = get_first(XPATH_ORDER_BUTTON(order_elem))
+
+            order_list.append(
+                {
+                    "date": date,
+                    "seller": get_text(get_first(XPATH_ORDER_SELLER(order_elem))),
+                    "no": get_text(get_first(XPATH_ORDER_NO(order_elem))),
+                    "kind": parse_order_kind(get_text(get_first(button.xpath("./span")))),
+                    "onclick": button.get("onclick"),
+                }
+            )
+
+    return order_list
+
+
+def parse_order_date(html):
+    return parse_order_datetime(get_text(get_first(XPATH_ORDER_DATETIME(load_html(html)))))
+
+
+def parse_item_list(html, base_url=BASE_URL):
+    root = load_html(html, base_url)
+
+    item_list = []
+    for item_elem in XPATH_ITEM(root):
+        link = get_first(XPATH_ITEM_LINK(item_elem))
+
+        item_list.append(
+            {
+                "name": get_text(get_first(link.xpath("./span"))),
+                "url": urllib.parse.urljoin(base_url, link.get("href")),
+                "price_text": get_text(get_first(XPATH_ITEM_PRICE(item_elem))),
+                "count_text": get_text(get_first(XPATH_ITEM_COUNT(item_elem))),
+                "thumb_url": urllib.parse.urljoin(
+                    base_url, get_first(XPATH_ITEM_IMAGE(item_elem)).get("src")
+                ),
+            }
+        )
+
+    return item_list
+
+
+def parse_order(html, order_info, base_url=BASE_URL):
+    item_base = {
+        "date": parse_order_date(html),
+        "no": order_info["no"],
+        "seller": order_info["seller"],
+        "kind": order_info["kind"],
+    }
+
+    return list(map(lambda item_info: build_item(item_info) | item_base, parse_item_list(html, base_url)))
+
+
+def parse_item_category(html):
+    category = list(map(get_text, XPATH_BREADCRUMB(load_html(html))))
+
+    if len(category) >= 2:
+        category.pop(0)
+        category.pop(-1)
+
+    return category
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+    import pprint
+
+    args = docopt(__doc__)
+
+    with open(args["HTML"], "r", encoding="utf-8") as f:
+        html = f.read()
+
+    if args["list"]:
+        pprint.pprint(parse_order_list(html))
+    elif args["order"]:
+        pprint.pprint({"date": parse_order_date(html), "item_list": parse_item_list(html)})
+    else:
+        pprint.pprint(parse_item_category(html))